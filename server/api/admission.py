@@ -0,0 +1,189 @@
+import threading
+from functools import wraps
+from typing import Dict, Optional, Tuple
+
+from flask import current_app, g, jsonify, make_response
+from flask_jwt_extended import get_jwt_identity
+
+from models.db import Document
+from services.cache.artifact_cache import ArtifactCache
+
+COST_CLASSES = ('light', 'medium', 'heavy')
+
+# Cost units per page of each operation type
+OPERATION_WEIGHTS = {
+    'text': 1,             # Text extraction and streaming
+    'forms': 1,            # Form field index
+    'images': 4,           # Image extraction (decodes every image)
+    'page_operation': 2,   # Rewrites the file (select, move, delete, fill, annotation export and commit)
+    'diff': 2,             # Text and page hashes of two versions (raster renders their changed pages)
+    'stamp': 3,            # Rewrites every stamped page
+    'split': 2             # Writes one new file per part
+}
+
+class AdmissionController:
+    """
+    Concurrency budgets per cost class, globally and per user, for one process
+
+    A limit of 0 means unlimited. Requests over budget are rejected rather
+    than queued, so a burst of expensive work cannot pile up behind the
+    worker threads and delay cheap requests.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]]):
+        """
+        Args:
+            limits: Cost class -> (global limit, per-user limit)
+        """
+        self.limits = limits
+        self._in_flight = {cost_class: 0 for cost_class in COST_CLASSES}
+        self._per_user = {}
+        self._counters = {cost_class: {'admitted': 0, 'rejected_user': 0, 'rejected_global': 0, 'background': 0}
+                          for cost_class in COST_CLASSES}
+        self._lock = threading.Lock()
+
+    def try_acquire(self, user_id, cost_class: str) -> Optional[str]:
+        """
+        Take a slot of a cost class
+
+        Returns:
+            None if admitted, otherwise 'user' or 'global' for the exhausted budget
+        """
+        global_limit, user_limit = self.limits.get(cost_class, (0, 0))
+        key = (user_id, cost_class)
+        with self._lock:
+            if user_limit and self._per_user.get(key, 0) >= user_limit:
+                self._counters[cost_class]['rejected_user'] += 1
+                return 'user'
+            if global_limit and self._in_flight[cost_class] >= global_limit:
+                self._counters[cost_class]['rejected_global'] += 1
+                return 'global'
+            self._in_flight[cost_class] += 1
+            self._per_user[key] = self._per_user.get(key, 0) + 1
+            self._counters[cost_class]['admitted'] += 1
+            return None
+
+    def release(self, user_id, cost_class: str) -> None:
+        """Return a slot taken with try_acquire"""
+        key = (user_id, cost_class)
+        with self._lock:
+            self._in_flight[cost_class] -= 1
+            self._per_user[key] -= 1
+            if not self._per_user[key]:
+                del self._per_user[key]
+
+    def record_background(self, cost_class: str) -> None:
+        """Count a request that was sent to the background queue instead"""
+        with self._lock:
+            self._counters[cost_class]['background'] += 1
+
+    def stats(self) -> Dict:
+        """In-flight requests, limits and counters per cost class"""
+        with self._lock:
+            return {
+                cost_class: {
+                    'in_flight': self._in_flight[cost_class],
+                    'global_limit': self.limits.get(cost_class, (0, 0))[0],
+                    'per_user_limit': self.limits.get(cost_class, (0, 0))[1],
+                    **self._counters[cost_class]
+                }
+                for cost_class in COST_CLASSES
+            }
+
+def estimate_cost(operation: str, file_size: int, page_count: Optional[int]) -> float:
+    """
+    Estimate the cost of an operation on a document in cost units
+
+    The page count (when cached) and the file size in page equivalents
+    (ADMISSION_BYTES_PER_PAGE) are both considered, whichever is larger, so
+    image-heavy scans with few but large pages are not mistaken for cheap.
+    """
+    size_pages = file_size / current_app.config['ADMISSION_BYTES_PER_PAGE']
+    return OPERATION_WEIGHTS[operation] * max(page_count or 0, size_pages)
+
+def cost_class_for(cost: float) -> str:
+    """Map a cost to its cost class using ADMISSION_MEDIUM_COST and ADMISSION_HEAVY_COST"""
+    if cost >= current_app.config['ADMISSION_HEAVY_COST']:
+        return 'heavy'
+    if cost >= current_app.config['ADMISSION_MEDIUM_COST']:
+        return 'medium'
+    return 'light'
+
+def run_in_background() -> bool:
+    """Whether admission control sent the current request to the background queue"""
+    return g.get('admission_background', False)
+
+def _document_cost(operation: str, user_id, document_id: int) -> Optional[float]:
+    """Estimated cost from the document row and the cached page count of its latest version"""
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return None
+    latest_version = document.get_version()
+    # Cache entries are keyed by file name, so the storage key works without fetching the file
+    info = ArtifactCache(current_app.config['CACHE_FOLDER']).read_json(
+        latest_version.file_path if latest_version else document.file_path, "info.json")
+    return estimate_cost(operation, document.file_size, info['page_count'] if info else None)
+
+def admission_control(operation: str, background: bool = False):
+    """
+    Apply admission control to a document route (apply below @jwt_required())
+
+    The request is classified by its estimated cost. Over budget, it gets
+    429 (the user's own budget) or 503 (the server's), with Retry-After.
+    With background=True, heavy requests skip the budget and the route is
+    expected to queue the work instead (see run_in_background). The slot
+    is held until the response is closed, so streamed responses count
+    until the last byte is sent.
+
+    Args:
+        operation: Operation type (key of OPERATION_WEIGHTS)
+        background: Whether the route can run heavy requests as a background job
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            controller = current_app.extensions.get('admission')
+            if controller is None:
+                return view(*args, **kwargs)
+
+            user_id = get_jwt_identity()
+            cost = _document_cost(operation, user_id, kwargs['document_id'])
+            if cost is None:
+                # Unknown document: let the view answer with its 404
+                return view(*args, **kwargs)
+
+            cost_class = cost_class_for(cost)
+            g.admission_cost = cost
+            if background and cost_class == 'heavy':
+                controller.record_background(cost_class)
+                g.admission_background = True
+                return view(*args, **kwargs)
+
+            exhausted = controller.try_acquire(user_id, cost_class)
+            if exhausted:
+                retry_after = current_app.config['ADMISSION_RETRY_AFTER']
+                message = ("Too many expensive requests in progress for this user" if exhausted == 'user'
+                           else "The server is busy with expensive requests")
+                response = jsonify({"error": message, "cost_class": cost_class, "retry_after": retry_after})
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429 if exhausted == 'user' else 503
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                controller.release(user_id, cost_class)
+                raise
+            response.call_on_close(lambda: controller.release(user_id, cost_class))
+            return response
+        return wrapper
+    return decorator
+
+def init_admission(app):
+    """Create the admission controller of the app, unless ADMISSION_ENABLED is false"""
+    if not app.config.get('ADMISSION_ENABLED', True):
+        return
+    app.extensions['admission'] = AdmissionController({
+        'light': (0, 0),
+        'medium': (app.config['ADMISSION_MEDIUM_GLOBAL'], app.config['ADMISSION_MEDIUM_PER_USER']),
+        'heavy': (app.config['ADMISSION_HEAVY_GLOBAL'], app.config['ADMISSION_HEAVY_PER_USER'])
+    })
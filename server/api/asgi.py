@@ -0,0 +1,435 @@
+import os
+import re
+import sys
+import json
+import asyncio
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from flask import g
+from flask_jwt_extended import decode_token
+
+from models.db import db, Document
+from api.routes.ai_routes import create_assistant, llm_retry_after, parse_ask_request
+from api.file_serving import accel_location
+from services.ai.document_assistant import AIDocumentAssistant
+from services.ai.llm_gateway import LLMUnavailableError
+from services.ai.corpus_index import retrieve_pages
+
+FILE_CHUNK_SIZE = 256 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024  # Request bodies above this are buffered on disk for the WSGI app
+
+class AsyncRequest:
+    """Minimal view of an ASGI HTTP request"""
+
+    def __init__(self, scope: Dict, receive: Callable, path_params: Dict):
+        self.scope = scope
+        self.receive = receive
+        self.path_params = path_params
+        self.method = scope['method']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+
+    async def body(self) -> bytes:
+        chunks = []
+        while True:
+            message = await self.receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def json(self) -> Optional[Dict]:
+        try:
+            return json.loads(await self.body() or b'null')
+        except ValueError:
+            return None
+
+class AsyncApp:
+    """ASGI application that serves I/O-bound routes as native coroutines
+
+    The AI routes and the document content route run directly on the event
+    loop, so a worker is not pinned while waiting on the LLM or the disk.
+    Database lookups and CPU-bound PDFService calls are offloaded to a thread
+    pool executor. Every other request is passed to the Flask app, which
+    keeps running synchronously on the same executor, so sync routes are
+    served concurrently up to the executor's size.
+    """
+
+    def __init__(self, flask_app, executor_workers: Optional[int] = None):
+        self.flask_app = flask_app
+        self.executor_workers = executor_workers or flask_app.config.get('ASGI_EXECUTOR_WORKERS', 16)
+        self.executor = None
+        self._executor_loop = None
+        self.routes: List[Tuple[str, re.Pattern, Callable[..., Awaitable]]] = []
+
+        self.route('POST', r'/api/ai/process-document/(?P<document_id>\d+)', self.process_document)
+        self.route('POST', r'/api/ai/extract-information/(?P<document_id>\d+)', self.extract_information)
+        self.route('POST', r'/api/ai/extract-fields/(?P<document_id>\d+)', self.extract_fields)
+        self.route('GET', r'/api/ai/summarize/(?P<document_id>\d+)', self.summarize_document)
+        self.route('POST', r'/api/ai/ask', self.ask_library)
+        self.route('GET', r'/api/pdf/(?P<document_id>\d+)/content', self.get_document_content)
+
+    def route(self, method: str, pattern: str, handler: Callable[..., Awaitable]):
+        """Register a native coroutine handler for a method and path pattern"""
+        self.routes.append((method, re.compile(pattern + r'/?$'), handler))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['type'] == 'http':
+            for method, pattern, handler in self.routes:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    self._ensure_executor()
+                    request = AsyncRequest(scope, receive, match.groupdict())
+                    return await handler(request, send)
+
+        if scope['type'] == 'http':
+            self._ensure_executor()
+            return await self.call_wsgi(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        """Create the executor at startup and shut it down on exit"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._ensure_executor()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _ensure_executor(self):
+        """Create the executor for the running event loop and make it the loop's default"""
+        loop = asyncio.get_running_loop()
+        if self._executor_loop is not loop:
+            self.executor = ThreadPoolExecutor(max_workers=self.executor_workers, thread_name_prefix='asgi-sync')
+            self._executor_loop = loop
+            loop.set_default_executor(self.executor)
+
+    async def run_sync(self, func: Callable, *args, user_id: Optional[int] = None):
+        """
+        Run a blocking function inside the Flask app context on the executor
+
+        Pass user_id for the lookups of read-only routes, so their queries may
+        be served by the read replica (see models/routing.py).
+        """
+        def call():
+            with self.flask_app.app_context():
+                if user_id is not None:
+                    g.db_read_only = True
+                    g.db_user_id = user_id
+                try:
+                    return func(*args)
+                finally:
+                    db.session.remove()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    async def call_wsgi(self, scope, receive, send):
+        """Serve a request with the synchronous Flask app on the executor"""
+        loop = asyncio.get_running_loop()
+
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        while True:
+            message = await receive()
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        environ = self._wsgi_environ(scope, body)
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+        # Streamed responses are pulled one chunk at a time from the executor
+        result = await loop.run_in_executor(self.executor, self.flask_app, environ, start_response)
+        iterable = iter(result)
+        try:
+            await send({'type': 'http.response.start', **response_start})
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next, iterable, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+            body.close()
+
+    def _wsgi_environ(self, scope, body) -> Dict:
+        """Build a WSGI environ from an ASGI HTTP scope"""
+        server_name, server_port = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server_name,
+            'SERVER_PORT': str(server_port),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    # -- Helpers shared by the handlers --
+
+    async def send_json(self, send, status: int, data, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(data).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': self._headers({
+                'content-type': 'application/json',
+                'content-length': str(len(body)),
+                **(headers or {})
+            })
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def _headers(self, headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+        # Mirror the CORS(app) defaults applied to the Flask routes
+        headers.setdefault('access-control-allow-origin', '*')
+        return [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]
+
+    async def authenticate(self, request: AsyncRequest, send) -> Optional[int]:
+        """Validate the JWT bearer token like @jwt_required, returning the user ID"""
+        auth = request.headers.get('authorization', '')
+        if not auth.startswith('Bearer '):
+            await self.send_json(send, 401, {"msg": "Missing Authorization Header"})
+            return None
+        try:
+            with self.flask_app.app_context():
+                claims = decode_token(auth[len('Bearer '):])
+                return claims[self.flask_app.config.get('JWT_IDENTITY_CLAIM', 'sub')]
+        except Exception as e:
+            await self.send_json(send, 422, {"msg": str(e)})
+            return None
+
+    async def get_document(self, request: AsyncRequest, send, read_only: bool = False) -> Optional[Document]:
+        """Authenticate the request and load the requested document of the user"""
+        user_id = await self.authenticate(request, send)
+        if user_id is None:
+            return None
+
+        document_id = int(request.path_params['document_id'])
+        document = await self.run_sync(
+            lambda: Document.query.filter_by(id=document_id, user_id=user_id).first(),
+            user_id=user_id if read_only else None)
+        if not document:
+            await self.send_json(send, 404, {"error": "Document not found or access denied"})
+        return document
+
+    async def run_assistant(self, send, operation: Callable[..., Awaitable], *args):
+        """Run an AI assistant operation on the event loop and send its result"""
+        try:
+            with self.flask_app.app_context():
+                ai_assistant = create_assistant()
+            result = await operation(ai_assistant, *args)
+            await self.send_json(send, 200, result)
+        except LLMUnavailableError as e:
+            with self.flask_app.app_context():
+                retry_after = llm_retry_after(e)
+            await self.send_json(send, 503, {"error": str(e), "retry_after": retry_after},
+                                 {'retry-after': str(retry_after)})
+        except Exception as e:
+            await self.send_json(send, 500, {"error": str(e)})
+
+    # -- Native coroutine routes --
+
+    async def process_document(self, request: AsyncRequest, send):
+        """Process a document with AI assistant"""
+        document = await self.get_document(request, send)
+        if not document:
+            return
+
+        data = await request.json()
+        if not data or 'query' not in data:
+            return await self.send_json(send, 400, {"error": "Missing required fields"})
+
+        file_path = await self.run_sync(lambda: document.local_path)
+        await self.run_assistant(send, lambda a: a.process_document(file_path, data['query']))
+
+    async def extract_information(self, request: AsyncRequest, send):
+        """Extract specific information from a document with AI assistant"""
+        document = await self.get_document(request, send)
+        if not document:
+            return
+
+        data = await request.json()
+        if not data or 'info_type' not in data:
+            return await self.send_json(send, 400, {"error": "Missing required fields"})
+
+        file_path = await self.run_sync(lambda: document.local_path)
+        await self.run_assistant(send, lambda a: a.extract_information(file_path, data['info_type']))
+
+    async def extract_fields(self, request: AsyncRequest, send):
+        """Extract several fields from a document in one pass with AI assistant"""
+        document = await self.get_document(request, send)
+        if not document:
+            return
+
+        data = await request.json()
+        if not data or ('fields' not in data and 'schema' not in data):
+            return await self.send_json(send, 400, {"error": "Missing required fields"})
+        try:
+            fields = AIDocumentAssistant.parse_fields(data.get('fields'), data.get('schema'))
+        except ValueError as e:
+            return await self.send_json(send, 400, {"error": str(e)})
+
+        file_path = await self.run_sync(lambda: document.local_path)
+        await self.run_assistant(send, lambda a: a.extract_fields(file_path, fields))
+
+    async def summarize_document(self, request: AsyncRequest, send):
+        """Generate a summary of a document with AI assistant"""
+        max_length = request.args.get('max_length', None)
+        if max_length is not None:
+            try:
+                max_length = int(max_length)
+            except ValueError:
+                return await self.send_json(send, 400, {"error": "max_length must be an integer"})
+
+        document = await self.get_document(request, send)
+        if not document:
+            return
+
+        file_path = await self.run_sync(lambda: document.local_path)
+        await self.run_assistant(send, lambda a: a.summarize_document(file_path, max_length))
+
+    async def ask_library(self, request: AsyncRequest, send):
+        """Answer a question from the user's whole library (or the given documents), citing the pages used"""
+        user_id = await self.authenticate(request, send)
+        if user_id is None:
+            return
+
+        config = self.flask_app.config
+        try:
+            question, document_ids = parse_ask_request(await request.json())
+            pages = await self.run_sync(retrieve_pages, user_id, question, config['CORPUS_MAX_HITS'], document_ids,
+                                        user_id=user_id)
+        except ValueError as e:
+            return await self.send_json(send, 400, {"error": str(e)})
+
+        async def answer(assistant):
+            result = await assistant.answer_corpus(question, pages, config['CORPUS_CONTEXT_TOKENS'],
+                                                   config['CORPUS_CALL_TOKENS'])
+            result["hits"] = len(pages)
+            return result
+        await self.run_assistant(send, answer)
+
+    async def get_document_content(self, request: AsyncRequest, send):
+        """Stream the document content (PDF file) without holding a worker thread"""
+        document = await self.get_document(request, send, read_only=True)
+        if not document:
+            return
+
+        version = request.args.get('version', None)
+        document_version = await self.run_sync(lambda: document.get_version(version), user_id=document.user_id)
+        if version and not document_version:
+            return await self.send_json(send, 404, {"error": f"Version {version} not found"})
+        try:
+            file_path = await self.run_sync(
+                lambda: document_version.local_path if document_version else document.local_path)
+            stat = await asyncio.get_running_loop().run_in_executor(self.executor, os.stat, file_path)
+        except OSError as e:
+            return await self.send_json(send, 500, {"error": str(e)})
+
+        mode = self.flask_app.config['FILE_SERVING']
+        if mode != 'sendfile':
+            # The front proxy sends the file (see api/file_serving.py)
+            with self.flask_app.app_context():
+                location = accel_location(file_path) if mode == 'x-accel-redirect' else file_path
+            if location is not None:
+                header = 'x-accel-redirect' if mode == 'x-accel-redirect' else 'x-sendfile'
+                await send({'type': 'http.response.start', 'status': 200, 'headers': self._headers(
+                    {'content-type': 'application/pdf', header: location})})
+                return await send({'type': 'http.response.body', 'body': b''})
+
+        etag = f'"{int(stat.st_mtime)}-{stat.st_size}-{os.path.basename(file_path)}"'
+        headers = {
+            'content-type': 'application/pdf',
+            'etag': etag,
+            'last-modified': formatdate(stat.st_mtime, usegmt=True),
+            'accept-ranges': 'bytes',
+        }
+        if request.headers.get('if-none-match') == etag:
+            await send({'type': 'http.response.start', 'status': 304, 'headers': self._headers(headers)})
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        start, end, status = 0, stat.st_size - 1, 200
+        byte_range = self._parse_range(request.headers.get('range'), stat.st_size)
+        if byte_range:
+            start, end = byte_range
+            status = 206
+            headers['content-range'] = f"bytes {start}-{end}/{stat.st_size}"
+        headers['content-length'] = str(end - start + 1)
+
+        await send({'type': 'http.response.start', 'status': status, 'headers': self._headers(headers)})
+        if 'http.response.zerocopy' in request.scope.get('extensions', {}):
+            await self._send_file_zerocopy(send, file_path, start, end - start + 1)
+        else:
+            await self._send_file(send, file_path, start, end - start + 1)
+
+    def _parse_range(self, header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+        """Parse a single-range "bytes=start-end" header, ignoring anything else"""
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', header or '')
+        if not match or not any(match.groups()) or size == 0:
+            return None
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+        return (start, end) if start <= end else None
+
+    async def _send_file_zerocopy(self, send, file_path: str, offset: int, length: int):
+        """Let the server send part of a file with sendfile() (ASGI zero-copy extension)"""
+        f = await asyncio.get_running_loop().run_in_executor(self.executor, open, file_path, 'rb')
+        try:
+            await send({'type': 'http.response.zerocopy', 'file': f, 'offset': offset, 'count': length})
+        finally:
+            f.close()
+
+    async def _send_file(self, send, file_path: str, offset: int, length: int):
+        """Send part of a file in chunks read on the executor"""
+        loop = asyncio.get_running_loop()
+        f = await loop.run_in_executor(self.executor, open, file_path, 'rb')
+        try:
+            await loop.run_in_executor(self.executor, f.seek, offset)
+            while length > 0:
+                chunk = await loop.run_in_executor(self.executor, f.read, min(FILE_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': length > 0})
+                if length == 0:
+                    return
+            # Empty range, or the file shrank while it was being sent
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            f.close()
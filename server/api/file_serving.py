@@ -0,0 +1,70 @@
+import os
+from typing import Optional
+from urllib.parse import quote
+
+from flask import Response, current_app, send_file
+
+FILE_SERVING_MODES = ('sendfile', 'x-sendfile', 'x-accel-redirect')
+
+def accel_location(file_path: str) -> Optional[str]:
+    """
+    Internal proxy URL of a file for X-Accel-Redirect
+
+    Files under UPLOAD_FOLDER map to <FILE_SERVING_ACCEL_PREFIX>/uploads/...
+    and files under CACHE_FOLDER to <FILE_SERVING_ACCEL_PREFIX>/cache/...;
+    other files have no location.
+    """
+    prefix = current_app.config['FILE_SERVING_ACCEL_PREFIX'].rstrip('/')
+    file_path = os.path.abspath(file_path)
+    for name, root in (('uploads', current_app.config['UPLOAD_FOLDER']),
+                       ('cache', current_app.config['CACHE_FOLDER'])):
+        relative = os.path.relpath(file_path, os.path.abspath(root))
+        if not relative.startswith(os.pardir + os.sep) and relative != os.pardir:
+            return f"{prefix}/{name}/{quote(relative.replace(os.sep, '/'))}"
+    return None
+
+def serve_file(file_path: str, mimetype: str, etag=True, as_attachment: bool = False,
+               download_name: Optional[str] = None) -> Response:
+    """
+    Send a file without copying its bytes through Python where possible
+
+    FILE_SERVING selects how:
+    - sendfile: send_file hands the open file to the server's
+      wsgi.file_wrapper, which gunicorn sends with the sendfile() system call
+      (conditional and range requests are still answered by Werkzeug)
+    - x-sendfile: only an X-Sendfile header is returned and the front
+      proxy (Apache, lighttpd) sends the file
+    - x-accel-redirect: only an X-Accel-Redirect header to an internal
+      nginx location is returned (see accel_location); nginx handles
+      conditional and range requests itself
+
+    Args:
+        file_path: Path to the file
+        mimetype: Content type of the response
+        etag: ETag for send_file (True computes one from the file)
+        as_attachment: Whether to ask the client to download the file
+        download_name: File name for the Content-Disposition header
+
+    Returns:
+        The response
+    """
+    if current_app.config['FILE_SERVING'] == 'x-accel-redirect':
+        location = accel_location(file_path)
+        if location is not None:
+            response = Response(status=200, mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = location
+            if as_attachment or download_name:
+                response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                                     filename=download_name or os.path.basename(file_path))
+            return response
+
+    # X-Sendfile is built into send_file through USE_X_SENDFILE (see init_file_serving)
+    return send_file(file_path, mimetype=mimetype, etag=etag, as_attachment=as_attachment,
+                     download_name=download_name, conditional=True)
+
+def init_file_serving(app):
+    """Validate FILE_SERVING and enable Flask's X-Sendfile support for the x-sendfile mode"""
+    mode = app.config['FILE_SERVING']
+    if mode not in FILE_SERVING_MODES:
+        raise ValueError(f"Unknown FILE_SERVING mode: {mode}")
+    app.config['USE_X_SENDFILE'] = mode == 'x-sendfile'
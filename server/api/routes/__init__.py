@@ -3,6 +3,9 @@ from api.routes.pdf_routes import pdf_routes
 from api.routes.ai_routes import ai_routes
 from api.routes.auth_routes import auth_bp
 from api.routes.document_routes import doc_bp
+from api.routes.job_routes import job_bp
+from api.routes.system_routes import system_bp
+from api.routes.annotation_routes import annotation_bp
 
 def register_routes(app):
     """Register all API routes with the Flask app"""
@@ -21,6 +24,9 @@ def register_routes(app):
     app.register_blueprint(doc_bp)
     app.register_blueprint(pdf_routes) # Assuming pdf_routes also has /api in its prefix
     app.register_blueprint(ai_routes) # Assuming ai_routes also has /api in its prefix
+    app.register_blueprint(job_bp)
+    app.register_blueprint(system_bp)
+    app.register_blueprint(annotation_bp)
 
     # If a single top-level /api blueprint is preferred by the app factory:
     # api_blueprint = Blueprint('api', __name__, url_prefix='/api')
@@ -1,13 +1,63 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import os
+import math
 import asyncio
 
 from models.db import Document
+from models.routing import db_read_only
 from services.ai.document_assistant import AIDocumentAssistant
+from services.ai.llm_gateway import LLMUnavailableError, get_llm_gateway
+from services.ai.corpus_index import retrieve_pages
 
 ai_routes = Blueprint('ai', __name__, url_prefix='/api/ai')
 
+def create_assistant():
+    """Create an AI assistant configured from the current app"""
+    return AIDocumentAssistant(
+        api_key=current_app.config.get('OPENAI_API_KEY'),
+        model=current_app.config.get('OPENAI_MODEL', 'gpt-4'),
+        api_url=current_app.config.get('OPENAI_API_URL'),
+        gateway=get_llm_gateway(current_app.config)
+    )
+
+def llm_retry_after(error: LLMUnavailableError) -> int:
+    """Seconds a client should wait before retrying a call the LLM gateway turned away"""
+    if error.retry_after:
+        return max(1, math.ceil(error.retry_after))
+    return current_app.config['ADMISSION_RETRY_AFTER']
+
+def llm_unavailable_response(error: LLMUnavailableError):
+    """503 response with Retry-After for a call the LLM gateway turned away"""
+    retry_after = llm_retry_after(error)
+    response = jsonify({"error": str(error), "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+def parse_ask_request(data):
+    """
+    Validate the body of an ask request
+
+    Returns:
+        Tuple of (question, document IDs or None)
+
+    Raises:
+        ValueError: If the question or the document IDs are malformed
+    """
+    if not data or not isinstance(data.get('question'), str) or not data['question'].strip():
+        raise ValueError("Missing required fields")
+    document_ids = data.get('document_ids')
+    if document_ids is not None and (not isinstance(document_ids, list) or not all(
+            isinstance(document_id, int) and not isinstance(document_id, bool) for document_id in document_ids)):
+        raise ValueError("document_ids must be a list of document IDs")
+    return data['question'].strip(), document_ids
+
+@ai_routes.route('/metrics', methods=['GET'])
+@jwt_required()
+def llm_metrics():
+    """Get the LLM gateway metrics of this server process"""
+    return jsonify(get_llm_gateway(current_app.config).metrics()), 200
+
 @ai_routes.route('/process-document/<int:document_id>', methods=['POST'])
 @jwt_required()
 def process_document(document_id):
@@ -26,21 +76,15 @@ def process_document(document_id):
     
     try:
         # Initialize AI assistant
-        ai_assistant = AIDocumentAssistant(
-            api_key=current_app.config.get('OPENAI_API_KEY'),
-            model=current_app.config.get('OPENAI_MODEL', 'gpt-4')
-        )
+        ai_assistant = create_assistant()
         
         # Process the document asynchronously
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            ai_assistant.process_document(document.file_path, data['query'])
-        )
-        loop.close()
+        result = asyncio.run(ai_assistant.process_document(document.local_path, data['query']))
         
         return jsonify(result), 200
         
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -62,21 +106,44 @@ def extract_information(document_id):
     
     try:
         # Initialize AI assistant
-        ai_assistant = AIDocumentAssistant(
-            api_key=current_app.config.get('OPENAI_API_KEY'),
-            model=current_app.config.get('OPENAI_MODEL', 'gpt-4')
-        )
+        ai_assistant = create_assistant()
         
         # Extract information asynchronously
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            ai_assistant.extract_information(document.file_path, data['info_type'])
-        )
-        loop.close()
+        result = asyncio.run(ai_assistant.extract_information(document.local_path, data['info_type']))
+        
+        return jsonify(result), 200
         
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@ai_routes.route('/extract-fields/<int:document_id>', methods=['POST'])
+@jwt_required()
+def extract_fields(document_id):
+    """Extract several fields (a list, a name to description object, or a JSON schema) in one pass"""
+    user_id = get_jwt_identity()
+    
+    data = request.json
+    if not data or ('fields' not in data and 'schema' not in data):
+        return jsonify({"error": "Missing required fields"}), 400
+    try:
+        fields = AIDocumentAssistant.parse_fields(data.get('fields'), data.get('schema'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Get the document
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    try:
+        ai_assistant = create_assistant()
+        result = asyncio.run(ai_assistant.extract_fields(document.local_path, fields))
         return jsonify(result), 200
         
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -101,20 +168,42 @@ def summarize_document(document_id):
     
     try:
         # Initialize AI assistant
-        ai_assistant = AIDocumentAssistant(
-            api_key=current_app.config.get('OPENAI_API_KEY'),
-            model=current_app.config.get('OPENAI_MODEL', 'gpt-4')
-        )
+        ai_assistant = create_assistant()
         
         # Summarize the document asynchronously
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(
-            ai_assistant.summarize_document(document.file_path, max_length)
-        )
-        loop.close()
+        result = asyncio.run(ai_assistant.summarize_document(document.local_path, max_length))
         
         return jsonify(result), 200
         
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@ai_routes.route('/ask', methods=['POST'])
+@jwt_required()
+@db_read_only
+def ask_library():
+    """Answer a question from the user's whole library (or the given documents), citing the pages used
+
+    Body: {"question", "document_ids": [optional]}
+    """
+    user_id = get_jwt_identity()
+    
+    try:
+        question, document_ids = parse_ask_request(request.get_json(silent=True))
+        pages = retrieve_pages(user_id, question, current_app.config['CORPUS_MAX_HITS'], document_ids)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    try:
+        ai_assistant = create_assistant()
+        result = asyncio.run(ai_assistant.answer_corpus(question, pages, current_app.config['CORPUS_CONTEXT_TOKENS'],
+                                                        current_app.config['CORPUS_CALL_TOKENS']))
+        result["hits"] = len(pages)
+        return jsonify(result), 200
+        
+    except LLMUnavailableError as e:
+        return llm_unavailable_response(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
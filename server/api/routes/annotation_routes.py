@@ -0,0 +1,188 @@
+from flask import Blueprint, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from models.db import db, Document
+from models.routing import db_read_only
+from api.admission import admission_control
+from api.file_serving import serve_file
+from services.pdf.pdf_service import PDFService
+from services.pdf.annotation_service import AnnotationService
+from services.pdf.ingest_service import schedule_ingest
+from services.cache.artifact_cache import ArtifactCache
+
+annotation_bp = Blueprint('annotation_bp', __name__, url_prefix='/api/documents')
+
+def _annotation_service():
+    """Annotation service with the app's folders and settings"""
+    return AnnotationService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                             ArtifactCache(current_app.config['CACHE_FOLDER']),
+                             current_app.config['ANNOTATION_SNAPSHOT_INTERVAL'],
+                             current_app.config['ANNOTATION_MAX_IMAGE_BYTES'])
+
+def _operation_json(operation):
+    return {
+        "seq": operation.seq,
+        "op": operation.op,
+        "element_id": operation.element_id,
+        "payload": operation.payload,
+        "created_at": operation.created_at.isoformat()
+    }
+
+def _append(document_id, op, element_id=None, payload=None):
+    """Append an edit to the annotation log of a document of the current user"""
+    user_id = get_jwt_identity()
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        operation = _annotation_service().append(document_id, user_id, op, element_id, payload)
+        return jsonify(_operation_json(operation)), 201 if op == 'add' else 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@annotation_bp.route('/<int:document_id>/annotations', methods=['GET'])
+@jwt_required()
+@db_read_only
+def get_annotations(document_id):
+    """Get the pending annotation layer of a document (elements in drawing order)"""
+    user_id = get_jwt_identity()
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        elements, seq = _annotation_service().layer(document_id)
+        return jsonify({"document_id": document_id, "seq": seq, "elements": elements}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@annotation_bp.route('/<int:document_id>/annotations/operations', methods=['GET'])
+@jwt_required()
+@db_read_only
+def get_annotation_operations(document_id):
+    """Get the annotation operations after a sequence number (?since=<seq>), for clients that sync incrementally
+
+    Besides add, update and delete, the log holds "undo" operations (payload
+    {"seq"} of the undone edit) and "commit" operations (the layer was
+    flattened into payload {"version"} and emptied).
+    """
+    user_id = get_jwt_identity()
+
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({"error": "since must be an integer"}), 400
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        operations = _annotation_service().operations(document_id, since)
+        return jsonify({"document_id": document_id,
+                        "operations": [_operation_json(operation) for operation in operations]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@annotation_bp.route('/<int:document_id>/annotations', methods=['POST'])
+@jwt_required()
+def add_annotation(document_id):
+    """Add an element to the annotation layer
+
+    Body: {"type": "text", "text", "page", "position": [x, y], "font_size", "color"}
+    or {"type": "image", "image": <base64>, "page", "position": [x, y], "width", "height"}
+    """
+    return _append(document_id, 'add', payload=request.get_json(silent=True))
+
+@annotation_bp.route('/<int:document_id>/annotations/<element_id>', methods=['PATCH'])
+@jwt_required()
+def update_annotation(document_id, element_id):
+    """Change properties of an element (e.g. {"position": [x, y]} to move it)"""
+    return _append(document_id, 'update', element_id, request.get_json(silent=True))
+
+@annotation_bp.route('/<int:document_id>/annotations/<element_id>', methods=['DELETE'])
+@jwt_required()
+def delete_annotation(document_id, element_id):
+    """Remove an element from the annotation layer"""
+    return _append(document_id, 'delete', element_id)
+
+@annotation_bp.route('/<int:document_id>/annotations/undo', methods=['POST'])
+@jwt_required()
+def undo_annotation(document_id):
+    """Undo the last annotation edit"""
+    user_id = get_jwt_identity()
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        result = _annotation_service().undo(document_id, user_id)
+        if result is None:
+            return jsonify({"error": "Nothing to undo"}), 400
+        edit, operation = result
+        return jsonify({"undone": _operation_json(edit), "operation": _operation_json(operation)}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@annotation_bp.route('/<int:document_id>/annotations/export', methods=['GET'])
+@jwt_required()
+@db_read_only
+@admission_control('page_operation')
+def export_annotations(document_id):
+    """Get the latest version with the pending annotations drawn in, without creating a version"""
+    user_id = get_jwt_identity()
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        annotation_service = _annotation_service()
+        elements, _ = annotation_service.layer(document_id)
+        latest_version = document.get_version()
+        file_path = latest_version.local_path if latest_version else document.local_path
+        if not elements:
+            return serve_file(file_path, mimetype='application/pdf')
+
+        export_path = annotation_service.export(file_path, elements)
+        return serve_file(export_path, mimetype='application/pdf',
+                          etag=annotation_service.cache.etag_for(file_path, AnnotationService.export_name(elements)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@annotation_bp.route('/<int:document_id>/annotations/commit', methods=['POST'])
+@jwt_required()
+@admission_control('page_operation')
+def commit_annotations(document_id):
+    """Flatten the pending annotations into a new version and empty the annotation log"""
+    user_id = get_jwt_identity()
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    try:
+        new_version = _annotation_service().commit(document, user_id)
+        schedule_ingest(user_id, document_id, new_version.local_path)
+        return jsonify({
+            "success": True,
+            "document_id": document_id,
+            "version": new_version.version_number
+        }), 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
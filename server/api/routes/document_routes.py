@@ -2,14 +2,26 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import os
 from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 
 from models.db import db, Document, DocumentVersion, User
+from models.routing import db_read_only
+from api.admission import admission_control
 from services.pdf.pdf_service import PDFService # Assuming PDFService will be used here
+from services.pdf.page_ranges import parse_page_selection
+from services.pdf.text_layer import TextLayerService
+from services.pdf.diff_service import DiffService
+from services.pdf.stamp_service import StampService
+from services.cache.artifact_cache import ArtifactCache
+from services.jobs.job_queue import job_queue, PRIORITY_BACKGROUND
+from services.storage.reaper import reap_documents
+from services.pdf.ingest_service import IngestService, schedule_ingest
 
 doc_bp = Blueprint('doc_bp', __name__, url_prefix='/api/documents')
 
 @doc_bp.route('/', methods=['GET'])
 @jwt_required()
+@db_read_only
 def list_documents():
     user_id = get_jwt_identity()
     
@@ -75,26 +87,10 @@ def create_document():
         # Get PDF information
         pdf_info = pdf_service.get_document_info(file_path)
         
-        new_document = Document(
-            title=title,
-            filename=saved_filename, # Use the name returned by save_uploaded_file
-            file_path=file_path,
-            file_size=file_size,
-            user_id=user_id
-        )
-        
-        db.session.add(new_document)
-        db.session.commit() # Commit to get new_document.id
-        
-        initial_version = DocumentVersion(
-            document_id=new_document.id,
-            version_number=1,
-            file_path=file_path, # Initial version uses the same path
-            created_by=user_id
-        )
-        
-        db.session.add(initial_version)
+        # Hands the file to storage and records it as version 1
+        new_document = Document.create_from_file(title, file_path, user_id)
         db.session.commit()
+        schedule_ingest(user_id, new_document.id, new_document.local_path)
         
         # Response should align with frontend expectations for documents.create()
         # api.ts: create: (formData) => api.post('/documents', formData, ...)
@@ -125,6 +121,7 @@ def create_document():
 
 @doc_bp.route('/<int:document_id>', methods=['GET'])
 @jwt_required()
+@db_read_only
 def get_document_details(document_id):
     user_id = get_jwt_identity()
     
@@ -148,11 +145,13 @@ def get_document_details(document_id):
             DocumentVersion.version_number.desc()).first()
         
         # Use latest version's path for PDF info if available, otherwise document's main path
-        path_for_pdf_info = document.file_path
+        # (only the file used is fetched, so a cold original is not promoted for nothing)
         current_version_number = 1 # Default if no versions explicitly tracked or found
         if latest_version:
-            path_for_pdf_info = latest_version.file_path
+            path_for_pdf_info = latest_version.local_path
             current_version_number = latest_version.version_number
+        else:
+            path_for_pdf_info = document.local_path
 
         if not os.path.exists(path_for_pdf_info):
             current_app.logger.error(f"File not found at path: {path_for_pdf_info} for document ID {document.id}")
@@ -162,7 +161,7 @@ def get_document_details(document_id):
             # Let's assume basic info can be returned, but log the missing file.
             pdf_info = {'page_count': None, 'form_fields': None, 'error': 'File not found'}
         else:
-            pdf_info = pdf_service.get_document_info(path_for_pdf_info)
+            pdf_info = IngestService(pdf_service, ArtifactCache(current_app.config['CACHE_FOLDER'])).get_info(path_for_pdf_info)
 
         return jsonify({
             "id": document.id, # Changed from document_id
@@ -243,51 +242,338 @@ def update_document_details(document_id):
 def delete_document_entry(document_id):
     user_id = get_jwt_identity()
     
-    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
-    if not document:
-        return jsonify({"error": "Document not found or access denied"}), 404
+    try:
+        deleted, job = _delete_documents(user_id, [document_id])
+        if not deleted:
+            return jsonify({"error": "Document not found or access denied"}), 404
+        return jsonify({
+            "message": "Document deleted; its files are removed in the background",
+            "job_id": job.id,
+            "status_url": f"/api/jobs/{job.id}"
+        }), 200
         
-    files_to_delete = set() # Use a set to avoid deleting the same file multiple times
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error deleting document {document_id} for user {user_id}: {e}")
+        return jsonify({"error": f"Failed to delete document: {str(e)}"}), 500
+
+@doc_bp.route('/delete', methods=['POST'])
+@jwt_required()
+def delete_documents():
+    """Delete many documents at once
 
+    Body: {"document_ids": [...]}. The documents are gone as soon as this
+    returns; their versions and files are removed by a background job
+    (polled at /api/jobs/<job_id>) that reports the bytes reclaimed.
+    """
+    user_id = get_jwt_identity()
+    
+    data = request.get_json()
+    document_ids = data.get('document_ids') if data else None
+    if not isinstance(document_ids, list) or not document_ids:
+        return jsonify({"error": "Request body must contain a non-empty 'document_ids' list"}), 400
+    if not all(isinstance(document_id, int) for document_id in document_ids):
+        return jsonify({"error": "document_ids must be integers"}), 400
+    max_ids = current_app.config['BULK_DELETE_MAX_IDS']
+    if len(document_ids) > max_ids:
+        return jsonify({"error": f"At most {max_ids} documents can be deleted per request"}), 400
+    
+    document_ids = list(dict.fromkeys(document_ids))
     try:
-        # Collect paths of all version files
-        versions = DocumentVersion.query.filter_by(document_id=document.id).all()
-        for version in versions:
-            if version.file_path and os.path.exists(version.file_path):
-                files_to_delete.add(version.file_path)
-            db.session.delete(version)
-            
-        # Add the main document file path
-        if document.file_path and os.path.exists(document.file_path):
-            files_to_delete.add(document.file_path)
-            
-        # Delete the document record from DB (versions are deleted via cascade or explicitly above)
-        db.session.delete(document)
+        deleted, job = _delete_documents(user_id, document_ids)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error deleting documents for user {user_id}: {e}")
+        return jsonify({"error": f"Failed to delete documents: {str(e)}"}), 500
+    
+    if not deleted:
+        return jsonify({"error": "Documents not found or access denied"}), 404
+    
+    return jsonify({
+        "deleted": deleted,
+        "not_found": [document_id for document_id in document_ids if document_id not in deleted],
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
+
+def _delete_documents(user_id, document_ids):
+    """Tombstone documents of a user and queue the reaper for them
+
+    Returns:
+        Tuple of the tombstoned IDs and the reaper job (None if no document was found)
+    """
+    # A concurrent delete of the same document inserts its tombstone first; once it is
+    # committed the document no longer shows up, so trying again skips it
+    for attempt in range(3):
+        try:
+            deleted = Document.tombstone(document_ids, user_id)
+            if not deleted:
+                return deleted, None
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == 2:
+                raise
+    
+    job = job_queue.enqueue('delete', user_id, reap_documents, deleted, priority=PRIORITY_BACKGROUND)
+    return deleted, job
+
+def _assemble_document(user_id, parts, title, target_document_id, upload_folder):
+    """Assemble page ranges into a new file and record it as a new document or version
+
+    Runs inline for small inputs and on the background job queue for large ones.
+    """
+    output_path = PDFService(upload_folder).assemble_pdf(parts)
+    
+    try:
+        if target_document_id:
+            document = db.session.get(Document, target_document_id)
+            if document is None:
+                raise ValueError("The target document has been deleted")
+            new_version = document.add_version(output_path, user_id)
+            db.session.commit()
+            schedule_ingest(user_id, document.id, new_version.local_path)
+            return {"document_id": document.id, "version": new_version.version_number}
         
-        # Commit DB changes first
+        new_document = Document.create_from_file(title, output_path, user_id)
         db.session.commit()
+        schedule_ingest(user_id, new_document.id, new_document.local_path)
+        return {"document_id": new_document.id, "version": 1}
         
-        # Then delete actual files
-        deleted_files_count = 0
-        errors_deleting_files = []
-        for file_path_to_delete in files_to_delete:
-            try:
-                os.remove(file_path_to_delete)
-                deleted_files_count += 1
-            except OSError as e:
-                current_app.logger.error(f"Error deleting file {file_path_to_delete} for document {document.id}: {e}")
-                errors_deleting_files.append(file_path_to_delete)
+    except Exception:
+        db.session.rollback()
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+@doc_bp.route('/merge', methods=['POST'])
+@jwt_required()
+def merge_documents():
+    """Assemble a document from page ranges of one or more documents
+
+    Each part is {"document_id", "pages" (optional, e.g. "0-4,7" or [0, 1]),
+    "rotate" (optional, degrees added to each page's rotation), "version" (optional)}. The result becomes a new
+    document, or a new version of "target_document_id" if given. Large inputs
+    (or "async": true) are processed on the background job queue.
+    """
+    user_id = get_jwt_identity()
+    
+    data = request.get_json()
+    if not data or not isinstance(data.get('parts'), list) or not data['parts']:
+        return jsonify({"error": "Request body must contain a non-empty 'parts' list"}), 400
+    
+    ingest_service = IngestService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                                   ArtifactCache(current_app.config['CACHE_FOLDER']))
+    parts = []
+    total_size = 0
+    for part in data['parts']:
+        if not isinstance(part, dict) or 'document_id' not in part:
+            return jsonify({"error": "Each part must contain a document_id"}), 400
+        
+        rotate = part.get('rotate')
+        if rotate is not None and (not isinstance(rotate, int) or isinstance(rotate, bool) or rotate % 90 != 0):
+            return jsonify({"error": "rotate must be a multiple of 90"}), 400
         
-        if errors_deleting_files:
-            # Partial success, document record deleted but some files might remain
-            return jsonify({
-                "message": f"Document record deleted. {deleted_files_count} associated files deleted. Failed to delete some files.",
-                "failed_files": errors_deleting_files
-            }), 207 # Multi-Status
+        document = Document.query.filter_by(id=part['document_id'], user_id=user_id).first()
+        if not document:
+            return jsonify({"error": f"Document {part['document_id']} not found or access denied"}), 404
         
-        return jsonify({"message": f"Document and {deleted_files_count} associated files deleted successfully"}), 200 # Or 204 No Content
+        version = part.get('version')
+        document_version = document.get_version(version)
+        if version and not document_version:
+            return jsonify({"error": f"Version {version} of document {document.id} not found"}), 404
+        
+        # Resolve the page selection now, so a malformed one is a 400 rather than a failed job
+        file_path = document_version.local_path if document_version else document.local_path
+        try:
+            page_count = ingest_service.get_info(file_path)['page_count']
+            pages = parse_page_selection(part.get('pages'), page_count)
+        except ValueError as e:
+            return jsonify({"error": f"Document {document.id}: {e}"}), 400
+        
+        parts.append({
+            'file_path': file_path,
+            'pages': pages,
+            'rotate': rotate
+        })
+        total_size += document.file_size
+    
+    target_document_id = data.get('target_document_id')
+    if target_document_id and not Document.query.filter_by(id=target_document_id, user_id=user_id).first():
+        return jsonify({"error": "Target document not found or access denied"}), 404
+    
+    title = data.get('title', 'Merged document')
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    
+    if data.get('async') or total_size > current_app.config['MERGE_ASYNC_THRESHOLD']:
+        job = job_queue.enqueue('merge', user_id, _assemble_document,
+                                user_id, parts, title, target_document_id, upload_folder,
+                                document_id=target_document_id)
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}"
+        }), 202
+    
+    try:
+        result = _assemble_document(user_id, parts, title, target_document_id, upload_folder)
+        return jsonify(result), 201
         
     except Exception as e:
+        current_app.logger.error(f"Error merging documents for user {user_id}: {e}")
+        return jsonify({"error": f"Failed to merge documents: {str(e)}"}), 500
+
+def _stamp_documents(user_id, documents, stamp, pages, upload_folder):
+    """Stamp several documents in parallel and add one new version to each (runs as a job)
+
+    Args:
+        documents: List of (document_id, file_path) tuples
+    """
+    output_paths = StampService(PDFService(upload_folder)).stamp_many(
+        [file_path for _, file_path in documents], stamp, pages)
+    
+    try:
+        results, deleted = [], []
+        for (document_id, _), output_path in zip(documents, output_paths):
+            document = db.session.get(Document, document_id)
+            if document is None:
+                # Deleted while the job was queued; the other documents still get their version
+                deleted.append(document_id)
+                os.remove(output_path)
+                continue
+            new_version = document.add_version(output_path, user_id)
+            results.append((document, new_version))
+        db.session.commit()
+        
+    except Exception:
         db.session.rollback()
-        current_app.logger.error(f"Error deleting document {document_id} for user {user_id}: {e}")
-        return jsonify({"error": f"Failed to delete document: {str(e)}"}), 500
+        for path in output_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    
+    for document, new_version in results:
+        schedule_ingest(user_id, document.id, new_version.local_path)
+    return {"documents": [{"document_id": document.id, "version": new_version.version_number}
+                          for document, new_version in results],
+            "deleted": deleted}
+
+@doc_bp.route('/stamp', methods=['POST'])
+@jwt_required()
+def stamp_documents():
+    """Stamp or watermark the latest version of several documents in the background
+
+    Body: {"document_ids": [...], "stamp": {...}, "pages": <selection>}, with
+    the stamp as for POST /api/pdf/<id>/stamp. Every document gets one new
+    version. Returns a job to poll at /api/jobs/<job_id>; documents deleted
+    before the job ran are listed in its result under "deleted".
+    """
+    user_id = get_jwt_identity()
+    
+    data = request.get_json()
+    if not data or not isinstance(data.get('document_ids'), list) or not data['document_ids']:
+        return jsonify({"error": "Request body must contain a non-empty 'document_ids' list"}), 400
+    if not isinstance(data.get('stamp'), dict):
+        return jsonify({"error": "stamp must be an object"}), 400
+    
+    if not all(isinstance(document_id, int) and not isinstance(document_id, bool)
+               for document_id in data['document_ids']):
+        return jsonify({"error": "document_ids must be a list of document IDs"}), 400
+    
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    pdf_service = PDFService(upload_folder)
+    ingest_service = IngestService(pdf_service, ArtifactCache(current_app.config['CACHE_FOLDER']))
+    documents = []
+    for document_id in dict.fromkeys(data['document_ids']):
+        document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+        if not document:
+            return jsonify({"error": f"Document {document_id} not found or access denied"}), 404
+        latest_version = document.get_version()
+        file_path = latest_version.local_path if latest_version else document.local_path
+        # Resolve the page selection now, so a malformed one is a 400 rather than a failed job
+        try:
+            parse_page_selection(data.get('pages'), ingest_service.get_info(file_path)['page_count'])
+        except ValueError as e:
+            return jsonify({"error": f"Document {document.id}: {e}"}), 400
+        documents.append((document.id, file_path))
+    
+    try:
+        # Reject malformed stamps now rather than in the job
+        pdf_service.build_stamp(data['stamp'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    job = job_queue.enqueue('stamp', user_id, _stamp_documents,
+                            user_id, documents, data['stamp'], data.get('pages'), upload_folder)
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
+
+@doc_bp.route('/<int:document_id>/ingest', methods=['GET'])
+@jwt_required()
+def get_ingest_status(document_id):
+    """Get the precompute (ingest) status of the latest or a given version (?version=<n>)"""
+    user_id = get_jwt_identity()
+    version = request.args.get('version', None)
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    ingest_service = IngestService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                                   ArtifactCache(current_app.config['CACHE_FOLDER']))
+    status = ingest_service.get_status(file_path) or {"status": "not_scheduled", "stages": {}}
+    return jsonify({
+        "document_id": document.id,
+        "version": document_version.version_number if document_version else 1,
+        **status
+    }), 200
+
+@doc_bp.route('/<int:document_id>/versions/<int:version_a>/diff/<int:version_b>', methods=['GET'])
+@jwt_required()
+@admission_control('diff')
+def diff_versions(document_id, version_a, version_b):
+    """Compare two versions of a document page by page
+
+    Pass raster=true to also get the bounding box of the changed region of
+    each changed page.
+    """
+    user_id = get_jwt_identity()
+    raster = request.args.get('raster', 'false').lower() in ('1', 'true', 'yes')
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    versions = {}
+    for version_number in (version_a, version_b):
+        versions[version_number] = document.get_version(version_number)
+        if not versions[version_number]:
+            return jsonify({"error": f"Version {version_number} not found"}), 404
+    
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+        diff_service = DiffService(pdf_service, TextLayerService(pdf_service, cache), cache)
+        
+        result = diff_service.diff(versions[version_a].local_path, versions[version_b].local_path, raster)
+        
+        return jsonify({
+            "document_id": document_id,
+            "version_a": version_a,
+            "version_b": version_b,
+            **result
+        }), 200
+        
+    except Exception as e:
+        current_app.logger.error(f"Error diffing versions {version_a} and {version_b} of document {document_id}: {e}")
+        return jsonify({"error": f"Failed to compare versions: {str(e)}"}), 500
@@ -0,0 +1,28 @@
+from flask import Blueprint, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+from models.db import Job
+
+job_bp = Blueprint('job_bp', __name__, url_prefix='/api/jobs')
+
+@job_bp.route('/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job_status(job_id):
+    """Get the status (and result, once finished) of a background job"""
+    user_id = get_jwt_identity()
+
+    job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+    if not job:
+        return jsonify({"error": "Job not found or access denied"}), 404
+
+    return jsonify({
+        "id": job.id,
+        "type": job.job_type,
+        "status": job.status,
+        "document_id": job.document_id,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }), 200
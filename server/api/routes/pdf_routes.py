@@ -1,11 +1,29 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import os
+import json
+import mimetypes
 # from werkzeug.utils import secure_filename # No longer needed here
 from werkzeug.exceptions import BadRequest, NotFound # Keep if other routes use them
 
 from models.db import db, Document, DocumentVersion # Document needed for access checks
+from models.routing import db_read_only
+from api.streaming import ndjson_chunks, zip_chunks, streaming_response
+from api.file_serving import serve_file
 from services.pdf.pdf_service import PDFService
+from services.pdf.text_layer import TextLayerService, decode_words, WORDS_MIMETYPE
+from services.pdf.search_service import SearchService
+from services.pdf.image_service import ImageService
+from services.pdf.page_ranges import parse_page_selection
+from services.pdf.form_service import FormService
+from services.pdf.stamp_service import StampService
+from services.cache.artifact_cache import ArtifactCache
+from services.jobs.job_queue import job_queue
+from services.storage.base import get_storage
+from services.pdf.ingest_service import IngestService, schedule_ingest
+from services.pdf.thumbnail_service import ThumbnailService
+from services.pdf.page_range_service import PageRangeService
+from api.admission import admission_control, run_in_background
 
 pdf_routes = Blueprint('pdf', __name__, url_prefix='/api/pdf')
 
@@ -13,6 +31,7 @@ pdf_routes = Blueprint('pdf', __name__, url_prefix='/api/pdf')
 
 @pdf_routes.route('/<int:document_id>/content', methods=['GET'])
 @jwt_required()
+@db_read_only
 def get_document_content(document_id):
     """Get the document content (PDF file)"""
     user_id = get_jwt_identity()
@@ -25,27 +44,162 @@ def get_document_content(document_id):
         return jsonify({"error": "Document not found or access denied"}), 404
     
     try:
-        # Get specific version if requested
-        if version:
-            document_version = DocumentVersion.query.filter_by(
-                document_id=document_id, version_number=version).first()
-            if not document_version:
-                return jsonify({"error": f"Version {version} not found"}), 404
-            file_path = document_version.file_path
-        else:
-            # Get latest version
-            latest_version = DocumentVersion.query.filter_by(document_id=document_id).order_by(
-                DocumentVersion.version_number.desc()).first()
-            file_path = latest_version.file_path if latest_version else document.file_path
+        # Get specific version if requested, otherwise the latest version
+        document_version = document.get_version(version)
+        if version and not document_version:
+            return jsonify({"error": f"Version {version} not found"}), 404
+        file_path = document_version.local_path if document_version else document.local_path
         
         # Return the file
-        return send_file(file_path, as_attachment=False, mimetype='application/pdf')
+        return serve_file(file_path, mimetype='application/pdf')
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/pages/<int:first_page>/pdf', methods=['GET'])
+@pdf_routes.route('/<int:document_id>/pages/<int:first_page>-<int:last_page>/pdf', methods=['GET'])
+@jwt_required()
+@db_read_only
+def get_page_range_content(document_id, first_page, last_page=None):
+    """Get a standalone PDF of one page or a short range of pages, for viewers that load pages on demand"""
+    user_id = get_jwt_identity()
+
+    version = request.args.get('version', None)
+    if last_page is None:
+        last_page = first_page
+    max_pages = current_app.config['PAGE_RANGE_MAX_PAGES']
+    if last_page - first_page + 1 > max_pages:
+        return jsonify({"error": f"A page range can have at most {max_pages} pages"}), 400
+
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+
+    try:
+        cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+        page_range_service = PageRangeService(PDFService(current_app.config['UPLOAD_FOLDER']), cache)
+        range_path, page_count = page_range_service.get_range_path(file_path, first_page, last_page)
+        response = serve_file(range_path, mimetype='application/pdf',
+                              etag=cache.etag_for(file_path, PageRangeService.artifact_name(first_page, last_page)))
+        if page_count is not None:
+            # Lets the viewer lay out the whole document from its first request
+            response.headers['X-Page-Count'] = str(page_count)
+        return response
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/pages/<int:page_number>/words', methods=['GET'])
+@jwt_required()
+@admission_control('text')
+def get_page_words(document_id, page_number):
+    """Get the words of a page with their bounding boxes
+
+    The word layer is served in a compact binary format by default
+    (see services/pdf/text_layer.py); pass format=json for a JSON rendering.
+    """
+    user_id = get_jwt_identity()
+    
+    # Get version and format parameters (optional)
+    version = request.args.get('version', None)
+    output_format = request.args.get('format', 'binary')
+    if output_format not in ('binary', 'json'):
+        return jsonify({"error": "Format must be 'binary' or 'json'"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+        text_layer = TextLayerService(PDFService(current_app.config['UPLOAD_FOLDER']), cache)
+        
+        words_path = text_layer.get_words_path(file_path, page_number)
+        etag = cache.etag_for(file_path, f"words/{page_number}.bin")
+        
+        if output_format == 'json':
+            with open(words_path, 'rb') as f:
+                response = jsonify(decode_words(f.read()))
+            response.set_etag(f"{etag}-json")
+            return response.make_conditional(request)
+        
+        return serve_file(words_path, mimetype=WORDS_MIMETYPE, etag=etag)
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/search', methods=['GET'])
+@jwt_required()
+@admission_control('text')
+def search_document(document_id):
+    """Search a document for a string
+
+    Results are streamed as NDJSON: one record per page with hits, in page
+    order, followed by a summary record with "done": true.
+    """
+    user_id = get_jwt_identity()
+    
+    query = request.args.get('q', '')
+    if not query.strip():
+        return jsonify({"error": "Missing search query"}), 400
+    
+    # Get version and max_hits parameters (optional)
+    version = request.args.get('version', None)
+    max_hits = request.args.get('max_hits', None)
+    if max_hits is not None:
+        try:
+            max_hits = int(max_hits)
+        except ValueError:
+            return jsonify({"error": "max_hits must be an integer"}), 400
+        if max_hits < 1:
+            return jsonify({"error": "max_hits must be at least 1"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        text_layer = TextLayerService(pdf_service, ArtifactCache(current_app.config['CACHE_FOLDER']))
+        search_service = SearchService(pdf_service, text_layer)
+        
+        results = search_service.search(file_path, query, max_hits)
+        # Build (or load) the page index before streaming starts, so errors
+        # are still reported with a proper status code
+        first_record = next(results)
+        
+        def records():
+            yield first_record
+            yield from results
+        
+        return streaming_response(ndjson_chunks(records()), 'application/x-ndjson')
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @pdf_routes.route('/<int:document_id>/extract-text', methods=['GET'])
 @jwt_required()
+@db_read_only
+@admission_control('text')
 def extract_text(document_id):
     """Extract text from a document"""
     user_id = get_jwt_identity()
@@ -67,7 +221,7 @@ def extract_text(document_id):
         pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
         
         # Extract text
-        text_data = pdf_service.extract_text(document.file_path, page)
+        text_data = pdf_service.extract_text(document.local_path, page)
         
         return jsonify({
             "document_id": document_id,
@@ -77,6 +231,203 @@ def extract_text(document_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@pdf_routes.route('/<int:document_id>/extract-text/stream', methods=['GET'])
+@jwt_required()
+@admission_control('text')
+def stream_text(document_id):
+    """Stream the text of a document as one NDJSON record per page"""
+    user_id = get_jwt_identity()
+    
+    # Get version parameter (optional)
+    version = request.args.get('version', None)
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        
+        # Open the document before streaming starts, so errors are still
+        # reported with a proper status code
+        pages = pdf_service.iter_text(file_path)
+        first_page = next(pages, None)
+        
+        def records():
+            if first_page is not None:
+                yield {"page": first_page[0], "text": first_page[1]}
+            for page_idx, text in pages:
+                yield {"page": page_idx, "text": text}
+        
+        return streaming_response(ndjson_chunks(records()), 'application/x-ndjson')
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/extract-images/stream', methods=['GET'])
+@jwt_required()
+@admission_control('images')
+def stream_images(document_id):
+    """Stream the images of a document as a zip archive"""
+    user_id = get_jwt_identity()
+    
+    # Get version and page parameters (optional)
+    version = request.args.get('version', None)
+    page = request.args.get('page', None)
+    if page is not None:
+        try:
+            page = int(page)
+        except ValueError:
+            return jsonify({"error": "Page must be an integer"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        image_service = ImageService(pdf_service, ArtifactCache(current_app.config['CACHE_FOLDER']))
+        index = image_service.get_index(file_path)
+        
+        # Open the document and decode the first image before streaming
+        # starts, so errors are still reported with a proper status code
+        images = pdf_service.iter_images(file_path, page)
+        first_image = next(images, None)
+        
+        def entries():
+            # Each unique image is stored once; index.json maps pages to xrefs
+            if first_image is not None:
+                yield f"xref{first_image['xref']}.{first_image['format']}", first_image['data']
+            for image in images:
+                yield f"xref{image['xref']}.{image['format']}", image['data']
+            yield "index.json", json.dumps(index).encode('utf-8')
+        
+        # Images are already compressed, so the archive is sent as-is
+        return streaming_response(
+            zip_chunks(entries()), 'application/zip', compress=False,
+            headers={"Content-Disposition": f"attachment; filename=document_{document_id}_images.zip"}
+        )
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/images', methods=['GET'])
+@jwt_required()
+@admission_control('images')
+def get_image_index(document_id):
+    """Get the metadata of every unique image and the page to xref map, without image data"""
+    user_id = get_jwt_identity()
+    
+    # Get version parameter (optional)
+    version = request.args.get('version', None)
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+        image_service = ImageService(PDFService(current_app.config['UPLOAD_FOLDER']), cache)
+        
+        index_path = image_service.get_index_path(file_path)
+        return serve_file(index_path, mimetype='application/json',
+                          etag=cache.etag_for(file_path, "images/index.json"))
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/images/<int:xref>', methods=['GET'])
+@jwt_required()
+def get_image(document_id, xref):
+    """Get a single image by xref, or a PNG thumbnail of it with ?thumbnail=<size>"""
+    user_id = get_jwt_identity()
+    
+    # Get version and thumbnail parameters (optional)
+    version = request.args.get('version', None)
+    thumbnail = request.args.get('thumbnail', None)
+    if thumbnail is not None:
+        try:
+            thumbnail = int(thumbnail)
+        except ValueError:
+            return jsonify({"error": "thumbnail must be an integer"}), 400
+        if not 16 <= thumbnail <= 1024:
+            return jsonify({"error": "thumbnail must be between 16 and 1024"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        image_service = ImageService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                                     ArtifactCache(current_app.config['CACHE_FOLDER']))
+        
+        if thumbnail:
+            return serve_file(image_service.get_thumbnail_path(file_path, xref, thumbnail), mimetype='image/png')
+        
+        image_path, image_format = image_service.get_image_path(file_path, xref)
+        mimetype = mimetypes.guess_type(f"image.{image_format}")[0] or 'application/octet-stream'
+        return serve_file(image_path, mimetype=mimetype)
+        
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/pages/<int:page_number>/thumbnail', methods=['GET'])
+@jwt_required()
+def get_page_thumbnail(document_id, page_number):
+    """Get a PNG thumbnail of a page (?size=<pixels>, default 200)"""
+    user_id = get_jwt_identity()
+    
+    version = request.args.get('version', None)
+    try:
+        size = int(request.args.get('size', current_app.config['INGEST_THUMBNAIL_SIZE']))
+    except ValueError:
+        return jsonify({"error": "size must be an integer"}), 400
+    if not 16 <= size <= 1024:
+        return jsonify({"error": "size must be between 16 and 1024"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+        thumbnail_service = ThumbnailService(PDFService(current_app.config['UPLOAD_FOLDER']), cache)
+        thumbnail_path = thumbnail_service.get_thumbnail_path(file_path, page_number, size)
+        return serve_file(thumbnail_path, mimetype='image/png',
+                          etag=cache.etag_for(file_path, f"thumbnails/{page_number}_{size}.png"))
+        
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @pdf_routes.route('/<int:document_id>/add-text', methods=['POST'])
 @jwt_required()
 def add_text(document_id):
@@ -99,7 +450,7 @@ def add_text(document_id):
         # Get the latest version's file path
         latest_version = DocumentVersion.query.filter_by(document_id=document_id).order_by(
             DocumentVersion.version_number.desc()).first()
-        file_path = latest_version.file_path if latest_version else document.file_path
+        file_path = latest_version.local_path if latest_version else document.local_path
         
         # Add text to the document
         new_file_path = pdf_service.add_text(
@@ -116,7 +467,7 @@ def add_text(document_id):
         new_version = DocumentVersion(
             document_id=document_id,
             version_number=new_version_number,
-            file_path=new_file_path,
+            file_path=get_storage().store(new_file_path),
             created_by=user_id
         )
         
@@ -126,6 +477,7 @@ def add_text(document_id):
         # Update document's updated_at timestamp
         document.updated_at = DocumentVersion.created_at
         db.session.commit()
+        schedule_ingest(user_id, document_id, new_version.local_path)
         
         return jsonify({
             "success": True,
@@ -136,3 +488,369 @@ def add_text(document_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+
+def _apply_page_operation(document_id, operation, validate=None):
+    """Run a page-structure operation on the latest version and store the result as a new version
+
+    Runs as a background job (answering 202) when admission control finds
+    the document too expensive to rewrite within the request. The request
+    is validated first, so invalid input is a 400 rather than a failed job.
+
+    Args:
+        document_id: ID of the document to modify
+        operation: Callable (pdf_service, file_path, page_count) -> new file path;
+                   may raise ValueError for invalid input
+        validate: Optional callable with the same arguments that raises
+                  ValueError for invalid input, run before queueing a job
+                  (an inline run relies on the operation's own checks)
+    """
+    user_id = get_jwt_identity()
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    if run_in_background():
+        if validate:
+            latest_version = document.get_version()
+            file_path = latest_version.local_path if latest_version else document.local_path
+            pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+            try:
+                page_count = IngestService(pdf_service, ArtifactCache(current_app.config['CACHE_FOLDER'])).get_info(
+                    file_path)['page_count']
+                validate(pdf_service, file_path, page_count)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except Exception as e:
+                return jsonify({"error": str(e)}), 500
+        
+        job = job_queue.enqueue('page_operation', user_id, _run_page_operation,
+                                user_id, document_id, operation, current_app.config['UPLOAD_FOLDER'],
+                                document_id=document_id)
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}"
+        }), 202
+    
+    try:
+        return jsonify(_run_page_operation(user_id, document_id, operation,
+                                           current_app.config['UPLOAD_FOLDER'])), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def _run_page_operation(user_id, document_id, operation, upload_folder):
+    """Apply a page operation and record the new version (inline, or as a job)"""
+    document = db.session.get(Document, document_id)
+    if document is None:
+        # Deleted while the job was queued
+        raise ValueError("The document has been deleted")
+    latest_version = document.get_version()
+    file_path = latest_version.local_path if latest_version else document.local_path
+    
+    try:
+        pdf_service = PDFService(upload_folder)
+        page_count = pdf_service.get_document_info(file_path)['page_count']
+        
+        new_file_path = operation(pdf_service, file_path, page_count)
+        
+        new_version = document.add_version(new_file_path, user_id)
+        db.session.commit()
+        schedule_ingest(user_id, document_id, new_version.local_path)
+        
+        return {
+            "success": True,
+            "document_id": document_id,
+            "version": new_version.version_number,
+            "page_count": pdf_service.get_document_info(new_file_path)['page_count']
+        }
+        
+    except Exception:
+        db.session.rollback()
+        raise
+
+@pdf_routes.route('/<int:document_id>/pages/select', methods=['POST'])
+@jwt_required()
+@admission_control('page_operation', background=True)
+def select_pages(document_id):
+    """Keep only the given pages, in the given order (reorder, subset or duplicate pages)"""
+    data = request.json
+    if not data or 'pages' not in data:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    return _apply_page_operation(document_id, lambda pdf_service, file_path, page_count: pdf_service.select_pages(
+        file_path, parse_page_selection(data['pages'], page_count)),
+        lambda pdf_service, file_path, page_count: parse_page_selection(data['pages'], page_count))
+
+@pdf_routes.route('/<int:document_id>/pages/move', methods=['POST'])
+@jwt_required()
+@admission_control('page_operation', background=True)
+def move_page(document_id):
+    """Move a page to a new position"""
+    data = request.json
+    if not data or not all(isinstance(data.get(k), int) for k in ('page', 'to')):
+        return jsonify({"error": "page and to must be integers"}), 400
+    
+    def validate(pdf_service, file_path, page_count):
+        for value in (data['page'], data['to']):
+            if not 0 <= value < page_count:
+                raise ValueError(f"Page number {value} out of range (0-{page_count-1})")
+    
+    return _apply_page_operation(document_id, lambda pdf_service, file_path, page_count: pdf_service.move_page(
+        file_path, data['page'], data['to']), validate)
+
+@pdf_routes.route('/<int:document_id>/pages/delete', methods=['POST'])
+@jwt_required()
+@admission_control('page_operation', background=True)
+def delete_pages(document_id):
+    """Delete pages from a document"""
+    data = request.json
+    if not data or 'pages' not in data:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    return _apply_page_operation(document_id, lambda pdf_service, file_path, page_count: pdf_service.delete_pages(
+        file_path, parse_page_selection(data['pages'], page_count)),
+        lambda pdf_service, file_path, page_count: parse_page_selection(data['pages'], page_count))
+
+@pdf_routes.route('/<int:document_id>/pages/extract', methods=['POST'])
+@jwt_required()
+@admission_control('split')
+def extract_pages(document_id):
+    """Copy a range of pages into a new document"""
+    user_id = get_jwt_identity()
+    
+    data = request.json
+    if not data or 'pages' not in data:
+        return jsonify({"error": "Missing required fields"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    latest_version = document.get_version()
+    file_path = latest_version.local_path if latest_version else document.local_path
+    
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        page_count = pdf_service.get_document_info(file_path)['page_count']
+        pages = parse_page_selection(data['pages'], page_count)
+        
+        new_file_path = pdf_service.split_pdf(file_path, [pages])[0]
+        new_document = Document.create_from_file(
+            data.get('title', f"{document.title} (pages)"), new_file_path, user_id)
+        db.session.commit()
+        schedule_ingest(user_id, new_document.id, new_document.local_path)
+        
+        return jsonify({
+            "success": True,
+            "document_id": new_document.id,
+            "page_count": len(pages)
+        }), 201
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/split', methods=['POST'])
+@jwt_required()
+@admission_control('split')
+def split_document(document_id):
+    """Split a document into several new documents
+
+    Pass either "every": N to cut it into chunks of N pages, or "ranges":
+    a list of page selections, one per new document.
+    """
+    user_id = get_jwt_identity()
+    
+    data = request.json
+    if not data or ('every' not in data and 'ranges' not in data):
+        return jsonify({"error": "Provide either 'every' or 'ranges'"}), 400
+    if 'every' in data and (not isinstance(data['every'], int) or data['every'] < 1):
+        return jsonify({"error": "every must be a positive integer"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    latest_version = document.get_version()
+    file_path = latest_version.local_path if latest_version else document.local_path
+    
+    new_file_paths = []
+    try:
+        pdf_service = PDFService(current_app.config['UPLOAD_FOLDER'])
+        page_count = pdf_service.get_document_info(file_path)['page_count']
+        
+        if 'every' in data:
+            page_groups = [list(range(start, min(start + data['every'], page_count)))
+                           for start in range(0, page_count, data['every'])]
+        else:
+            if not isinstance(data['ranges'], list) or not data['ranges']:
+                return jsonify({"error": "ranges must be a non-empty list"}), 400
+            page_groups = [parse_page_selection(selection, page_count) for selection in data['ranges']]
+        
+        new_file_paths = pdf_service.split_pdf(file_path, page_groups)
+        new_documents = [
+            Document.create_from_file(f"{document.title} (part {i + 1})", path, user_id)
+            for i, path in enumerate(new_file_paths)
+        ]
+        db.session.commit()
+        for new_document in new_documents:
+            schedule_ingest(user_id, new_document.id, new_document.local_path)
+        
+        return jsonify({
+            "success": True,
+            "documents": [
+                {"document_id": new_document.id, "page_count": len(pages)}
+                for new_document, pages in zip(new_documents, page_groups)
+            ]
+        }), 201
+        
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        for path in new_file_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/forms', methods=['GET'])
+@jwt_required()
+@admission_control('forms')
+def get_form_fields(document_id):
+    """Get the form fields of a document (name -> widgets with page, xref and type)"""
+    user_id = get_jwt_identity()
+    version = request.args.get('version', None)
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    document_version = document.get_version(version)
+    if version and not document_version:
+        return jsonify({"error": f"Version {version} not found"}), 404
+    file_path = document_version.local_path if document_version else document.local_path
+    
+    try:
+        form_service = FormService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                                   ArtifactCache(current_app.config['CACHE_FOLDER']))
+        return jsonify(form_service.get_fields(file_path)), 200
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@pdf_routes.route('/<int:document_id>/forms/fill', methods=['POST'])
+@jwt_required()
+@admission_control('page_operation', background=True)
+def fill_form(document_id):
+    """Fill form fields and store the result as a new version"""
+    data = request.json
+    if not data or not isinstance(data.get('values'), dict):
+        return jsonify({"error": "values must be an object of field names to values"}), 400
+    
+    cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+    return _apply_page_operation(document_id, lambda pdf_service, file_path, page_count: FormService(
+        pdf_service, cache).fill(file_path, data['values']),
+        lambda pdf_service, file_path, page_count: FormService(pdf_service, cache).check_values(
+            file_path, data['values']))
+
+@pdf_routes.route('/<int:document_id>/stamp', methods=['POST'])
+@jwt_required()
+@admission_control('stamp', background=True)
+def stamp_document(document_id):
+    """Stamp or watermark pages with text or an image (new version)
+
+    Body: {"stamp": {"text": ... | "image": <base64>, "opacity", "position",
+    "width", "height", "rotate", "overlay", ...}, "pages": <selection>}.
+    """
+    data = request.json
+    if not data or not isinstance(data.get('stamp'), dict):
+        return jsonify({"error": "stamp must be an object"}), 400
+    
+    def validate(pdf_service, file_path, page_count):
+        parse_page_selection(data.get('pages'), page_count)
+        pdf_service.build_stamp(data['stamp'])
+    
+    return _apply_page_operation(document_id, lambda pdf_service, file_path, page_count: StampService(
+        pdf_service).stamp(file_path, data['stamp'], data.get('pages')), validate)
+
+def _fill_form_batch(user_id, document_id, file_path, records, merge, title, upload_folder, cache_folder):
+    """Fill a template once per record and record the outputs as new documents (runs as a job)"""
+    form_service = FormService(PDFService(upload_folder), ArtifactCache(cache_folder))
+    output_paths = form_service.fill_batch(file_path, records, merge=merge)
+    
+    try:
+        if merge:
+            new_documents = [Document.create_from_file(title, output_paths[0], user_id)]
+        else:
+            new_documents = [
+                Document.create_from_file(f"{title} ({i + 1})", path, user_id)
+                for i, path in enumerate(output_paths)
+            ]
+        db.session.commit()
+        for new_document in new_documents:
+            schedule_ingest(user_id, new_document.id, new_document.local_path)
+        return {"document_ids": [new_document.id for new_document in new_documents]}
+        
+    except Exception:
+        db.session.rollback()
+        for path in output_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+@pdf_routes.route('/<int:document_id>/forms/batch', methods=['POST'])
+@jwt_required()
+@admission_control('forms')
+def fill_form_batch(document_id):
+    """Fill a form template once per record in the background
+
+    Body: {"records": [{field: value, ...}, ...], "merge": false, "title": "..."}.
+    Produces one new document per record, or a single merged document when
+    merge is true. Returns a job to poll at /api/jobs/<job_id>.
+    """
+    user_id = get_jwt_identity()
+    
+    data = request.json
+    records = data.get('records') if data else None
+    if not isinstance(records, list) or not records or not all(isinstance(r, dict) for r in records):
+        return jsonify({"error": "records must be a non-empty list of objects"}), 400
+    max_records = current_app.config['FORM_BATCH_MAX_RECORDS']
+    if len(records) > max_records:
+        return jsonify({"error": f"At most {max_records} records can be filled per request"}), 400
+    
+    document = Document.query.filter_by(id=document_id, user_id=user_id).first()
+    if not document:
+        return jsonify({"error": "Document not found or access denied"}), 404
+    
+    latest_version = document.get_version()
+    file_path = latest_version.local_path if latest_version else document.local_path
+    
+    try:
+        # Validate field names up front so typos fail fast instead of in the job
+        fields = FormService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                             ArtifactCache(current_app.config['CACHE_FOLDER'])).get_fields(file_path)
+        unknown = sorted({name for record in records for name in record} - set(fields))
+        if unknown:
+            return jsonify({"error": f"Unknown form fields: {', '.join(unknown)}"}), 400
+        
+        job = job_queue.enqueue('form_batch', user_id, _fill_form_batch,
+                                user_id, document_id, file_path, records, bool(data.get('merge')),
+                                data.get('title', f"{document.title} (filled)"),
+                                current_app.config['UPLOAD_FOLDER'], current_app.config['CACHE_FOLDER'],
+                                document_id=document_id)
+        return jsonify({
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/jobs/{job.id}",
+            "records": len(records)
+        }), 202
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
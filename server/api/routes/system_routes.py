@@ -0,0 +1,29 @@
+from flask import Blueprint, jsonify, current_app
+from flask_jwt_extended import jwt_required
+
+from models.db import db
+from models.routing import pool_stats
+from services.pdf.memory import get_memory_governor
+
+system_bp = Blueprint('system_bp', __name__, url_prefix='/api/system')
+
+@system_bp.route('/db-pools', methods=['GET'])
+@jwt_required()
+def get_db_pools():
+    """Get the connection pool statistics of this server process, per database engine"""
+    return jsonify(pool_stats(db)), 200
+
+@system_bp.route('/admission', methods=['GET'])
+@jwt_required()
+def get_admission_stats():
+    """Get the admission control budgets and counters of this server process, per cost class"""
+    controller = current_app.extensions.get('admission')
+    if controller is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, "classes": controller.stats()}), 200
+
+@system_bp.route('/memory', methods=['GET'])
+@jwt_required()
+def get_memory_stats():
+    """Get the memory figures of this server process, with the MuPDF store and memory per PDF operation and endpoint"""
+    return jsonify(get_memory_governor().stats()), 200
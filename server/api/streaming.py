@@ -0,0 +1,112 @@
+import json
+import zlib
+import zipfile
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+class _ChunkSink:
+    """Write-only file object that collects written bytes until drained
+
+    It has no tell()/seek(), so zipfile writes entries with data
+    descriptors instead of seeking back into the output.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def ndjson_chunks(records: Iterable[Dict]) -> Iterator[bytes]:
+    """Serialize records as newline-delimited JSON, one chunk per record"""
+    for record in records:
+        yield (json.dumps(record) + '\n').encode('utf-8')
+
+def zip_chunks(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """
+    Build a zip archive incrementally
+
+    Entries are stored without recompression (they are usually images that
+    are already compressed) and each entry is emitted as soon as it is written,
+    so only one entry is held in memory at a time.
+
+    Args:
+        entries: Iterable of (archive name, data) tuples
+
+    Yields:
+        Chunks of the zip archive
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the best supported content encoding from an Accept-Encoding header"""
+    accepted = {token.split(';')[0].strip().lower() for token in accept_encoding.split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def encode_chunks(chunks: Iterable[bytes], encoding: Optional[str]) -> Iterator[bytes]:
+    """
+    Compress a stream of chunks with the given content encoding
+
+    Every chunk is flushed through the compressor, so clients receive each
+    record as soon as it has been produced.
+    """
+    if encoding is None:
+        yield from chunks
+        return
+
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+def streaming_response(chunks: Iterable[bytes], mimetype: str, compress: bool = True,
+                       headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Build a streamed response, compressed according to the request's Accept-Encoding
+
+    Args:
+        chunks: Iterable of response body chunks
+        mimetype: Response content type
+        compress: Whether to apply gzip/brotli content encoding
+        headers: Optional extra response headers
+
+    Returns:
+        Flask response that streams the chunks
+    """
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', '')) if compress else None
+    response = Response(encode_chunks(chunks, encoding), mimetype=mimetype, headers=headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compress:
+        response.vary.add('Accept-Encoding')
+    return response
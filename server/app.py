@@ -6,6 +6,13 @@ import os
 
 from api.routes import register_routes
 from models.db import init_db
+from services.jobs.job_queue import init_jobs
+from services.storage.storage import init_storage
+from services.ai.corpus_index import init_corpus
+from api.admission import init_admission
+from api.file_serving import init_file_serving
+from services.pdf.pdf_service import PDFService
+from services.pdf.memory import configure_memory
 
 # Load environment variables
 load_dotenv()
@@ -20,9 +27,72 @@ def create_app(test_config=None):
         JWT_SECRET_KEY=os.environ.get('JWT_SECRET_KEY', 'dev'),
         SQLALCHEMY_DATABASE_URI=os.environ.get('DATABASE_URL', 'postgresql://localhost/pdf_editor'),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        DATABASE_REPLICA_URL=os.environ.get('DATABASE_REPLICA_URL'),  # Serves the read-only routes when set
+        DB_POOL_SIZE=int(os.environ.get('DB_POOL_SIZE', 10)),
+        DB_MAX_OVERFLOW=int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        DB_POOL_TIMEOUT=float(os.environ.get('DB_POOL_TIMEOUT', 10)),  # Seconds to wait for a connection
+        DB_POOL_RECYCLE=int(os.environ.get('DB_POOL_RECYCLE', 1800)),  # Seconds before a connection is replaced
+        DB_POOL_PRE_PING=os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        DB_REPLICA_STICKY_SECONDS=float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5)),  # Read from the primary after a write
         UPLOAD_FOLDER=os.environ.get('UPLOAD_FOLDER', os.path.join(app.instance_path, 'uploads')),
+        CACHE_FOLDER=os.environ.get('CACHE_FOLDER', os.path.join(app.instance_path, 'cache')),
         MAX_CONTENT_LENGTH=50 * 1024 * 1024,  # 50MB max upload
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY'),
+        OPENAI_MODEL=os.environ.get('OPENAI_MODEL', 'gpt-4'),
+        OPENAI_API_URL=os.environ.get('OPENAI_API_URL', 'https://api.openai.com/v1/chat/completions'),
+        LLM_MAX_CONCURRENCY=int(os.environ.get('LLM_MAX_CONCURRENCY', 8)),  # Per process; adapts downwards on overload
+        LLM_TOKENS_PER_MINUTE=int(os.environ.get('LLM_TOKENS_PER_MINUTE', 0)),  # Per process; 0 for no limit
+        LLM_TIMEOUT=float(os.environ.get('LLM_TIMEOUT', 60)),  # Seconds per attempt
+        LLM_MAX_RETRIES=int(os.environ.get('LLM_MAX_RETRIES', 3)),
+        LLM_CIRCUIT_FAILURES=int(os.environ.get('LLM_CIRCUIT_FAILURES', 5)),  # Consecutive failures that open the circuit
+        LLM_CIRCUIT_RESET=float(os.environ.get('LLM_CIRCUIT_RESET', 30)),  # Seconds before a trial call
+        LLM_QUEUE_TIMEOUT=float(os.environ.get('LLM_QUEUE_TIMEOUT', 30)),  # Seconds to wait for a free slot
+        JOB_WORKERS=int(os.environ.get('JOB_WORKERS', 2)),
+        MERGE_ASYNC_THRESHOLD=int(os.environ.get('MERGE_ASYNC_THRESHOLD', 20 * 1024 * 1024)),  # Queue merges above 20MB of input
+        DB_CREATE_ALL_ON_STARTUP=os.environ.get('DB_CREATE_ALL_ON_STARTUP', 'false').lower() == 'true',
+        ASGI_EXECUTOR_WORKERS=int(os.environ.get('ASGI_EXECUTOR_WORKERS', 16)),  # Threads for sync work in ASGI mode
+        INGEST_STAGES=[stage.strip() for stage in os.environ.get(
+            'INGEST_STAGES', 'hash,metadata,text,thumbnails,search,corpus').split(',') if stage.strip()],  # Empty disables warming
+        INGEST_THUMBNAIL_SIZE=int(os.environ.get('INGEST_THUMBNAIL_SIZE', 200)),
+        CORPUS_INDEX_PATH=os.environ.get('CORPUS_INDEX_PATH'),  # SQLite page index for /api/ai/ask, default corpus.db in CACHE_FOLDER
+        CORPUS_MAX_HITS=int(os.environ.get('CORPUS_MAX_HITS', 50)),  # Pages retrieved per question
+        CORPUS_CONTEXT_TOKENS=int(os.environ.get('CORPUS_CONTEXT_TOKENS', 12000)),  # Page text sent to the LLM per question
+        CORPUS_CALL_TOKENS=int(os.environ.get('CORPUS_CALL_TOKENS', 3000)),  # Page text per LLM call; calls run concurrently
+        STORAGE_BACKEND=os.environ.get('STORAGE_BACKEND', 'local'),  # local, s3 or directory
+        STORAGE_BUCKET=os.environ.get('STORAGE_BUCKET', 'documents'),
+        STORAGE_ENDPOINT_URL=os.environ.get('STORAGE_ENDPOINT_URL'),  # S3-compatible services such as MinIO
+        STORAGE_DIRECTORY=os.environ.get('STORAGE_DIRECTORY', os.path.join(app.instance_path, 'objects')),
+        FILE_SERVING=os.environ.get('FILE_SERVING', 'sendfile'),  # sendfile, x-sendfile or x-accel-redirect
+        FILE_SERVING_ACCEL_PREFIX=os.environ.get('FILE_SERVING_ACCEL_PREFIX', '/_files'),  # Internal nginx location
+        PAGE_RANGE_MAX_PAGES=int(os.environ.get('PAGE_RANGE_MAX_PAGES', 20)),  # Pages per standalone page-range PDF
+        COLD_AFTER_DAYS=float(os.environ.get('COLD_AFTER_DAYS', 30)),  # Days without access before old versions are compressed
+        COLD_CODEC=os.environ.get('COLD_CODEC', 'xz'),  # xz, or zstd (needs zstandard; enables family dictionaries)
+        COLD_LEVEL=int(os.environ['COLD_LEVEL']) if os.environ.get('COLD_LEVEL') else None,  # Codec default if unset
+        COLD_DICTIONARY=os.environ.get('COLD_DICTIONARY', 'true').lower() == 'true',  # Train a zstd dictionary per document
+        COLD_MIN_SAVING=float(os.environ.get('COLD_MIN_SAVING', 0.05)),  # Keep files hot that compress by less
+        PDF_OPEN_MMAP=os.environ.get('PDF_OPEN_MMAP', 'true').lower() == 'true',  # Open PDFs from memory maps
+        MUPDF_STORE_MAX_MB=int(os.environ.get('MUPDF_STORE_MAX_MB', 0)),  # MuPDF store kept after each call, 0 for MuPDF's own 256MB
+        MUPDF_HEAVY_DELTA_MB=int(os.environ.get('MUPDF_HEAVY_DELTA_MB', 64)),  # RSS growth that releases MuPDF caches after a call
+        MUPDF_RSS_SOFT_LIMIT_MB=int(os.environ.get('MUPDF_RSS_SOFT_LIMIT_MB', 0)),  # Release caches after every call above this RSS, 0 for none
+        MUPDF_LOW_MEMORY=os.environ.get('MUPDF_LOW_MEMORY', 'false').lower() == 'true',  # Disable display list caching
+        ADMISSION_ENABLED=os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true',
+        ADMISSION_BYTES_PER_PAGE=int(os.environ.get('ADMISSION_BYTES_PER_PAGE', 100 * 1024)),  # File size counted as one page
+        ADMISSION_MEDIUM_COST=float(os.environ.get('ADMISSION_MEDIUM_COST', 200)),  # Cost units (pages x operation weight)
+        ADMISSION_HEAVY_COST=float(os.environ.get('ADMISSION_HEAVY_COST', 2000)),
+        ADMISSION_MEDIUM_GLOBAL=int(os.environ.get('ADMISSION_MEDIUM_GLOBAL', 8)),  # Concurrent requests per process, 0 for no limit
+        ADMISSION_MEDIUM_PER_USER=int(os.environ.get('ADMISSION_MEDIUM_PER_USER', 2)),
+        ADMISSION_HEAVY_GLOBAL=int(os.environ.get('ADMISSION_HEAVY_GLOBAL', 2)),
+        ADMISSION_HEAVY_PER_USER=int(os.environ.get('ADMISSION_HEAVY_PER_USER', 1)),
+        ADMISSION_RETRY_AFTER=int(os.environ.get('ADMISSION_RETRY_AFTER', 5)),  # Seconds, sent with 429/503
+        ANNOTATION_SNAPSHOT_INTERVAL=int(os.environ.get('ANNOTATION_SNAPSHOT_INTERVAL', 50)),  # Annotation edits between materialized snapshots
+        ANNOTATION_MAX_IMAGE_BYTES=int(os.environ.get('ANNOTATION_MAX_IMAGE_BYTES', 2 * 1024 * 1024)),
+        BULK_DELETE_MAX_IDS=int(os.environ.get('BULK_DELETE_MAX_IDS', 1000)),
+        FORM_BATCH_MAX_RECORDS=int(os.environ.get('FORM_BATCH_MAX_RECORDS', 1000)),  # Records per form batch request
+        REAPER_BATCH_SIZE=int(os.environ.get('REAPER_BATCH_SIZE', 100)),  # Deleted documents removed per commit
+        REAPER_MAX_ATTEMPTS=int(os.environ.get('REAPER_MAX_ATTEMPTS', 3)),  # Tries per file before leaving it for `flask reap-documents`
     )
+    if test_config is not None:
+        app.config.from_mapping(test_config)
 
     # Ensure the instance folder exists
     try:
@@ -30,6 +100,7 @@ def create_app(test_config=None):
         os.makedirs(app.config['UPLOAD_FOLDER'])
     except OSError:
         pass
+    os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
 
     # Enable CORS
     CORS(app)
@@ -40,12 +111,31 @@ def create_app(test_config=None):
     # Initialize database
     init_db(app)
     
+    # Initialize file storage
+    init_storage(app)
+    
+    # Register the corpus index commands
+    init_corpus(app)
+    
+    # Initialize background job queue
+    init_jobs(app)
+    
+    # Configure how files are sent and opened
+    init_file_serving(app)
+    PDFService.use_mmap = app.config['PDF_OPEN_MMAP']
+    
+    # Configure the per-process MuPDF memory budget
+    configure_memory(app.config)
+    
+    # Initialize admission control for expensive PDF operations
+    init_admission(app)
+    
     # Register API routes
     register_routes(app)
     
     return app
 
-app = create_app()
-
+# The app is created by the server (flask run, gunicorn "app:create_app()",
+# or asgi.py), not at import time, so importing this module stays cheap
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,10 @@
+"""ASGI entry point
+
+Run with an ASGI server, one event loop per worker process, e.g.:
+
+    uvicorn asgi:app --workers 4
+"""
+from app import create_app
+from api.asgi import AsyncApp
+
+app = AsyncApp(create_app())
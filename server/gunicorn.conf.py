@@ -0,0 +1,33 @@
+"""Gunicorn configuration
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded in the master process and then forked, so workers
+share the imported code copy-on-write and start almost instantly.
+"""
+import os
+
+from services.lazy import warm_imports
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Load PyMuPDF and the AI stack in the master as well, so no worker pays for
+# them on its first request. Leave off to keep the master small.
+preload_heavy_imports = os.environ.get('PRELOAD_HEAVY_IMPORTS', 'false').lower() == 'true'
+
+def on_starting(server):
+    if preload_app and preload_heavy_imports:
+        warm_imports()
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master process"""
+    if not preload_app:
+        return
+    from models.db import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
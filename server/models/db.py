@@ -1,13 +1,37 @@
+import os
+import click
+from flask.cli import with_appcontext
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exists, insert, literal, select
+from sqlalchemy.orm import with_loader_criteria
 from datetime import datetime
 
-db = SQLAlchemy()
+from services.storage.base import get_storage
+from models.routing import RoutingSession, configure_engines
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def init_db(app):
-    """Initialize the database with the Flask app"""
+    """Initialize the database with the Flask app
+
+    Tables are created by the `flask init-db` command rather than on every
+    worker boot; set DB_CREATE_ALL_ON_STARTUP to restore the old behaviour
+    for local development. Pool options and the read replica are configured
+    from the DB_* settings (see models/routing.py).
+    """
+    configure_engines(app)
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+    app.cli.add_command(init_db_command)
+    if app.config.get('DB_CREATE_ALL_ON_STARTUP'):
+        with app.app_context():
+            db.create_all()
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create all database tables that do not exist yet"""
+    db.create_all()
+    click.echo('Initialized the database.')
 
 class User(db.Model):
     """User model for authentication and document ownership"""
@@ -32,12 +56,80 @@ class Document(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
-    file_path = db.Column(db.String(500), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)  # Storage key (absolute path for legacy rows)
     file_size = db.Column(db.Integer, nullable=False)  # Size in bytes
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    @classmethod
+    def create_from_file(cls, title, file_path, user_id):
+        """Create a document with an initial version for a file already on disk (the caller commits)"""
+        file_size = os.path.getsize(file_path)
+        key = get_storage().store(file_path)
+        document = cls(
+            title=title,
+            filename=os.path.basename(file_path),
+            file_path=key,
+            file_size=file_size,
+            user_id=user_id
+        )
+        db.session.add(document)
+        db.session.flush()  # Assigns document.id
+        
+        db.session.add(DocumentVersion(
+            document_id=document.id,
+            version_number=1,
+            file_path=key,
+            created_by=user_id
+        ))
+        return document
+    
+    @classmethod
+    def tombstone(cls, document_ids, user_id):
+        """
+        Mark documents of a user as deleted (the caller commits)
+
+        The documents disappear from every query at once; their rows and
+        files are removed later by the reaper (services/storage/reaper.py).
+
+        Returns:
+            IDs of the documents that were marked (the others do not exist,
+            belong to another user or are already deleted)
+        """
+        found = [row[0] for row in db.session.execute(
+            select(cls.id).where(cls.id.in_(document_ids), cls.user_id == user_id))]
+        if found:
+            db.session.execute(insert(DocumentTombstone).from_select(
+                ['document_id', 'user_id', 'deleted_at'],
+                select(cls.id, cls.user_id, literal(datetime.utcnow())).where(cls.id.in_(found))))
+        return found
+    
+    @property
+    def local_path(self):
+        """Local path of the original file (fetched from storage if needed)"""
+        return get_storage().local_path(self.file_path)
+    
+    def get_version(self, version_number=None):
+        """Return the requested version, or the latest one if no number is given"""
+        query = DocumentVersion.query.filter_by(document_id=self.id)
+        if version_number is not None:
+            return query.filter_by(version_number=version_number).first()
+        return query.order_by(DocumentVersion.version_number.desc()).first()
+    
+    def add_version(self, file_path, user_id):
+        """Add a new version from the file at file_path, handing it to storage (the caller commits the session)"""
+        latest_version = self.get_version()
+        new_version = DocumentVersion(
+            document_id=self.id,
+            version_number=(latest_version.version_number + 1) if latest_version else 2,
+            file_path=get_storage().store(file_path),
+            created_by=user_id
+        )
+        db.session.add(new_version)
+        self.updated_at = datetime.utcnow()
+        return new_version
+    
     def __repr__(self):
         return f'<Document {self.title}>'
 
@@ -48,11 +140,85 @@ class DocumentVersion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
     version_number = db.Column(db.Integer, nullable=False)
-    file_path = db.Column(db.String(500), nullable=False)
+    file_path = db.Column(db.String(500), nullable=False)  # Storage key (absolute path for legacy rows)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     
     document = db.relationship('Document', backref='versions')
     
+    @property
+    def local_path(self):
+        """Local path of this version's file (fetched from storage if needed)"""
+        return get_storage().local_path(self.file_path)
+    
     def __repr__(self):
         return f'<DocumentVersion {self.document_id}-{self.version_number}>'
+
+class Job(db.Model):
+    """Background job model for tracking long-running operations"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.job_type} {self.status}>'
+
+class DocumentTombstone(db.Model):
+    """Marks a deleted document whose rows and files are still to be removed by the reaper"""
+    __tablename__ = 'document_tombstones'
+    
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)  # Reaper runs that failed to remove every file
+    last_error = db.Column(db.Text, nullable=True)
+    
+    def __repr__(self):
+        return f'<DocumentTombstone {self.document_id}>'
+
+class AnnotationOperation(db.Model):
+    """One operation on a document's annotation layer (an edit of an element, an undo or a commit), in order"""
+    __tablename__ = 'annotation_operations'
+    __table_args__ = (db.UniqueConstraint('document_id', 'seq'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)  # Position in the document's log, from 1
+    op = db.Column(db.String(10), nullable=False)  # add, update, delete, undo or commit
+    element_id = db.Column(db.String(36), nullable=False)  # Element of the (undone) edit, empty for commit
+    payload = db.Column(db.JSON, nullable=True)  # Element (add) or changed properties (update)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnnotationOperation {self.document_id}-{self.seq} {self.op}>'
+
+class AnnotationSnapshot(db.Model):
+    """Materialized annotation layer after a number of operations, so reads replay only the operations after it"""
+    __tablename__ = 'annotation_snapshots'
+
+    document_id = db.Column(db.Integer, db.ForeignKey('documents.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)  # Last operation included
+    elements = db.Column(db.JSON, nullable=False)  # Elements in drawing order
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<AnnotationSnapshot {self.document_id}-{self.seq}>'
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _hide_deleted_documents(execute_state):
+    """Leave tombstoned documents out of every query, unless it sets the include_deleted option"""
+    if execute_state.is_select and not execute_state.execution_options.get('include_deleted', False):
+        execute_state.statement = execute_state.statement.options(with_loader_criteria(
+            Document,
+            lambda cls: ~exists().where(DocumentTombstone.document_id == cls.id),
+            include_aliases=True))
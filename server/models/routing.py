@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+
+_routed = {'primary': 0, 'replica': 0}
+_routed_lock = threading.Lock()
+
+def engine_options(url: str, config) -> Dict:
+    """
+    Build the SQLAlchemy engine options of a database URL from the app config
+
+    Pool sizing only applies to server databases; SQLite keeps the pool
+    class Flask-SQLAlchemy picks for it.
+    """
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE']
+    }
+    if not url.startswith('sqlite'):
+        options.update(
+            pool_size=config['DB_POOL_SIZE'],
+            max_overflow=config['DB_MAX_OVERFLOW'],
+            pool_timeout=config['DB_POOL_TIMEOUT']
+        )
+    return options
+
+def configure_engines(app) -> None:
+    """Set the pool options of the primary and, if DATABASE_REPLICA_URL is set, add the replica bind"""
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                          engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+    replica_url = app.config.get('DATABASE_REPLICA_URL')
+    if replica_url:
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, {'url': replica_url, **engine_options(replica_url, app.config)})
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+def db_read_only(view):
+    """
+    Mark a route as read-only, so its queries may be served by the replica
+
+    Apply below @jwt_required(). Requests of a user who wrote within the last
+    DB_REPLICA_STICKY_SECONDS still read from the primary, so a client sees
+    its own writes despite replication lag.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask_jwt_extended import get_jwt_identity
+        g.db_read_only = True
+        g.db_user_id = get_jwt_identity()
+        return view(*args, **kwargs)
+    return wrapper
+
+def _marker_path(user_id) -> str:
+    return os.path.join(current_app.config['CACHE_FOLDER'], 'db-writes', str(user_id))
+
+def record_write(user_id) -> None:
+    """Remember that a user just wrote to the primary (shared by the worker processes of a host)"""
+    path = _marker_path(user_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a'):
+            os.utime(path)
+    except OSError as e:
+        current_app.logger.warning(f"Could not record write for user {user_id}: {e}")
+
+def wrote_recently(user_id) -> bool:
+    """Whether a user wrote within the replica stickiness window"""
+    window = current_app.config.get('DB_REPLICA_STICKY_SECONDS', 0)
+    if user_id is None or window <= 0:
+        return False
+    try:
+        return time.time() - os.stat(_marker_path(user_id)).st_mtime < window
+    except OSError:
+        return False
+
+def _current_user_id() -> Optional[int]:
+    """User whose data the current request or job writes, if known"""
+    user_id = g.get('db_user_id')
+    if user_id is None:
+        from flask_jwt_extended import get_jwt_identity
+        try:
+            user_id = get_jwt_identity()
+        except RuntimeError:
+            # Not a JWT-protected request
+            pass
+    return user_id
+
+class RoutingSession(Session):
+    """
+    Session that sends the queries of read-only routes to the replica
+
+    Everything else uses the primary: routes not marked with db_read_only,
+    anything the session flushes, every query after the session wrote, and
+    requests of users who wrote recently (see db_read_only).
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica():
+            self._count('replica')
+            return self._db.engines[REPLICA_BIND]
+        self._count('primary')
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self) -> bool:
+        if self._flushing or self.info.get('wrote') or not has_app_context():
+            return False
+        if not g.get('db_read_only') or REPLICA_BIND not in self._db.engines:
+            return False
+        if 'db_use_replica' not in g:
+            # Decided once per request, so its queries see one consistent database
+            g.db_use_replica = not wrote_recently(g.get('db_user_id'))
+        return g.db_use_replica
+
+    def _count(self, target: str) -> None:
+        with _routed_lock:
+            _routed[target] += 1
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session.info.pop('wrote', False) and has_app_context() and REPLICA_BIND in session._db.engines:
+        # Later queries of this request or job must see the write
+        g.db_use_replica = False
+        user_id = _current_user_id()
+        if user_id is not None:
+            record_write(user_id)
+
+@event.listens_for(RoutingSession, 'after_soft_rollback')
+def _after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop('wrote', None)
+
+def pool_stats(db) -> Dict:
+    """Pool statistics of every engine and how many statements were routed to each database"""
+    stats = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {
+            'url': engine.url.render_as_string(hide_password=True),
+            'pool': type(pool).__name__,
+            'status': pool.status()
+        }
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                entry[name] = getattr(pool, name)()
+        stats['primary' if key is None else key] = entry
+    with _routed_lock:
+        routed = dict(_routed)
+    return {'engines': stats, 'routed_statements': routed}
@@ -0,0 +1,57 @@
+"""Startup-time benchmark
+
+Measures, in fresh interpreters, how long it takes to import the application
+module and to run the app factory, and how long the first use of PyMuPDF
+costs afterwards (the price of importing it lazily).
+
+    python scripts/bench_startup.py --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+t2 = time.perf_counter()
+from services.pdf.pdf_service import fitz
+fitz.Rect
+t3 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'create_app': t2 - t1, 'first_pdf_use': t3 - t2}))
+"""
+
+def run_probe(env):
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=SERVER_DIR, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to start')
+    args = parser.parse_args()
+
+    instance = tempfile.mkdtemp()
+    env = dict(os.environ,
+               UPLOAD_FOLDER=os.path.join(instance, 'uploads'),
+               CACHE_FOLDER=os.path.join(instance, 'cache'))
+
+    samples = [run_probe(env) for _ in range(args.runs)]
+
+    print(f"{'phase':<15}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for phase in ('import', 'create_app', 'first_pdf_use'):
+        values = [s[phase] * 1000 for s in samples]
+        print(f"{phase:<15}{statistics.median(values):>12.1f}{min(values):>10.1f}{max(values):>10.1f}")
+    total = [(s['import'] + s['create_app']) * 1000 for s in samples]
+    print(f"{'startup total':<15}{statistics.median(total):>12.1f}{min(total):>10.1f}{max(total):>10.1f}")
+
+if __name__ == '__main__':
+    main()
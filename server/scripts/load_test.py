@@ -0,0 +1,287 @@
+"""Load-test harness
+
+Starts the app on a fresh SQLite database, with scripts/mock_llm.py behind
+the AI routes. It seeds synthetic users and PDFs over HTTP, then replays a
+weighted mix of routes at a fixed concurrency. The report gives per-route
+throughput and p50/p95/p99 latency.
+
+    python scripts/load_test.py --concurrency 32 --duration 60
+    python scripts/load_test.py --server uvicorn --workers 2 --mix content=5,summarize=1
+    python scripts/load_test.py --url http://127.0.0.1:8000   # an already running server
+
+Routes in the mix: upload, content, extract_text, add_text, search, summarize,
+process, extract_info.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+
+import aiohttp
+import fitz
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'content=40,extract_text=20,add_text=10,search=10,upload=5,summarize=5,process=5,extract_info=5'
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt '
+         'ut labore et dolore magna aliqua invoice total amount due date contract party').split()
+
+def make_pdf(pages):
+    """Build a synthetic text PDF"""
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        lines = [' '.join(random.choices(WORDS, k=12)) for _ in range(40)]
+        page.insert_textbox(fitz.Rect(50, 50, 545, 790), f"Page {page_number + 1}\n" + '\n'.join(lines), fontsize=10)
+    data = doc.tobytes(garbage=3, deflate=True)
+    doc.close()
+    return data
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ROUTES:
+            raise SystemExit(f"Unknown route in mix: {name.strip()} (choose from {', '.join(ROUTES)})")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+# -- Route mix --
+
+async def read(response):
+    await response.read()
+    return response.status
+
+async def route_upload(session, base, user, pdfs):
+    form = aiohttp.FormData()
+    form.add_field('file', random.choice(pdfs), filename='load.pdf', content_type='application/pdf')
+    form.add_field('title', 'Load test upload')
+    async with session.post(f"{base}/api/documents/", data=form, headers=user['headers']) as response:
+        if response.status == 201:
+            user['documents'].append((await response.json())['id'])
+            return response.status
+        return await read(response)
+
+async def route_content(session, base, user, pdfs):
+    async with session.get(f"{base}/api/pdf/{random.choice(user['documents'])}/content", headers=user['headers']) as response:
+        return await read(response)
+
+async def route_extract_text(session, base, user, pdfs):
+    async with session.get(f"{base}/api/pdf/{random.choice(user['documents'])}/extract-text", headers=user['headers']) as response:
+        return await read(response)
+
+async def route_add_text(session, base, user, pdfs):
+    body = {'text': 'Reviewed', 'page': 0, 'position': [72, 40]}
+    async with session.post(f"{base}/api/pdf/{random.choice(user['documents'])}/add-text", json=body, headers=user['headers']) as response:
+        return await read(response)
+
+async def route_search(session, base, user, pdfs):
+    params = {'q': random.choice(WORDS)}
+    async with session.get(f"{base}/api/pdf/{random.choice(user['documents'])}/search", params=params, headers=user['headers']) as response:
+        return await read(response)
+
+async def route_summarize(session, base, user, pdfs):
+    async with session.get(f"{base}/api/ai/summarize/{random.choice(user['documents'])}", headers=user['headers']) as response:
+        return await read(response)
+
+async def route_process(session, base, user, pdfs):
+    body = {'query': 'What is the total amount due?'}
+    async with session.post(f"{base}/api/ai/process-document/{random.choice(user['documents'])}", json=body, headers=user['headers']) as response:
+        return await read(response)
+
+async def route_extract_info(session, base, user, pdfs):
+    body = {'info_type': 'dates'}
+    async with session.post(f"{base}/api/ai/extract-information/{random.choice(user['documents'])}", json=body, headers=user['headers']) as response:
+        return await read(response)
+
+ROUTES = {
+    'upload': route_upload,
+    'content': route_content,
+    'extract_text': route_extract_text,
+    'add_text': route_add_text,
+    'search': route_search,
+    'summarize': route_summarize,
+    'process': route_process,
+    'extract_info': route_extract_info,
+}
+
+# -- Seeding and replay --
+
+async def seed(session, base, users, documents_per_user, pdfs):
+    """Register users and upload their documents"""
+    run_id = int(time.time())
+
+    async def seed_user(i):
+        credentials = {'email': f"load{run_id}-{i}@example.com", 'password': 'load-test', 'name': f"Load {i}"}
+        async with session.post(f"{base}/api/auth/register", json=credentials) as response:
+            if response.status != 201:
+                raise RuntimeError(f"Registration failed ({response.status}): {await response.text()}")
+            token = (await response.json())['token']
+        user = {'headers': {'Authorization': f"Bearer {token}"}, 'documents': []}
+        for _ in range(documents_per_user):
+            form = aiohttp.FormData()
+            form.add_field('file', random.choice(pdfs), filename='seed.pdf', content_type='application/pdf')
+            async with session.post(f"{base}/api/documents/", data=form, headers=user['headers']) as response:
+                if response.status != 201:
+                    raise RuntimeError(f"Seeding upload failed ({response.status}): {await response.text()}")
+                user['documents'].append((await response.json())['id'])
+        return user
+
+    return await asyncio.gather(*(seed_user(i) for i in range(users)))
+
+async def replay(session, base, users, weights, concurrency, duration, warmup, pdfs):
+    """Run virtual users against the route mix; returns {route: [(latency, status)]}"""
+    names, route_weights = list(weights), list(weights.values())
+    samples = defaultdict(list)
+    start = time.perf_counter()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+
+    async def virtual_user(i):
+        user = users[i % len(users)]
+        while time.perf_counter() < stop_at:
+            name = random.choices(names, route_weights)[0]
+            began = time.perf_counter()
+            try:
+                status = await ROUTES[name](session, base, user, pdfs)
+            except Exception:
+                status = 0
+            if began >= measure_from:
+                samples[name].append((time.perf_counter() - began, status))
+
+    await asyncio.gather(*(virtual_user(i) for i in range(concurrency)))
+    return samples
+
+def report(samples, duration):
+    rows = []
+    for name in sorted(samples, key=lambda n: -len(samples[n])) + ['total']:
+        entries = samples[name] if name != 'total' else [e for values in samples.values() for e in values]
+        latencies = sorted(latency for latency, _ in entries)
+        errors = sum(1 for _, status in entries if not 200 <= status < 400)
+        rows.append({
+            'route': name,
+            'requests': len(entries),
+            'errors': errors,
+            'throughput_rps': len(entries) / duration,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': (latencies[-1] if latencies else float('nan')) * 1000,
+        })
+
+    print(f"{'route':<14}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for row in rows:
+        print(f"{row['route']:<14}{row['requests']:>10}{row['errors']:>8}{row['throughput_rps']:>9.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+    return rows
+
+async def run(args, base):
+    pdfs = [make_pdf(random.randint(1, args.max_pages)) for _ in range(8)]
+    weights = parse_mix(args.mix)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency + args.users)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        print(f"Seeding {args.users} users with {args.documents} documents each...", file=sys.stderr)
+        users = await seed(session, base, args.users, args.documents, pdfs)
+        print(f"Replaying {args.concurrency} virtual users for {args.duration}s "
+              f"(+{args.warmup}s warm-up)...", file=sys.stderr)
+        samples = await replay(session, base, users, weights, args.concurrency, args.duration, args.warmup, pdfs)
+    return report(samples, args.duration)
+
+def start_server(args, env, port):
+    """Initialize the database and start the app server"""
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app:create_app', 'init-db'],
+                   cwd=SERVER_DIR, env=env, check=True, capture_output=True)
+    if args.server == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(args.workers), '--log-level', 'warning']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{port}",
+                   '--workers', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning']
+    return subprocess.Popen(command, cwd=SERVER_DIR, env=env)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Target an already running server instead of starting one')
+    parser.add_argument('--server', choices=('gunicorn', 'uvicorn'), default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds before measuring')
+    parser.add_argument('--users', type=int, default=8, help='Synthetic users to seed')
+    parser.add_argument('--documents', type=int, default=3, help='Documents seeded per user')
+    parser.add_argument('--max-pages', type=int, default=10, help='Maximum pages of a synthetic PDF')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weighted route mix, e.g. "content=4,summarize=1"')
+    parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds')
+    parser.add_argument('--llm-latency-ms', type=float, default=500, help='Mock LLM delay before the first token')
+    parser.add_argument('--llm-token-ms', type=float, default=0, help='Mock LLM delay per token')
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.url:
+            base = args.url.rstrip('/')
+        else:
+            instance = tempfile.mkdtemp(prefix='loadtest-')
+            llm_port, app_port = free_port(), free_port()
+            env = dict(os.environ,
+                       DATABASE_URL=f"sqlite:///{os.path.join(instance, 'load.db')}",
+                       UPLOAD_FOLDER=os.path.join(instance, 'uploads'),
+                       CACHE_FOLDER=os.path.join(instance, 'cache'),
+                       OPENAI_API_KEY='mock',
+                       OPENAI_API_URL=f"http://127.0.0.1:{llm_port}/v1/chat/completions")
+            os.makedirs(env['UPLOAD_FOLDER'])
+
+            processes.append(subprocess.Popen(
+                [sys.executable, os.path.join(SERVER_DIR, 'scripts', 'mock_llm.py'), '--port', str(llm_port),
+                 '--latency-ms', str(args.llm_latency_ms), '--token-ms', str(args.llm_token_ms)]))
+            wait_for_port(llm_port, processes[-1])
+            processes.append(start_server(args, env, app_port))
+            wait_for_port(app_port, processes[-1])
+            base = f"http://127.0.0.1:{app_port}"
+            print(f"Serving from {instance} with {args.server}", file=sys.stderr)
+
+        rows = asyncio.run(run(args, base))
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'config': vars(args), 'routes': rows}, f, indent=2)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait(timeout=10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Mock LLM server
+
+Serves an OpenAI-compatible chat completions endpoint with a configurable
+delay, so the AI routes can be load tested without calling a real model.
+Requests with "stream": true get server-sent events, one chunk per token.
+
+    python scripts/mock_llm.py --port 8100 --latency-ms 800 --token-ms 20
+
+Then set OPENAI_API_URL=http://127.0.0.1:8100/v1/chat/completions.
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from aiohttp import web
+
+REPLY = ('This document discusses the topics on its pages. The key points are '
+         'summarized here in a fixed reply, which is long enough to exercise '
+         'response handling without depending on the prompt. ["alpha", "beta"]')
+
+def completion(model, content):
+    return {
+        'id': f"chatcmpl-mock-{int(time.time() * 1000)}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': 0, 'completion_tokens': len(content.split()), 'total_tokens': len(content.split())}
+    }
+
+def chunk(model, delta, finish_reason=None):
+    return {
+        'id': 'chatcmpl-mock',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+    }
+
+def create_app(latency_ms, jitter_ms, token_ms, error_rate, reply, error_status=503, retry_after=None):
+    async def chat_completions(request):
+        payload = await request.json()
+        model = payload.get('model', 'mock')
+        await asyncio.sleep(max(0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+
+        if random.random() < error_rate:
+            headers = {'Retry-After': str(retry_after)} if retry_after is not None else None
+            return web.json_response({'error': {'message': 'Mock overload', 'type': 'server_error'}},
+                                     status=error_status, headers=headers)
+
+        tokens = [word + ' ' for word in reply.split(' ')]
+        if not payload.get('stream'):
+            await asyncio.sleep(token_ms * len(tokens) / 1000)
+            return web.json_response(completion(model, reply))
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        await response.write(f"data: {json.dumps(chunk(model, {'role': 'assistant'}))}\n\n".encode())
+        for token in tokens:
+            await asyncio.sleep(token_ms / 1000)
+            await response.write(f"data: {json.dumps(chunk(model, {'content': token}))}\n\n".encode())
+        await response.write(f"data: {json.dumps(chunk(model, {}, 'stop'))}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency-ms', type=float, default=500, help='Delay before the first token')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='Uniform random variation of the delay')
+    parser.add_argument('--token-ms', type=float, default=0, help='Delay per generated token')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with an error')
+    parser.add_argument('--error-status', type=int, default=503, help='Status of the error responses, e.g. 429')
+    parser.add_argument('--retry-after', type=float, default=None, help='Retry-After seconds sent with the errors')
+    args = parser.parse_args()
+
+    web.run_app(create_app(args.latency_ms, args.jitter_ms, args.token_ms, args.error_rate, REPLY,
+                           args.error_status, args.retry_after),
+                host=args.host, port=args.port, print=None)
+
+if __name__ == '__main__':
+    main()
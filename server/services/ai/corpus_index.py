@@ -0,0 +1,227 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+# Words too common to help find pages
+STOPWORDS = frozenset("""
+a about an and any are as at be by can could did do does for from had has have how i if in is it its
+me mention mentions my of on or our should that the their them there these they this those to was we
+were what when where which who whom why will with would you your all do does list show find tell
+""".split())
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+def query_terms(question: str) -> List[str]:
+    """Distinct search terms of a question (lower-cased words of two or more characters, without stopwords)"""
+    terms = []
+    for word in _WORD.findall(question.casefold()):
+        if len(word) > 1 and word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    return terms
+
+class CorpusIndex:
+    """
+    Full-text index of the pages of every user's current document versions
+
+    A SQLite FTS5 database next to the artifact cache, filled by the ingest
+    pipeline's 'corpus' stage. Each document has the pages of one version
+    in the index (a new version replaces them), and every page row carries
+    its owner as an indexed token, so a search only visits the pages of one
+    user that match: its cost grows with the number of hits, not with the
+    size of the library.
+    """
+
+    _initialized = set()
+    _init_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        """Initialize with the path of the index database (created on first use)"""
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        if self.path not in self._initialized:
+            with self._init_lock:
+                if self.path not in self._initialized:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    # WAL lets searches run while an ingest job writes
+                    connection.execute("PRAGMA journal_mode=WAL")
+                    connection.executescript("""
+                        CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(
+                            text, owner, document_id UNINDEXED, page UNINDEXED, tokenize='porter unicode61');
+                        CREATE TABLE IF NOT EXISTS versions (
+                            document_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL,
+                            version_key TEXT NOT NULL, pages INTEGER NOT NULL, indexed_at REAL NOT NULL);
+                    """)
+                    self._initialized.add(self.path)
+        return connection
+
+    def index_version(self, document_id: int, user_id: int, version_key: str, page_texts: List[str]) -> None:
+        """
+        Replace the indexed pages of a document with those of a version
+
+        Args:
+            document_id: ID of the document
+            user_id: ID of the owner
+            version_key: Cache key of the version (see ArtifactCache.version_key)
+            page_texts: Text of every page, indexed by page number (0-based)
+        """
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM pages WHERE document_id = ?", (document_id,))
+                connection.executemany(
+                    "INSERT INTO pages (text, owner, document_id, page) VALUES (?, ?, ?, ?)",
+                    ((text, f"u{user_id}", document_id, page) for page, text in enumerate(page_texts) if text.strip()))
+                connection.execute("INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?)",
+                                   (document_id, user_id, version_key, len(page_texts), time.time()))
+        finally:
+            connection.close()
+
+    def indexed_version(self, document_id: int) -> Optional[str]:
+        """Version key of the indexed version of a document, or None if it is not indexed"""
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT version_key FROM versions WHERE document_id = ?",
+                                     (document_id,)).fetchone()
+            return row[0] if row else None
+        finally:
+            connection.close()
+
+    def remove_documents(self, document_ids: Iterable[int]) -> None:
+        """Remove documents from the index"""
+        document_ids = list(document_ids)
+        if not document_ids:
+            return
+        placeholders = ",".join("?" * len(document_ids))
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute(f"DELETE FROM pages WHERE document_id IN ({placeholders})", document_ids)
+                connection.execute(f"DELETE FROM versions WHERE document_id IN ({placeholders})", document_ids)
+        finally:
+            connection.close()
+
+    def search(self, user_id: int, terms: List[str], limit: int,
+               document_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Find the pages of a user that best match any of the terms
+
+        Args:
+            user_id: ID of the owner
+            terms: Search terms (see query_terms); pages matching more and rarer terms rank higher
+            limit: Maximum number of pages
+            document_ids: Optional documents to restrict the search to
+
+        Returns:
+            List of {"document_id", "page" (0-based), "text", "score"}, best first
+        """
+        if not terms:
+            return []
+        match = f"owner:u{int(user_id)} AND text:(" + " OR ".join(
+            '"' + term.replace('"', '""') + '"' for term in terms) + ")"
+        sql = ("SELECT document_id, page, text, bm25(pages, 1.0, 0.0) AS score FROM pages "
+               "WHERE pages MATCH ?")
+        params = [match]
+        if document_ids is not None:
+            sql += f" AND document_id IN ({','.join('?' * len(document_ids))})"
+            params.extend(document_ids)
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+
+        connection = self._connect()
+        try:
+            return [{'document_id': document_id, 'page': page, 'text': text, 'score': -score}
+                    for document_id, page, text, score in connection.execute(sql, params)]
+        finally:
+            connection.close()
+
+    def stats(self, user_id: Optional[int] = None) -> Dict:
+        """Number of indexed documents and pages (of one user, or of everyone)"""
+        connection = self._connect()
+        try:
+            query = "SELECT COUNT(*), COALESCE(SUM(pages), 0) FROM versions"
+            row = connection.execute(query + (" WHERE user_id = ?" if user_id is not None else ""),
+                                     (user_id,) if user_id is not None else ()).fetchone()
+            return {'documents': row[0], 'pages': row[1]}
+        finally:
+            connection.close()
+
+def get_corpus_index() -> CorpusIndex:
+    """Get the corpus index of the current app"""
+    return CorpusIndex(current_app.config['CORPUS_INDEX_PATH']
+                       or os.path.join(current_app.config['CACHE_FOLDER'], 'corpus.db'))
+
+def retrieve_pages(user_id: int, question: str, limit: int,
+                   document_ids: Optional[List[int]] = None) -> List[Dict]:
+    """
+    Find the pages of a user's current versions that best match a question
+
+    Hits of documents that were deleted since they were indexed are dropped
+    with one query for the hit documents, which also supplies their titles.
+
+    Args:
+        user_id: ID of the user
+        question: Question in natural language
+        limit: Maximum number of pages
+        document_ids: Optional documents to restrict the search to
+
+    Returns:
+        List of {"document_id", "title", "page" (0-based), "text", "score"}, best first
+
+    Raises:
+        ValueError: If the question has no searchable words
+    """
+    from models.db import db, Document
+
+    terms = query_terms(question)
+    if not terms:
+        raise ValueError("The question has no searchable words")
+    hits = get_corpus_index().search(user_id, terms, limit, document_ids)
+    if not hits:
+        return []
+
+    titles = dict(db.session.execute(select(Document.id, Document.title).where(
+        Document.id.in_({hit['document_id'] for hit in hits}), Document.user_id == user_id)).all())
+    return [{**hit, 'title': titles[hit['document_id']]} for hit in hits if hit['document_id'] in titles]
+
+def init_corpus(app):
+    """Register the corpus index commands with the Flask app"""
+    app.cli.add_command(index_corpus_command)
+
+@click.command('index-corpus')
+@with_appcontext
+def index_corpus_command():
+    """Index the latest version of every document that is not indexed yet (for documents ingested before the index)"""
+    from models.db import Document
+    from services.cache.artifact_cache import ArtifactCache
+    from services.pdf.pdf_service import PDFService
+    from services.pdf.text_layer import TextLayerService
+
+    index = get_corpus_index()
+    cache = ArtifactCache(current_app.config['CACHE_FOLDER'])
+    text_layer = TextLayerService(PDFService(current_app.config['UPLOAD_FOLDER']), cache)
+    indexed = skipped = failed = 0
+    for document in Document.query.order_by(Document.id).yield_per(100):
+        latest_version = document.get_version()
+        key = latest_version.file_path if latest_version else document.file_path
+        if index.indexed_version(document.id) == cache.version_key(key):
+            skipped += 1
+            continue
+        try:
+            file_path = latest_version.local_path if latest_version else document.local_path
+            index.index_version(document.id, document.user_id, cache.version_key(file_path),
+                                text_layer.get_page_texts(file_path))
+            indexed += 1
+        except Exception as e:
+            click.echo(f'Could not index document {document.id}: {e}')
+            failed += 1
+    click.echo(f'Indexed {indexed} documents ({skipped} up to date, {failed} failed).')
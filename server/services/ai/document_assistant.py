@@ -1,27 +1,51 @@
 import os
+import re
 import json
-import requests
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
 import tempfile
 import asyncio
-import aiohttp
 
 from services.pdf.pdf_service import PDFService
+from services.ai.llm_gateway import LLMGateway, LLMUnavailableError
+from services.ai.corpus_index import query_terms
+
+# JSON schema types accepted for extracted values
+FIELD_TYPES = {
+    'string': str,
+    'number': (int, float),
+    'integer': int,
+    'boolean': bool
+}
 
 class AIDocumentAssistant:
     """Service for AI-powered document assistance"""
+
+    # Words of document text sent per structured extraction call
+    EXTRACTION_CHUNK_WORDS = 3000
+
+    # Extraction calls per document (pages beyond them are not searched)
+    EXTRACTION_MAX_CHUNKS = 20
+
+    # Tokens of a retrieved page sent as one source (longer pages are cut around the question's terms)
+    SOURCE_EXCERPT_TOKENS = 800
     
-    def __init__(self, api_key: str, model: str = "gpt-4"):
+    def __init__(self, api_key: str, model: str = "gpt-4", api_url: Optional[str] = None,
+                 gateway: Optional[LLMGateway] = None):
         """
         Initialize the AI Document Assistant
         
         Args:
             api_key: API key for the LLM service
             model: Model to use (default: gpt-4)
+            api_url: Chat completions endpoint (default: OpenAI); point it at
+                     another compatible server, e.g. scripts/mock_llm.py
+            gateway: Gateway that limits, retries and circuit-breaks the calls
+                     (default: a private gateway with default settings)
         """
         self.api_key = api_key
         self.model = model
-        self.api_url = "https://api.openai.com/v1/chat/completions"
+        self.api_url = api_url or "https://api.openai.com/v1/chat/completions"
+        self.gateway = gateway or LLMGateway()
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
@@ -37,11 +61,13 @@ class AIDocumentAssistant:
             
         Returns:
             Dictionary with AI response
+
+        Raises:
+            LLMUnavailableError: If the LLM gateway turns the call away (circuit open or busy)
         """
         try:
             # Extract text from document
-            pdf_service = PDFService(os.path.dirname(file_path))
-            text_data = pdf_service.extract_text(file_path)
+            text_data = await self._extract_text(file_path)
             
             # Combine all text (limit to avoid token limit issues)
             all_text = ""
@@ -66,6 +92,8 @@ class AIDocumentAssistant:
                 "response": response
             }
             
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             return {
                 "error": str(e),
@@ -83,11 +111,13 @@ class AIDocumentAssistant:
             
         Returns:
             Dictionary with extracted information
+
+        Raises:
+            LLMUnavailableError: If the LLM gateway turns the call away (circuit open or busy)
         """
         try:
             # Extract text from document
-            pdf_service = PDFService(os.path.dirname(file_path))
-            text_data = pdf_service.extract_text(file_path)
+            text_data = await self._extract_text(file_path)
             
             # Combine all text (limit to avoid token limit issues)
             all_text = ""
@@ -107,19 +137,9 @@ class AIDocumentAssistant:
             # Call LLM API
             response = await self._call_llm_api(messages)
             
-            # Try to parse JSON from response
-            try:
-                # Find JSON in the response (handling cases where the model adds explanatory text)
-                json_start = response.find('[')
-                json_end = response.rfind(']') + 1
-                
-                if json_start >= 0 and json_end > json_start:
-                    json_str = response[json_start:json_end]
-                    extracted_items = json.loads(json_str)
-                else:
-                    # Fallback if no valid JSON array is found
-                    extracted_items = []
-            except json.JSONDecodeError:
+            # Parse the JSON array from the response (the model may add explanatory text)
+            extracted_items = self._parse_json(response, list)
+            if extracted_items is None:
                 extracted_items = []
             
             return {
@@ -128,6 +148,8 @@ class AIDocumentAssistant:
                 "raw_response": response
             }
             
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             return {
                 "error": str(e),
@@ -135,6 +157,370 @@ class AIDocumentAssistant:
                 "extracted_items": []
             }
     
+    @staticmethod
+    def parse_fields(fields: Optional[Union[List, Dict]] = None, schema: Optional[Dict] = None) -> Dict[str, Dict]:
+        """
+        Normalize the fields to extract
+
+        Args:
+            fields: Field names, or an object of field name to description
+            schema: JSON schema of an object whose properties are the fields
+                    (each with an optional "type", which may be nullable as in
+                    ["string", "null"], and "description")
+
+        Returns:
+            Dictionary of field name to {"type", "description"}
+
+        Raises:
+            ValueError: If no fields are given or a field is malformed
+        """
+        if schema is not None:
+            if not isinstance(schema, dict) or not isinstance(schema.get('properties'), dict):
+                raise ValueError("schema must be a JSON schema object with properties")
+            fields = schema['properties']
+
+        if isinstance(fields, list):
+            for name in fields:
+                if not isinstance(name, str):
+                    raise ValueError(f"Invalid field name: {name!r}")
+            fields = {name: {} for name in fields}
+        elif isinstance(fields, dict):
+            fields = {name: spec if isinstance(spec, dict) else {'description': spec}
+                      for name, spec in fields.items()}
+        else:
+            raise ValueError("fields must be a list of names or an object of name to description")
+
+        if not fields:
+            raise ValueError("At least one field is required")
+
+        result = {}
+        for name, spec in fields.items():
+            if not isinstance(name, str) or not name.strip():
+                raise ValueError(f"Invalid field name: {name!r}")
+            field_type = spec.get('type', 'string')
+            if isinstance(field_type, list):
+                # A nullable type such as ["string", "null"]: missing values are simply not extracted
+                types = [member for member in field_type if member != 'null']
+                field_type = types[0] if len(types) == 1 else field_type
+            if not isinstance(field_type, str) or field_type not in FIELD_TYPES:
+                raise ValueError(f"Unsupported type for field {name}: {field_type}")
+            result[name] = {'type': field_type, 'description': str(spec.get('description', name))}
+        return result
+
+    async def extract_fields(self, file_path: str, fields: Dict[str, Dict]) -> Dict:
+        """
+        Extract several fields from a document in one pass
+
+        The document is split into chunks of whole pages, every chunk is sent
+        to the LLM concurrently with a request for all fields at once, and the
+        per-chunk results are validated and merged: equal values are
+        combined and keep every page they were found on. Only the first
+        EXTRACTION_MAX_CHUNKS chunks are sent.
+
+        Args:
+            file_path: Path to the PDF file
+            fields: Fields to extract, as returned by parse_fields
+
+        Returns:
+            Dictionary with the items of each field ({"value", "page", "pages"},
+            pages 1-based), the number of chunks, the errors of failed chunks,
+            and the last page searched if the document was cut short
+            ("truncated_after_page")
+
+        Raises:
+            LLMUnavailableError: If the LLM gateway turns the call away (circuit open or busy)
+        """
+        try:
+            text_data = await self._extract_text(file_path)
+            chunks = self._chunk_pages(text_data, self.EXTRACTION_CHUNK_WORDS)
+            truncated = len(chunks) > self.EXTRACTION_MAX_CHUNKS
+            chunks = chunks[:self.EXTRACTION_MAX_CHUNKS]
+
+            results = await asyncio.gather(
+                *(self._extract_chunk(chunk, fields) for chunk in chunks), return_exceptions=True)
+
+            self._raise_if_unavailable(results)
+
+            merged = {name: {} for name in fields}
+            errors = []
+            for index, result in enumerate(results):
+                if isinstance(result, Exception):
+                    errors.append({'chunk': index, 'error': str(result)})
+                    continue
+                for name, items in result.items():
+                    for item in items:
+                        key = self._normalize_value(item['value'])
+                        entry = merged[name].setdefault(key, {'value': item['value'], 'pages': set()})
+                        entry['pages'].add(item['page'])
+
+            extracted = {
+                name: sorted(({'value': entry['value'], 'page': min(entry['pages']), 'pages': sorted(entry['pages'])}
+                              for entry in entries.values()), key=lambda item: item['page'])
+                for name, entries in merged.items()
+            }
+            result = {"fields": extracted, "chunks": len(chunks)}
+            if truncated:
+                result["truncated_after_page"] = max(chunks[-1]) + 1
+            if errors:
+                result["errors"] = errors
+                if len(errors) == len(chunks):
+                    result["error"] = "Extraction failed for every part of the document"
+            return result
+
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            return {
+                "error": str(e),
+                "fields": {name: [] for name in fields}
+            }
+
+    async def _extract_chunk(self, chunk: Dict[int, str], fields: Dict[str, Dict]) -> Dict[str, List[Dict]]:
+        """
+        Extract all fields from one chunk of pages and validate the result
+
+        Returns:
+            Dictionary of field name to a list of {"value", "page"} items;
+            items with a wrong type or a page outside the chunk are dropped
+        """
+        text = "".join(f"\n--- Page {page_num + 1} ---\n{page_text}" for page_num, page_text in chunk.items())
+        field_lines = "\n".join(f"- {name} ({spec['type']}): {spec['description']}" for name, spec in fields.items())
+        messages = [
+            {"role": "system", "content": (
+                "You are an AI document assistant that extracts structured information from documents. "
+                "Respond with a single JSON object and nothing else. It must have exactly one key per "
+                "requested field, each mapping to an array of objects of the form "
+                '{"value": <value>, "page": <page number>}, where the page number is taken from the '
+                '"--- Page N ---" marker of the page the value appears on. Use an empty array for '
+                "fields that do not occur.")},
+            {"role": "user", "content": f"Fields:\n{field_lines}\n\nDocument content:{text}"}
+        ]
+
+        # Every field can have many items, so allow a longer response than the other operations
+        response = await self._call_llm_api(messages, max_tokens=2000)
+        data = self._parse_json(response, dict)
+        if data is None:
+            raise ValueError("The response is not a JSON object")
+
+        pages = {page_num + 1 for page_num in chunk}
+        result = {}
+        for name, spec in fields.items():
+            items = data.get(name)
+            result[name] = []
+            for item in items if isinstance(items, list) else []:
+                if not isinstance(item, dict):
+                    continue
+                value, page = item.get('value'), item.get('page')
+                if isinstance(value, str):
+                    value = " ".join(value.split())
+                if isinstance(page, str) and page.isdigit():
+                    page = int(page)
+                if page not in pages or not self._valid_value(value, spec['type']):
+                    continue
+                result[name].append({'value': value, 'page': page})
+        return result
+
+    def _raise_if_unavailable(self, results: List[Any]) -> None:
+        """Raise the gateway's refusal if it turned away every one of a batch of concurrent calls"""
+        if results and all(isinstance(result, LLMUnavailableError) for result in results):
+            raise results[0]
+
+    def _chunk_pages(self, text_data: Dict[int, str], max_words: int) -> List[Dict[int, str]]:
+        """Group consecutive pages into chunks of at most max_words words (a longer page is a chunk of its own)"""
+        chunks, current, words = [], {}, 0
+        for page_num, page_text in text_data.items():
+            page_words = len(page_text.split())
+            if current and words + page_words > max_words:
+                chunks.append(current)
+                current, words = {}, 0
+            current[page_num] = page_text
+            words += page_words
+        if current or not chunks:
+            chunks.append(current)
+        return chunks
+
+    def _parse_json(self, response: str, expected: type) -> Optional[Any]:
+        """
+        Parse the first JSON value of the expected type (list or dict) in a response
+
+        Tolerates code fences and explanatory text around the JSON.
+
+        Returns:
+            The parsed value, or None if the response has none
+        """
+        decoder = json.JSONDecoder()
+        opener = '[' if expected is list else '{'
+        for match in re.finditer(re.escape(opener), response):
+            try:
+                value, _ = decoder.raw_decode(response, match.start())
+            except json.JSONDecodeError:
+                continue
+            if isinstance(value, expected):
+                return value
+        return None
+
+    def _valid_value(self, value: Any, field_type: str) -> bool:
+        """Check an extracted value against its field type"""
+        if value is None or value == "":
+            return False
+        # bool is a subclass of int, but not a number here
+        if isinstance(value, bool) and field_type != 'boolean':
+            return False
+        return isinstance(value, FIELD_TYPES[field_type])
+
+    def _normalize_value(self, value: Any) -> str:
+        """Key under which equal values from different chunks are merged"""
+        if isinstance(value, str):
+            return " ".join(value.split()).casefold()
+        return json.dumps(value)
+
+    async def answer_corpus(self, question: str, pages: List[Dict], context_tokens: int = 12000,
+                            call_tokens: int = 3000) -> Dict:
+        """
+        Answer a question from pages retrieved across a user's documents
+
+        The best-ranked pages are numbered as sources until context_tokens
+        is used up, and split into batches of at most call_tokens that are
+        sent to the LLM concurrently. Each call answers from its sources and
+        cites them as [n]; when more than one call finds an answer, a final
+        call combines the partial answers. The number of calls follows the
+        number of hits, never the size of the library.
+
+        Args:
+            question: Question in natural language
+            pages: Retrieved pages, best first (see corpus_index.retrieve_pages)
+            context_tokens: Estimated tokens of page text sent in total
+            call_tokens: Estimated tokens of page text sent per call
+
+        Returns:
+            Dictionary with the answer, the cited sources ({"source",
+            "document_id", "title", "page"}, pages 1-based), the number of
+            sources and calls, and the errors of failed calls
+
+        Raises:
+            LLMUnavailableError: If the LLM gateway turns the call away (circuit open or busy)
+        """
+        try:
+            terms = query_terms(question)
+            excerpt_chars = min(self.SOURCE_EXCERPT_TOKENS, call_tokens) * 4
+            sources, used = [], 0
+            for page in pages:
+                excerpt = self._excerpt(page['text'], terms, excerpt_chars)
+                tokens = self._estimate_tokens(excerpt)
+                if used + tokens > context_tokens:
+                    continue
+                used += tokens
+                sources.append({'source': len(sources) + 1, 'document_id': page['document_id'],
+                                'title': page['title'], 'page': page['page'] + 1, 'text': excerpt})
+
+            if not sources:
+                return {"question": question, "answer": None, "citations": [], "sources": 0, "calls": 0}
+
+            batches, current, tokens = [], [], 0
+            for source in sources:
+                source_tokens = self._estimate_tokens(source['text'])
+                if current and tokens + source_tokens > call_tokens:
+                    batches.append(current)
+                    current, tokens = [], 0
+                current.append(source)
+                tokens += source_tokens
+            batches.append(current)
+
+            results = await asyncio.gather(
+                *(self._answer_sources(question, batch) for batch in batches), return_exceptions=True)
+
+            self._raise_if_unavailable(results)
+
+            partials, errors = [], []
+            for index, result in enumerate(results):
+                if isinstance(result, Exception):
+                    errors.append({'call': index, 'error': str(result)})
+                elif result:
+                    partials.append(result)
+
+            calls = len(batches)
+            if len(partials) > 1:
+                answer = await self._combine_answers(question, partials)
+                calls += 1
+            else:
+                answer = partials[0] if partials else None
+
+            cited = {int(number) for number in re.findall(r'\[(\d+)\]', answer or '')}
+            result = {
+                "question": question,
+                "answer": answer,
+                "citations": [{key: source[key] for key in ('source', 'document_id', 'title', 'page')}
+                              for source in sources if source['source'] in cited],
+                "sources": len(sources),
+                "calls": calls
+            }
+            if errors:
+                result["errors"] = errors
+                if len(errors) == len(batches):
+                    result["error"] = "Answering failed for every group of sources"
+            return result
+
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            return {
+                "error": str(e),
+                "question": question,
+                "answer": None,
+                "citations": []
+            }
+
+    async def _answer_sources(self, question: str, sources: List[Dict]) -> Optional[str]:
+        """
+        Answer a question from one batch of numbered sources
+
+        Returns:
+            The answer with [n] citations, or None if the sources do not answer the question
+        """
+        text = "".join(f"\n--- Source [{source['source']}]: {source['title']}, page {source['page']} ---\n"
+                       f"{source['text']}" for source in sources)
+        messages = [
+            {"role": "system", "content": (
+                "You are an AI document assistant that answers questions from excerpts of a user's documents. "
+                "Use only the given sources. Cite every statement with the number of its source in square "
+                'brackets, e.g. [3]. Respond with a single JSON object of the form {"answer": <answer or null>} '
+                "and nothing else; use null if the sources do not answer the question.")},
+            {"role": "user", "content": f"Sources:{text}\n\nQuestion: {question}"}
+        ]
+        response = await self._call_llm_api(messages)
+        data = self._parse_json(response, dict)
+        if data is None:
+            raise ValueError("The response is not a JSON object")
+        answer = data.get('answer')
+        return answer.strip() or None if isinstance(answer, str) else None
+
+    async def _combine_answers(self, question: str, answers: List[str]) -> str:
+        """Combine the partial answers of several batches into one, keeping their [n] citations"""
+        text = "".join(f"\n--- Partial answer {index + 1} ---\n{answer}" for index, answer in enumerate(answers))
+        messages = [
+            {"role": "system", "content": (
+                "You are an AI document assistant. Combine partial answers, each drawn from different "
+                "sources, into one answer to the question. Keep the source citations in square brackets "
+                "(e.g. [3]) exactly as they are, and do not add facts or citations of your own.")},
+            {"role": "user", "content": f"Question: {question}\n\nPartial answers:{text}"}
+        ]
+        return (await self._call_llm_api(messages)).strip()
+
+    def _excerpt(self, text: str, terms: List[str], max_chars: int) -> str:
+        """Cut a page to at most max_chars, centered on the first occurrence of a search term"""
+        text = " ".join(text.split())
+        if len(text) <= max_chars:
+            return text
+        folded = text.casefold()
+        positions = [position for position in (folded.find(term) for term in terms) if position >= 0]
+        start = max(0, min(positions) - max_chars // 4) if positions else 0
+        start = min(start, len(text) - max_chars)
+        return ("..." if start else "") + text[start:start + max_chars] + "..."
+
+    def _estimate_tokens(self, text: str) -> int:
+        """Rough token count of a text (about 4 characters per token, as in LLMGateway)"""
+        return len(text) // 4 + 1
+
     async def summarize_document(self, file_path: str, max_length: Optional[int] = None) -> Dict:
         """
         Generate a summary of the document
@@ -145,11 +531,13 @@ class AIDocumentAssistant:
             
         Returns:
             Dictionary with the summary
+
+        Raises:
+            LLMUnavailableError: If the LLM gateway turns the call away (circuit open or busy)
         """
         try:
             # Extract text from document
-            pdf_service = PDFService(os.path.dirname(file_path))
-            text_data = pdf_service.extract_text(file_path)
+            text_data = await self._extract_text(file_path)
             
             # Combine all text (limit to avoid token limit issues)
             all_text = ""
@@ -175,34 +563,45 @@ class AIDocumentAssistant:
                 "word_count": len(summary.split())
             }
             
+        except LLMUnavailableError:
+            raise
         except Exception as e:
             return {
                 "error": str(e),
                 "summary": "I'm sorry, I encountered an error while summarizing your document. Please try again."
             }
     
-    async def _call_llm_api(self, messages: List[Dict[str, str]]) -> str:
+    async def _extract_text(self, file_path: str) -> Dict:
+        """
+        Extract the text of a document without blocking the event loop
+        
+        Args:
+            file_path: Path to the PDF file
+            
+        Returns:
+            Dictionary with extracted text, as returned by PDFService.extract_text
+        """
+        pdf_service = PDFService(os.path.dirname(file_path))
+        loop = asyncio.get_running_loop()
+        # PyMuPDF is CPU-bound, so it runs on the loop's executor
+        return await loop.run_in_executor(None, pdf_service.extract_text, file_path)
+    
+    async def _call_llm_api(self, messages: List[Dict[str, str]], max_tokens: int = 1000) -> str:
         """
         Call the LLM API with the given messages
         
         Args:
             messages: List of message objects to send to the API
+            max_tokens: Maximum length of the response in tokens
             
         Returns:
             Response text from the LLM
         """
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": 0.3,  # Lower temperature for more deterministic outputs
-                "max_tokens": 1000
-            }
-            
-            async with session.post(self.api_url, headers=self.headers, json=payload) as response:
-                if response.status == 200:
-                    response_json = await response.json()
-                    return response_json["choices"][0]["message"]["content"]
-                else:
-                    error_text = await response.text()
-                    raise Exception(f"API call failed with status {response.status}: {error_text}")
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": 0.3,  # Lower temperature for more deterministic outputs
+            "max_tokens": max_tokens
+        }
+        response_json = await self.gateway.complete(self.api_url, self.headers, payload)
+        return response_json["choices"][0]["message"]["content"]
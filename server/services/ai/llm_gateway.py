@@ -0,0 +1,394 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from services.lazy import lazy_import
+
+aiohttp = lazy_import('aiohttp')
+
+# Responses worth retrying: rate limiting and transient upstream failures
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class LLMError(Exception):
+    """Base class for LLM gateway errors"""
+
+class LLMUnavailableError(LLMError):
+    """The upstream is failing (circuit open) or no capacity freed up in time"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMRequestError(LLMError):
+    """The upstream rejected the request or kept failing after all retries"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit shared by all threads and event loops of a process
+
+    The limit adapts AIMD-style: it creeps up by one per limit's worth of
+    successful calls and halves whenever the upstream signals overload, so
+    the process settles just below the rate the upstream accepts.
+    Waiters are resumed in FIFO order on their own event loop.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self, timeout: float) -> None:
+        """Wait for a slot; raises asyncio.TimeoutError if none frees up within timeout"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), timeout)
+        except BaseException:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # The slot was granted while we gave up; hand it back exactly once
+            if waiter[1].done():
+                self.release()
+            else:
+                # _grant has not run yet; it finds the future cancelled and releases the slot
+                waiter[1].cancel()
+            raise
+
+    def release(self) -> None:
+        """Return a slot"""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def record(self, overloaded: bool) -> None:
+        """Adapt the limit to the outcome of a call"""
+        with self._lock:
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit / 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._wake()
+
+    def _wake(self) -> None:
+        """Grant free slots to waiters (called with the lock held)"""
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, future = self._waiters.popleft()
+            self.in_flight += 1
+            loop.call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future) -> None:
+        if future.done():
+            # The waiter timed out after being picked
+            self.release()
+        else:
+            future.set_result(None)
+
+class TokenBucket:
+    """Token-rate limit (tokens per minute) shared by all threads of a process"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.rate = tokens_per_minute / 60.0
+        self.capacity = float(tokens_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve tokens and return how many seconds to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt keeps reservations in order; later callers wait longer
+            self.tokens -= min(tokens, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the upstream is down
+
+    Opens after a run of consecutive failed attempts, rejects calls for
+    reset_timeout seconds, then lets a single trial call through: success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may proceed now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a trial call through"""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def abandon(self) -> None:
+        """Forget a call that ended without an outcome (cancelled), so a half-open circuit can try again"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._trial_running = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = 'closed'
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class LLMGateway:
+    """
+    Client-side gateway for chat completion calls
+
+    Every call from the process goes through one gateway, which applies:
+    an adaptive concurrency limit and an optional token-rate limit; a
+    per-attempt timeout; retries with jittered exponential backoff that
+    honor Retry-After; and a circuit breaker that fails fast while the
+    upstream keeps failing. It works from any thread and any event loop,
+    so it serves both the Flask routes and the ASGI coroutine routes.
+    """
+
+    def __init__(self, max_concurrency: int = 8, tokens_per_minute: int = 0, timeout: float = 60,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 20,
+                 circuit_failures: int = 5, circuit_reset: float = 30, queue_timeout: float = 30):
+        """
+        Args:
+            max_concurrency: Upper bound of concurrent upstream calls
+            tokens_per_minute: Token-rate limit, 0 for none
+            timeout: Seconds allowed for each attempt
+            max_retries: Retries after the first attempt
+            backoff_base: Backoff before the first retry, doubled per retry (seconds)
+            backoff_max: Upper bound of a single backoff (seconds)
+            circuit_failures: Consecutive failed attempts that open the circuit
+            circuit_reset: Seconds the circuit stays open before a trial call
+            queue_timeout: Seconds to wait for a free concurrency slot
+        """
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.breaker = CircuitBreaker(circuit_failures, circuit_reset)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue_timeout = queue_timeout
+        self._counters = {key: 0 for key in (
+            'calls', 'succeeded', 'failed', 'attempts', 'retries', 'rate_limited',
+            'timeouts', 'rejected_circuit_open', 'rejected_queue_timeout')}
+        self._latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    async def complete(self, url: str, headers: Dict[str, str], payload: Dict) -> Dict:
+        """
+        Send a chat completion request
+
+        Args:
+            url: Chat completions endpoint
+            headers: Request headers (authorization)
+            payload: JSON request body
+
+        Returns:
+            The parsed JSON response
+
+        Raises:
+            LLMUnavailableError: If the circuit is open or no slot frees up in time
+            LLMRequestError: If the request is rejected or fails after all retries
+        """
+        self._count('calls')
+        started = time.perf_counter()
+        try:
+            result = await self._complete(url, headers, payload)
+        except LLMError:
+            self._count('failed')
+            raise
+        self._count('succeeded')
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+        return result
+
+    async def _complete(self, url: str, headers: Dict[str, str], payload: Dict) -> Dict:
+        if self.bucket:
+            delay = self.bucket.reserve(self._estimate_tokens(payload))
+            if delay:
+                await asyncio.sleep(delay)
+
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.limiter.acquire(self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._count('rejected_queue_timeout')
+                raise LLMUnavailableError("LLM service busy (no capacity freed up in time)")
+
+            # Checked once a slot is held, so a half-open trial call is never left waiting
+            if not self.breaker.allow():
+                self.limiter.release()
+                self._count('rejected_circuit_open')
+                raise LLMUnavailableError("LLM service unavailable (circuit open)", self.breaker.retry_in())
+
+            retry_after = None
+            try:
+                self._count('attempts')
+                status, body, retry_after = await self._post(url, headers, payload)
+                if status == 200:
+                    self.breaker.record_success()
+                    self.limiter.record(overloaded=False)
+                    return body
+                if status not in RETRYABLE_STATUSES:
+                    # The request itself is wrong; retrying will not help
+                    self.breaker.record_success()
+                    raise LLMRequestError(f"API call failed with status {status}: {body}", status)
+                if status == 429:
+                    self._count('rate_limited')
+                self.limiter.record(overloaded=status in (429, 503))
+                self.breaker.record_failure()
+                last_error = LLMRequestError(f"API call failed with status {status}: {body}", status)
+            except asyncio.TimeoutError:
+                self._count('timeouts')
+                self.limiter.record(overloaded=True)
+                self.breaker.record_failure()
+                last_error = LLMRequestError(f"API call timed out after {self.timeout}s")
+            except aiohttp.ClientError as e:
+                self.breaker.record_failure()
+                last_error = LLMRequestError(f"API call failed: {str(e)}")
+            except ValueError as e:
+                # A 200 whose body is not JSON
+                self.breaker.record_failure()
+                last_error = LLMRequestError(f"API call returned invalid JSON: {str(e)}")
+            except BaseException:
+                # Cancelled (or a bug): no outcome to record, but a half-open trial must not stay running
+                self.breaker.abandon()
+                raise
+            finally:
+                self.limiter.release()
+
+            if attempt < self.max_retries:
+                self._count('retries')
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+
+        raise last_error
+
+    async def _post(self, url: str, headers: Dict[str, str], payload: Dict):
+        """One attempt; returns (status, parsed body or error text, Retry-After seconds)"""
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.post(url, headers=headers, json=payload) as response:
+                if response.status == 200:
+                    return response.status, await response.json(), None
+                return response.status, await response.text(), self._retry_after(response.headers.get('Retry-After'))
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, but never shorter than Retry-After"""
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.backoff_max * 3))
+        return backoff
+
+    def _retry_after(self, value: Optional[str]) -> Optional[float]:
+        """Parse a Retry-After header (seconds or HTTP date)"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _estimate_tokens(self, payload: Dict) -> int:
+        """Rough token count of a request: about 4 characters per prompt token plus the completion budget"""
+        prompt_chars = sum(len(message.get('content', '')) for message in payload.get('messages', []))
+        return prompt_chars // 4 + payload.get('max_tokens', 0)
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counters[key] += 1
+
+    def metrics(self) -> Dict:
+        """Counters, limiter and circuit state, and latency percentiles of successful calls"""
+        with self._lock:
+            counters = dict(self._counters)
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1) if latencies else None
+
+        return {
+            **counters,
+            'in_flight': self.limiter.in_flight,
+            'queued': len(self.limiter._waiters),
+            'concurrency_limit': round(self.limiter.limit, 2),
+            'circuit_state': self.breaker.state,
+            'latency_ms': {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99)}
+        }
+
+_gateway = None
+_gateway_pid = None
+_gateway_lock = threading.Lock()
+
+def get_llm_gateway(config) -> LLMGateway:
+    """
+    Get the LLM gateway of this process, creating it from the app config on first use
+
+    The gateway is per process (recreated after a fork), so its limits apply
+    to each server worker separately.
+    """
+    global _gateway, _gateway_pid
+    with _gateway_lock:
+        if _gateway is None or _gateway_pid != os.getpid():
+            _gateway = LLMGateway(
+                max_concurrency=config.get('LLM_MAX_CONCURRENCY', 8),
+                tokens_per_minute=config.get('LLM_TOKENS_PER_MINUTE', 0),
+                timeout=config.get('LLM_TIMEOUT', 60),
+                max_retries=config.get('LLM_MAX_RETRIES', 3),
+                circuit_failures=config.get('LLM_CIRCUIT_FAILURES', 5),
+                circuit_reset=config.get('LLM_CIRCUIT_RESET', 30),
+                queue_timeout=config.get('LLM_QUEUE_TIMEOUT', 30)
+            )
+            _gateway_pid = os.getpid()
+        return _gateway
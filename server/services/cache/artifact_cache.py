@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import tempfile
+from typing import Any, Optional
+
+class ArtifactCache:
+    """File-backed cache for data derived from document version files
+
+    Version files are never modified once written (every edit produces a new
+    file), so the file name of a version is a stable cache key. Artifacts for
+    one version live together in a directory named after that file.
+    """
+
+    def __init__(self, cache_folder: str):
+        """Initialize with the folder for storing cached artifacts"""
+        self.cache_folder = cache_folder
+
+    def version_key(self, file_path: str) -> str:
+        """Return the cache key for the version stored at file_path"""
+        return os.path.splitext(os.path.basename(file_path))[0]
+
+    def path_for(self, file_path: str, name: str) -> str:
+        """
+        Get the cache path of an artifact
+
+        Args:
+            file_path: Path to the version file the artifact is derived from
+            name: Artifact name, may contain subdirectories (e.g. "words/3.bin")
+
+        Returns:
+            Absolute path of the artifact inside the cache folder
+        """
+        return os.path.join(self.cache_folder, self.version_key(file_path), name)
+
+    def etag_for(self, file_path: str, name: str) -> str:
+        """Return an ETag that identifies an artifact of a specific version"""
+        return f"{self.version_key(file_path)}-{name.replace('/', '-')}"
+
+    def exists(self, file_path: str, name: str) -> bool:
+        """Check whether an artifact has already been computed"""
+        return os.path.exists(self.path_for(file_path, name))
+
+    def read_bytes(self, file_path: str, name: str) -> Optional[bytes]:
+        """Read an artifact, returning None if it has not been computed yet"""
+        try:
+            with open(self.path_for(file_path, name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_bytes(self, file_path: str, name: str, data: bytes) -> str:
+        """
+        Store an artifact atomically
+
+        The data is written to a temporary file first and then renamed into
+        place, so concurrent readers never see a partially written artifact.
+
+        Returns:
+            Path of the stored artifact
+        """
+        target = self.path_for(file_path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return target
+
+    def read_json(self, file_path: str, name: str) -> Optional[Any]:
+        """Read a JSON artifact, returning None if it has not been computed yet"""
+        data = self.read_bytes(file_path, name)
+        return json.loads(data) if data is not None else None
+
+    def write_json(self, file_path: str, name: str, value: Any) -> str:
+        """Store a JSON-serializable artifact"""
+        return self.write_bytes(file_path, name, json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    def invalidate(self, file_path: str) -> None:
+        """Remove every cached artifact of a version"""
+        shutil.rmtree(os.path.join(self.cache_folder, self.version_key(file_path)), ignore_errors=True)
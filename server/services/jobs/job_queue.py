@@ -0,0 +1,122 @@
+import os
+import queue
+import itertools
+import threading
+from datetime import datetime
+from typing import Any, Callable, Optional
+
+from flask import g
+
+from models.db import db, Job
+
+# Lower numbers run first; queued interactive jobs always start before background warming
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+class JobQueue:
+    """In-process background job queue
+
+    Jobs are recorded in the jobs table so clients can poll their status,
+    and run on a small pool of worker threads inside the application context,
+    highest priority first and in submission order within a priority.
+    Worker threads are started lazily on the first submission, so the queue
+    is safe to create before a pre-forking server forks its workers.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.worker_count = 2
+        self._queue = None
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Bind the queue to a Flask app"""
+        self.app = app
+        self.worker_count = app.config.get('JOB_WORKERS', 2)
+        app.extensions['job_queue'] = self
+
+    def enqueue(self, job_type: str, user_id: int, func: Callable[..., Any], *args,
+                document_id: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Job:
+        """
+        Record a job and schedule it for execution
+
+        Args:
+            job_type: Short name of the operation (e.g. "merge")
+            user_id: ID of the user who requested the job
+            func: Callable to run; its return value must be JSON-serializable
+            *args: Positional arguments for func
+            document_id: Optional document the job operates on
+            priority: PRIORITY_INTERACTIVE for work a user is waiting on,
+                      PRIORITY_BACKGROUND for precomputation
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            The committed Job row
+        """
+        job = Job(job_type=job_type, user_id=user_id, document_id=document_id, status='queued')
+        db.session.add(job)
+        db.session.commit()
+
+        self._ensure_workers()
+        self._queue.put((priority, next(self._sequence), job.id, func, args, kwargs))
+        return job
+
+    def _ensure_workers(self):
+        """Start worker threads in the current process if needed"""
+        with self._lock:
+            if self._pid == os.getpid() and self._workers:
+                return
+            # Threads do not survive fork(), so every process gets its own pool
+            self._pid = os.getpid()
+            self._queue = queue.PriorityQueue()
+            self._workers = []
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        """Worker loop: run queued jobs one at a time"""
+        while True:
+            _, _, job_id, func, args, kwargs = self._queue.get()
+            with self.app.app_context():
+                try:
+                    self._run(job_id, func, args, kwargs)
+                finally:
+                    db.session.remove()
+                    self._queue.task_done()
+
+    def _run(self, job_id, func, args, kwargs):
+        """Run a single job and record its outcome"""
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return
+        # Lets the session record the job's writes for the user (see models/routing.py)
+        g.db_user_id = job.user_id
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            result = func(*args, **kwargs)
+            job.status = 'completed'
+            job.result = result
+        except Exception as e:
+            db.session.rollback()
+            self.app.logger.error(f"Job {job_id} ({job.job_type}) failed: {e}")
+            job = db.session.get(Job, job_id)
+            job.status = 'failed'
+            job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+job_queue = JobQueue()
+
+def init_jobs(app):
+    """Initialize the background job queue with the Flask app"""
+    job_queue.init_app(app)
@@ -0,0 +1,32 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+
+def get_process_pool(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Get the process pool for CPU-bound batch work (form fills, stamping)
+
+    PyMuPDF holds the GIL while it works, so batches only run in parallel in
+    separate processes. The pool is created on first use in each process and
+    uses the "spawn" start method, because it is usually started from a job
+    worker thread, where forking is unsafe.
+
+    Args:
+        max_workers: Pool size, defaults to the number of CPUs
+
+    Returns:
+        The shared process pool of this process
+    """
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                        mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
@@ -0,0 +1,56 @@
+import sys
+import threading
+import importlib
+import importlib.util
+from types import ModuleType
+from typing import Iterable
+
+_import_lock = threading.Lock()
+
+class _LazyModule(ModuleType):
+    """Stand-in for a module that imports it on first attribute access
+
+    importlib's LazyLoader is not thread-safe before Python 3.12: threads
+    that touch the module while another thread is executing it see a
+    half-initialized module. The import here happens under a lock instead.
+    """
+
+    def __getattr__(self, attribute):
+        with _import_lock:
+            module = importlib.import_module(self.__name__)
+            # Later lookups find the attributes directly, without __getattr__
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Import a module lazily
+
+    The module is located immediately (so a missing dependency still fails
+    at import time), but it is only executed on first attribute access.
+    Heavy dependencies such as PyMuPDF and aiohttp therefore add nothing to
+    application startup until a request actually uses them.
+
+    Args:
+        name: Fully qualified module name
+
+    Returns:
+        The module, or a stand-in that loads it on first use
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    if importlib.util.find_spec(name) is None:
+        raise ImportError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
+
+def warm_imports(names: Iterable[str] = ('fitz', 'aiohttp')) -> None:
+    """
+    Force lazily imported modules to load now
+
+    Call this in a pre-forking server's master process so workers share
+    the loaded modules copy-on-write instead of each importing them.
+    """
+    for name in names:
+        with _import_lock:
+            importlib.import_module(name)
@@ -0,0 +1,366 @@
+import os
+import json
+import uuid
+import base64
+import hashlib
+import binascii
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from models.db import db, Document, DocumentVersion, AnnotationOperation, AnnotationSnapshot
+from services.cache.artifact_cache import ArtifactCache
+from services.lazy import lazy_import
+from services.pdf.pdf_service import PDFService
+from services.pdf.ingest_service import IngestService
+from services.storage.base import get_storage
+
+fitz = lazy_import('fitz')  # PyMuPDF, loaded on first use
+
+# Edits a client can append; the log also records 'undo' (payload {"seq": <undone operation>})
+# and 'commit' (payload {"version": <new version>}, the layer was flattened and emptied)
+OPERATIONS = ('add', 'update', 'delete')
+
+# Required and optional properties of each element type
+ELEMENT_TYPES = {
+    'text': (('text', 'page', 'position'), ('font_size', 'color')),
+    'image': (('image', 'page', 'position'), ('width', 'height'))
+}
+
+class AnnotationService:
+    """
+    Service for a document's non-destructive annotation layer
+
+    Edits are appended to an ordered operation log in the database instead
+    of rewriting the PDF: an edit is one small insert. The layer (the
+    elements in drawing order) is the log folded from the latest snapshot,
+    and a snapshot is materialized every snapshot_interval operations so
+    reads never replay more than that. The layer is drawn into the PDF only
+    when it is exported, or committed as a new version (which empties the
+    layer). Undo and commit are operations of their own, so sequence
+    numbers only ever grow and a client syncing from a sequence number sees
+    them. Elements keep their page numbers; page-structure edits made while
+    annotations are pending do not move them.
+    """
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache, snapshot_interval: int = 50,
+                 max_image_bytes: int = 2 * 1024 * 1024):
+        """
+        Args:
+            pdf_service: PDF service used to flatten the layer
+            cache: Artifact cache for exported files
+            snapshot_interval: Operations between materialized snapshots
+            max_image_bytes: Largest image an image element may carry
+        """
+        self.pdf_service = pdf_service
+        self.cache = cache
+        self.snapshot_interval = snapshot_interval
+        self.max_image_bytes = max_image_bytes
+
+    def append(self, document_id: int, user_id, op: str, element_id: Optional[str] = None,
+               payload: Optional[Dict] = None) -> AnnotationOperation:
+        """
+        Append an operation to the log of a document and commit it
+
+        Args:
+            document_id: ID of the document
+            user_id: ID of the user making the edit
+            op: 'add' (payload is the element), 'update' (payload holds the
+                changed properties, e.g. a new position to move the element)
+                or 'delete'
+            element_id: Element to update or delete
+            payload: Element or changed properties
+
+        Returns:
+            The stored operation
+
+        Raises:
+            ValueError: If the operation or element is invalid
+        """
+        if op not in OPERATIONS:
+            raise ValueError(f"Unknown operation: {op} (expected one of {', '.join(OPERATIONS)})")
+
+        if op == 'add':
+            element_id = str(uuid.uuid4())
+            payload = self._validate(payload, None)
+        else:
+            element_type = self._element_type(document_id, element_id)
+            if element_type is None:
+                raise ValueError(f"Element {element_id} not found")
+            payload = self._validate(payload, element_type) if op == 'update' else None
+        if payload and 'page' in payload:
+            self._check_page(document_id, payload['page'])
+
+        return self._insert(document_id, user_id, op, element_id, payload)
+
+    def undo(self, document_id: int, user_id) -> Optional[Tuple[AnnotationOperation, AnnotationOperation]]:
+        """
+        Undo the last edit that is not undone yet, by appending an 'undo' operation
+
+        Snapshots that include the undone edit are removed, so the layer is
+        folded again without it.
+
+        Returns:
+            Tuple of (undone edit, undo operation), or None if there is nothing to undo
+        """
+        operations = self.operations(document_id)
+        undone = self._undone(operations)
+        edit = next((operation for operation in reversed(operations)
+                     if operation.op in OPERATIONS and operation.seq not in undone), None)
+        if edit is None:
+            return None
+
+        def prepare(seq):
+            db.session.execute(delete(AnnotationSnapshot).where(AnnotationSnapshot.document_id == document_id,
+                                                                AnnotationSnapshot.seq >= edit.seq))
+
+        operation = self._insert(document_id, user_id, 'undo', edit.element_id, {'seq': edit.seq}, prepare)
+        return edit, operation
+
+    def layer(self, document_id: int) -> Tuple[List[Dict], int]:
+        """
+        Get the current annotation layer of a document
+
+        Returns:
+            Tuple of (elements in drawing order, sequence number of the last operation)
+        """
+        snapshot = db.session.scalars(select(AnnotationSnapshot)
+                                      .where(AnnotationSnapshot.document_id == document_id)
+                                      .order_by(AnnotationSnapshot.seq.desc()).limit(1)).first()
+        elements = {element['id']: element for element in snapshot.elements} if snapshot else {}
+        seq = snapshot.seq if snapshot else 0
+
+        # Snapshots never include an edit that is undone later, so the undos after it are enough
+        operations = self.operations(document_id, since=seq)
+        undone = self._undone(operations)
+        for operation in operations:
+            seq = operation.seq
+            if operation.seq in undone or operation.op == 'undo':
+                continue
+            if operation.op == 'add':
+                elements[operation.element_id] = {'id': operation.element_id, **operation.payload}
+            elif operation.op == 'update':
+                # An update that raced with a delete of its element has nothing left to change
+                if operation.element_id in elements:
+                    elements[operation.element_id] = {**elements[operation.element_id], **operation.payload}
+            elif operation.op == 'delete':
+                elements.pop(operation.element_id, None)
+            else:
+                elements.clear()
+        return list(elements.values()), seq
+
+    def operations(self, document_id: int, since: int = 0) -> List[AnnotationOperation]:
+        """Get the operations of a document after a sequence number, in order"""
+        return list(db.session.scalars(select(AnnotationOperation)
+                                       .where(AnnotationOperation.document_id == document_id,
+                                              AnnotationOperation.seq > since)
+                                       .order_by(AnnotationOperation.seq)))
+
+    def export(self, file_path: str, elements: List[Dict]) -> str:
+        """
+        Get a PDF of a version with annotation elements drawn in, flattening it on first use
+
+        Exports are cached per version and layer content, so repeated
+        exports of an unchanged layer are served from the cache.
+
+        Returns:
+            Path to the flattened PDF
+        """
+        name = self.export_name(elements)
+        if not self.cache.exists(file_path, name):
+            target = self.cache.path_for(file_path, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Flatten next to the target and rename it into place, so readers never see a partial file
+            tmp_path = f"{target}.tmp-{uuid.uuid4()}"
+            try:
+                self.pdf_service.apply_annotations(file_path, elements, tmp_path)
+                os.replace(tmp_path, target)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return self.cache.path_for(file_path, name)
+
+    @staticmethod
+    def export_name(elements: List[Dict]) -> str:
+        """Cache name of the export of a layer, derived from its content"""
+        digest = hashlib.sha256(json.dumps(elements, sort_keys=True).encode()).hexdigest()[:16]
+        return f"annotations/{digest}.pdf"
+
+    def commit(self, document: Document, user_id) -> DocumentVersion:
+        """
+        Flatten the annotation layer into a new version of the document and empty the layer
+
+        A 'commit' operation takes the place of the log before it, so the
+        sequence numbers carry on and syncing clients see the layer emptied.
+
+        Returns:
+            The new version
+
+        Raises:
+            ValueError: If there are no annotations to commit, or they were edited meanwhile
+        """
+        elements, seq = self.layer(document.id)
+        if not elements:
+            raise ValueError("There are no annotations to commit")
+
+        latest_version = document.get_version()
+        file_path = latest_version.local_path if latest_version else document.local_path
+        new_version = document.add_version(self.pdf_service.apply_annotations(file_path, elements), user_id)
+        version_key = new_version.file_path
+        db.session.flush()
+        db.session.execute(delete(AnnotationOperation).where(AnnotationOperation.document_id == document.id,
+                                                             AnnotationOperation.seq <= seq))
+        db.session.execute(delete(AnnotationSnapshot).where(AnnotationSnapshot.document_id == document.id))
+        db.session.add(AnnotationOperation(document_id=document.id, seq=seq + 1, op='commit', element_id='',
+                                           payload={'version': new_version.version_number}, created_by=user_id))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # An edit took the next sequence number, so it is not in the flattened file
+            db.session.rollback()
+            get_storage().delete(version_key)
+            raise ValueError("The annotations changed while they were committed; commit again")
+        return new_version
+
+    def _insert(self, document_id: int, user_id, op: str, element_id: str, payload: Optional[Dict],
+                prepare=None) -> AnnotationOperation:
+        """
+        Append an operation with the next sequence number and commit it
+
+        Args:
+            prepare: Optional callable (seq) run in the same transaction before the insert
+        """
+        # Concurrent edits may race for the next sequence number; the unique constraint decides
+        for attempt in range(3):
+            seq = (db.session.scalar(select(func.max(AnnotationOperation.seq))
+                                     .where(AnnotationOperation.document_id == document_id)) or 0) + 1
+            if prepare:
+                prepare(seq)
+            operation = AnnotationOperation(document_id=document_id, seq=seq, op=op, element_id=element_id,
+                                            payload=payload, created_by=user_id)
+            db.session.add(operation)
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == 2:
+                    raise
+
+        if seq % self.snapshot_interval == 0:
+            self._snapshot(document_id)
+        return operation
+
+    @staticmethod
+    def _undone(operations: List[AnnotationOperation]) -> set:
+        """Sequence numbers of the edits undone by the given operations"""
+        return {operation.payload['seq'] for operation in operations if operation.op == 'undo'}
+
+    def _snapshot(self, document_id: int) -> None:
+        """Materialize the layer, keeping the previous snapshot for undo"""
+        elements, seq = self.layer(document_id)
+        db.session.merge(AnnotationSnapshot(document_id=document_id, seq=seq, elements=elements))
+        db.session.execute(delete(AnnotationSnapshot).where(
+            AnnotationSnapshot.document_id == document_id,
+            AnnotationSnapshot.seq < seq - self.snapshot_interval))
+        db.session.commit()
+
+    def _element_type(self, document_id: int, element_id: Optional[str]) -> Optional[str]:
+        """Type of a live element, or None if it was never added or has been deleted"""
+        if not element_id:
+            return None
+        # Undo operations carry the element of the edit they undo
+        rows = db.session.execute(select(AnnotationOperation.seq, AnnotationOperation.op, AnnotationOperation.payload)
+                                  .where(AnnotationOperation.document_id == document_id,
+                                         AnnotationOperation.element_id == element_id,
+                                         AnnotationOperation.op.in_(('add', 'delete', 'undo')))
+                                  .order_by(AnnotationOperation.seq)).all()
+        undone = {payload['seq'] for _, op, payload in rows if op == 'undo'}
+        element_type = None
+        for seq, op, payload in rows:
+            if seq in undone or op == 'undo':
+                continue
+            if op == 'delete':
+                return None
+            element_type = payload['type']
+        return element_type
+
+    def _check_page(self, document_id: int, page: int) -> None:
+        """Raise ValueError if a page number is beyond the latest version of the document"""
+        document = db.session.get(Document, document_id)
+        latest_version = document.get_version()
+        file_path = latest_version.local_path if latest_version else document.local_path
+        page_count = IngestService(self.pdf_service, self.cache).get_info(file_path)['page_count']
+        if page >= page_count:
+            raise ValueError(f"Page number {page} out of range (0-{page_count-1})")
+
+    def _validate(self, payload: Optional[Dict], element_type: Optional[str]) -> Dict:
+        """
+        Validate an element (element_type None) or the changed properties of an element
+
+        Returns:
+            The payload with only known properties
+        """
+        if not isinstance(payload, dict):
+            raise ValueError("The element must be an object")
+
+        if element_type is None:
+            element_type = payload.get('type')
+            if element_type not in ELEMENT_TYPES:
+                raise ValueError(f"Unknown element type: {element_type} (expected one of {', '.join(ELEMENT_TYPES)})")
+            required, optional = ELEMENT_TYPES[element_type]
+            missing = [name for name in required if name not in payload]
+            if missing:
+                raise ValueError(f"Missing element properties: {', '.join(missing)}")
+            allowed = required + optional
+            cleaned = {'type': element_type}
+        else:
+            required, optional = ELEMENT_TYPES[element_type]
+            allowed = required + optional
+            if 'type' in payload and payload['type'] != element_type:
+                raise ValueError("The type of an element cannot be changed")
+            cleaned = {}
+
+        for name, value in payload.items():
+            if name == 'type':
+                continue
+            if name not in allowed:
+                raise ValueError(f"Unknown property for a {element_type} element: {name}")
+            self._validate_property(name, value)
+            cleaned[name] = value
+        if not cleaned:
+            raise ValueError("Nothing to update")
+        return cleaned
+
+    def _validate_property(self, name: str, value) -> None:
+        def is_number(v):
+            return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+        if name == 'page':
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ValueError("page must be a page number (0-based)")
+        elif name == 'position':
+            if not isinstance(value, list) or len(value) != 2 or not all(is_number(v) for v in value):
+                raise ValueError("position must be [x, y]")
+        elif name == 'color':
+            if not isinstance(value, list) or len(value) != 3 or not all(is_number(v) and 0 <= v <= 1 for v in value):
+                raise ValueError("color must be [r, g, b] with values from 0 to 1")
+        elif name in ('font_size', 'width', 'height'):
+            if not is_number(value) or value <= 0:
+                raise ValueError(f"{name} must be a positive number")
+        elif name == 'text':
+            if not isinstance(value, str) or not value:
+                raise ValueError("text must be a non-empty string")
+        elif name == 'image':
+            try:
+                data = base64.b64decode(value, validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                raise ValueError("image must be base64-encoded image data")
+            if len(data) > self.max_image_bytes:
+                raise ValueError(f"image must be at most {self.max_image_bytes} bytes")
+            # Decode it now, so a bad image fails the edit rather than every later export
+            try:
+                fitz.Pixmap(data)
+            except Exception as e:
+                raise ValueError(f"image is not a readable image: {str(e)}")
@@ -0,0 +1,130 @@
+import difflib
+from typing import Dict, List, Optional
+
+from services.cache.artifact_cache import ArtifactCache
+from services.pdf.pdf_service import PDFService
+from services.pdf.text_layer import TextLayerService
+
+class DiffService:
+    """Service for comparing two versions of a document page by page"""
+
+    def __init__(self, pdf_service: PDFService, text_layer: TextLayerService, cache: ArtifactCache):
+        """Initialize with the PDF service, the text layer cache and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.text_layer = text_layer
+        self.cache = cache
+
+    def get_page_hashes(self, file_path: str) -> List[str]:
+        """Get the per-page content hashes of a version, computing them on first use"""
+        name = "hashes/pages.json"
+        hashes = self.cache.read_json(file_path, name)
+        if hashes is None:
+            hashes = self.pdf_service.get_page_hashes(file_path)
+            self.cache.write_json(file_path, name, hashes)
+        return hashes
+
+    def diff(self, path_a: str, path_b: str, raster: bool = False) -> Dict:
+        """
+        Compare two versions of a document
+
+        Pages are aligned by their content hashes (see
+        PDFService.get_page_hashes), so pages whose content streams and
+        annotations are equal are skipped without being looked at, and
+        inserted or removed pages do not make every following page look
+        changed. A page that differs only in a font or a nested resource is
+        reported as unchanged. Only changed pages are
+        diffed as text (and optionally as rasters). Results are cached per
+        version pair.
+
+        Args:
+            path_a: Path to the older version
+            path_b: Path to the newer version
+            raster: Whether to locate the changed region of each changed page
+
+        Returns:
+            Dictionary with a summary and a list of page changes
+        """
+        name = f"diffs/{self.cache.version_key(path_a)}{'-raster' if raster else ''}.json"
+        cached = self.cache.read_json(path_b, name)
+        if cached is not None:
+            return cached
+
+        hashes_a = self.get_page_hashes(path_a)
+        hashes_b = self.get_page_hashes(path_b)
+        texts_a = texts_b = None
+
+        changes = []
+        unchanged = 0
+        matcher = difflib.SequenceMatcher(None, hashes_a, hashes_b, autojunk=False)
+        for tag, a1, a2, b1, b2 in matcher.get_opcodes():
+            if tag == 'equal':
+                unchanged += a2 - a1
+                continue
+
+            if texts_a is None:
+                texts_a = self.text_layer.get_page_texts(path_a)
+                texts_b = self.text_layer.get_page_texts(path_b)
+
+            # Pair up replaced pages; the remainder were removed or inserted
+            paired = min(a2 - a1, b2 - b1) if tag == 'replace' else 0
+            for offset in range(paired):
+                page_a, page_b = a1 + offset, b1 + offset
+                change = {
+                    'type': 'changed',
+                    'page_a': page_a,
+                    'page_b': page_b,
+                    'text_diff': self._text_diff(texts_a[page_a], texts_b[page_b])
+                }
+                if raster:
+                    change['region'] = self._raster_diff(path_a, page_a, path_b, page_b)
+                changes.append(change)
+            for page_a in range(a1 + paired, a2):
+                changes.append({'type': 'removed', 'page_a': page_a, 'text': texts_a[page_a]})
+            for page_b in range(b1 + paired, b2):
+                changes.append({'type': 'added', 'page_b': page_b, 'text': texts_b[page_b]})
+
+        result = {
+            'page_count_a': len(hashes_a),
+            'page_count_b': len(hashes_b),
+            'unchanged_pages': unchanged,
+            'changes': changes
+        }
+        self.cache.write_json(path_b, name, result)
+        return result
+
+    def _text_diff(self, text_a: str, text_b: str) -> List[str]:
+        """Line-based unified diff of two page texts"""
+        return list(difflib.unified_diff(text_a.splitlines(), text_b.splitlines(), lineterm='', n=1))[2:]
+
+    def _raster_diff(self, path_a: str, page_a: int, path_b: str, page_b: int,
+                     scale: float = 0.5) -> Optional[List[float]]:
+        """
+        Find the bounding box of the pixels that differ between two pages
+
+        Returns:
+            [x0, y0, x1, y1] in PDF points on the newer page, or None if the
+            pages render identically at this resolution
+        """
+        raster_a = self.pdf_service.render_page_gray(path_a, page_a, scale)
+        raster_b = self.pdf_service.render_page_gray(path_b, page_b, scale)
+        width, height = raster_b['width'], raster_b['height']
+
+        if (raster_a['width'], raster_a['height']) != (width, height):
+            return [0, 0, width / scale, height / scale]
+
+        samples_a, samples_b = raster_a['samples'], raster_b['samples']
+        x0, y0, x1, y1 = width, height, -1, -1
+        for y in range(height):
+            row = slice(y * width, (y + 1) * width)
+            row_a, row_b = samples_a[row], samples_b[row]
+            if row_a == row_b:
+                continue
+            # Narrow the changed columns of this row from both ends
+            left = next(x for x in range(width) if row_a[x] != row_b[x])
+            right = next(x for x in range(width - 1, -1, -1) if row_a[x] != row_b[x])
+            x0, x1 = min(x0, left), max(x1, right)
+            y0, y1 = min(y0, y), y
+
+        if y1 < 0:
+            return None
+        return [x0 / scale, y0 / scale, (x1 + 1) / scale, (y1 + 1) / scale]
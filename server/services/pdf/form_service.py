@@ -0,0 +1,92 @@
+import os
+import uuid
+from typing import Dict, List
+
+from services.cache.artifact_cache import ArtifactCache
+from services.jobs.process_pool import get_process_pool
+from services.pdf.pdf_service import PDFService
+
+def _fill_record(upload_folder: str, file_path: str, fields: Dict, values: Dict) -> str:
+    """Fill one record into a new file (runs in a pool process)"""
+    pdf_service = PDFService(upload_folder)
+    output_path = pdf_service.new_file_path(f"{str(uuid.uuid4())}.pdf")
+    return pdf_service.fill_form(file_path, values, fields, output_path)
+
+class FormService:
+    """Service for filling AcroForm templates using a cached per-version widget index"""
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache):
+        """Initialize with the PDF service used for filling and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+
+    def get_fields(self, file_path: str) -> Dict[str, List[Dict]]:
+        """Get the widget index (field name -> page, xref, type) of a version, building it on first use"""
+        name = "forms/fields.json"
+        fields = self.cache.read_json(file_path, name)
+        if fields is None:
+            fields = self.pdf_service.get_form_fields(file_path)
+            self.cache.write_json(file_path, name, fields)
+        return fields
+
+    def check_values(self, file_path: str, values: Dict) -> None:
+        """Raise ValueError if the values name fields the template does not have"""
+        unknown = sorted(set(values) - set(self.get_fields(file_path)))
+        if unknown:
+            raise ValueError(f"Unknown form fields: {', '.join(unknown)}")
+
+    def fill(self, file_path: str, values: Dict) -> str:
+        """
+        Fill a single set of values into a template
+
+        Returns:
+            Path to the filled PDF file
+        """
+        return self.pdf_service.fill_form(file_path, values, self.get_fields(file_path))
+
+    def fill_batch(self, file_path: str, records: List[Dict], merge: bool = False) -> List[str]:
+        """
+        Fill one template with many records in parallel
+
+        Args:
+            file_path: Path to the template PDF
+            records: One dictionary of field values per output document
+            merge: Whether to combine all filled documents into a single file
+
+        Returns:
+            Paths to the filled PDF files, in record order (a single path if merged)
+        """
+        fields = self.get_fields(file_path)
+        for values in records:
+            self.check_values(file_path, values)
+
+        pool = get_process_pool()
+        upload_folder = self.pdf_service.upload_folder
+        futures = [pool.submit(_fill_record, upload_folder, file_path, fields, values) for values in records]
+
+        output_paths = []
+        try:
+            for future in futures:
+                output_paths.append(future.result())
+        except Exception:
+            for future in futures:
+                future.cancel()
+            self._remove(output_paths)
+            raise
+
+        if not merge:
+            return output_paths
+
+        try:
+            merged_path = self.pdf_service.assemble_pdf([
+                {'file_path': path, 'pages': list(range(self.pdf_service.get_document_info(path)['page_count']))}
+                for path in output_paths
+            ])
+        finally:
+            self._remove(output_paths)
+        return [merged_path]
+
+    def _remove(self, paths: List[str]) -> None:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
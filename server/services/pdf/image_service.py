@@ -0,0 +1,78 @@
+import os
+import glob
+from typing import Dict, Tuple
+
+from services.cache.artifact_cache import ArtifactCache
+from services.pdf.pdf_service import PDFService
+
+class ImageService:
+    """Service for xref-deduplicated image access with per-version caching"""
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache):
+        """Initialize with the PDF service used for extraction and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+
+    def get_index_path(self, file_path: str) -> str:
+        """
+        Get the cached image index of a document, building it on first use
+
+        The index lists every unique image once, with the pages it appears on,
+        and maps each page to the xrefs it shows. No image is decoded.
+
+        Returns:
+            Path to the JSON image index
+        """
+        name = "images/index.json"
+        if not self.cache.exists(file_path, name):
+            self.cache.write_json(file_path, name, self.pdf_service.get_image_index(file_path))
+        return self.cache.path_for(file_path, name)
+
+    def get_index(self, file_path: str) -> Dict:
+        """Get the image index of a document as a dictionary"""
+        self.get_index_path(file_path)
+        return self.cache.read_json(file_path, "images/index.json")
+
+    def get_image_path(self, file_path: str, xref: int) -> Tuple[str, str]:
+        """
+        Get a single image by xref, extracting it on first use
+
+        Args:
+            file_path: Path to the PDF file
+            xref: Cross-reference number of the image
+
+        Returns:
+            Tuple of (path to the cached image, image format)
+        """
+        cached = glob.glob(self.cache.path_for(file_path, f"images/{xref}.*"))
+        if cached:
+            return cached[0], os.path.splitext(cached[0])[1][1:]
+
+        self._check_xref(file_path, xref)
+        image = self.pdf_service.extract_image(file_path, xref)
+        path = self.cache.write_bytes(file_path, f"images/{xref}.{image['format']}", image['data'])
+        return path, image['format']
+
+    def get_thumbnail_path(self, file_path: str, xref: int, max_size: int) -> str:
+        """
+        Get a PNG thumbnail of a single image, rendering it on first use
+
+        Args:
+            file_path: Path to the PDF file
+            xref: Cross-reference number of the image
+            max_size: Maximum width or height of the thumbnail in pixels
+
+        Returns:
+            Path to the cached thumbnail
+        """
+        name = f"images/{xref}_thumb{max_size}.png"
+        if not self.cache.exists(file_path, name):
+            self._check_xref(file_path, xref)
+            self.cache.write_bytes(file_path, name,
+                                   self.pdf_service.render_image_thumbnail(file_path, xref, max_size))
+        return self.cache.path_for(file_path, name)
+
+    def _check_xref(self, file_path: str, xref: int) -> None:
+        """Make sure an xref refers to an image shown in the document"""
+        if not any(image['xref'] == xref for image in self.get_index(file_path)['images']):
+            raise LookupError(f"Image {xref} not found")
@@ -0,0 +1,187 @@
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from flask import current_app
+
+from models.db import db, Document
+from services.ai.corpus_index import CorpusIndex, get_corpus_index
+from services.cache.artifact_cache import ArtifactCache
+from services.jobs.job_queue import job_queue, PRIORITY_BACKGROUND
+from services.pdf.pdf_service import PDFService
+from services.pdf.text_layer import TextLayerService
+from services.pdf.diff_service import DiffService
+from services.pdf.thumbnail_service import ThumbnailService
+
+STATUS_NAME = "ingest/status.json"
+
+class IngestService:
+    """
+    Service for precomputing the cached artifacts of a new version
+
+    Every stage fills the same per-version artifact cache the request
+    handlers read from, so a warmed version is served without touching
+    PyMuPDF on its first view, text extraction or search. Stages skip
+    artifacts that already exist, so re-running the pipeline is cheap.
+    """
+
+    # Stage name -> method name, in execution order
+    STAGES = {
+        'hash': '_stage_hash',              # File digest and per-page hashes (used by diffs)
+        'metadata': '_stage_metadata',      # Page count and form flag (used by document details)
+        'text': '_stage_text',              # Per-page word layers (used by the viewer)
+        'thumbnails': '_stage_thumbnails',  # Page thumbnails
+        'search': '_stage_search',          # Page text index (used by search and diffs)
+        'corpus': '_stage_corpus'           # User's cross-document page index (used by /api/ai/ask)
+    }
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache, thumbnail_size: int = 200,
+                 corpus_index: Optional[CorpusIndex] = None):
+        """Initialize with the PDF service, the artifact cache, the thumbnail size to warm and the corpus index to fill"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+        self.thumbnail_size = thumbnail_size
+        self.corpus_index = corpus_index
+        self.text_layer = TextLayerService(pdf_service, cache)
+
+    def get_info(self, file_path: str) -> Dict:
+        """Get the basic information of a version (see PDFService.get_document_info), computing it on first use"""
+        name = "info.json"
+        info = self.cache.read_json(file_path, name)
+        if info is None:
+            info = self.pdf_service.get_document_info(file_path)
+            self.cache.write_json(file_path, name, info)
+        return info
+
+    def get_file_hash(self, file_path: str) -> str:
+        """Get the SHA-256 digest of a version file, computing it on first use"""
+        name = "hashes/file.json"
+        cached = self.cache.read_json(file_path, name)
+        if cached is None:
+            cached = {'sha256': self.pdf_service.get_file_hash(file_path)}
+            self.cache.write_json(file_path, name, cached)
+        return cached['sha256']
+
+    def get_status(self, file_path: str) -> Optional[Dict]:
+        """Get the ingest status of a version, or None if it was never scheduled"""
+        return self.cache.read_json(file_path, STATUS_NAME)
+
+    def mark_queued(self, file_path: str, stages: List[str]) -> None:
+        """Record that the pipeline is scheduled for a version"""
+        self.cache.write_json(file_path, STATUS_NAME, {
+            'status': 'queued',
+            'stages': {stage: {'status': 'pending'} for stage in stages},
+            'queued_at': datetime.utcnow().isoformat()
+        })
+
+    def run(self, file_path: str, stages: List[str], document_id: Optional[int] = None) -> Dict:
+        """
+        Run the given stages in order, recording progress after each one
+
+        A failing stage is recorded and the remaining stages still run, since
+        each one only warms a cache the request handlers can fill themselves.
+
+        Args:
+            file_path: Path to the version file
+            stages: Names of the stages to run (keys of STAGES)
+            document_id: ID of the document the version belongs to (needed by the corpus stage)
+
+        Returns:
+            The final status dictionary
+        """
+        status = self.get_status(file_path) or {}
+        status.update({
+            'status': 'running',
+            'stages': {stage: {'status': 'pending'} for stage in stages},
+            'started_at': datetime.utcnow().isoformat()
+        })
+        self.cache.write_json(file_path, STATUS_NAME, status)
+
+        failed = False
+        for stage in stages:
+            started = time.perf_counter()
+            try:
+                if stage not in self.STAGES:
+                    raise ValueError(f"Unknown ingest stage: {stage}")
+                getattr(self, self.STAGES[stage])(file_path, document_id)
+                status['stages'][stage] = {'status': 'completed'}
+            except Exception as e:
+                failed = True
+                status['stages'][stage] = {'status': 'failed', 'error': str(e)}
+            status['stages'][stage]['seconds'] = round(time.perf_counter() - started, 3)
+            self.cache.write_json(file_path, STATUS_NAME, status)
+
+        status['status'] = 'failed' if failed else 'completed'
+        status['finished_at'] = datetime.utcnow().isoformat()
+        self.cache.write_json(file_path, STATUS_NAME, status)
+        return status
+
+    def _stage_hash(self, file_path: str, document_id: Optional[int]) -> None:
+        self.get_file_hash(file_path)
+        DiffService(self.pdf_service, self.text_layer, self.cache).get_page_hashes(file_path)
+
+    def _stage_metadata(self, file_path: str, document_id: Optional[int]) -> None:
+        self.get_info(file_path)
+
+    def _stage_text(self, file_path: str, document_id: Optional[int]) -> None:
+        self.text_layer.warm_words(file_path)
+
+    def _stage_thumbnails(self, file_path: str, document_id: Optional[int]) -> None:
+        ThumbnailService(self.pdf_service, self.cache).warm(
+            file_path, self.thumbnail_size, self.get_info(file_path)['page_count'])
+
+    def _stage_search(self, file_path: str, document_id: Optional[int]) -> None:
+        self.text_layer.get_page_texts(file_path)
+
+    def _stage_corpus(self, file_path: str, document_id: Optional[int]) -> None:
+        if self.corpus_index is None or document_id is None:
+            raise ValueError("The corpus stage needs the corpus index and the document")
+        document = db.session.get(Document, document_id)
+        if document is None:
+            # Deleted meanwhile
+            return
+        # Jobs of consecutive versions may finish out of order; only the latest version is indexed
+        latest_version = document.get_version()
+        version_key = self.cache.version_key(file_path)
+        if self.cache.version_key(latest_version.file_path if latest_version else document.file_path) != version_key:
+            return
+        self.corpus_index.index_version(document_id, document.user_id, version_key,
+                                        self.text_layer.get_page_texts(file_path))
+
+def run_ingest(upload_folder: str, cache_folder: str, file_path: str, stages: List[str],
+               thumbnail_size: int, document_id: Optional[int] = None) -> Dict:
+    """Run the ingest pipeline for one version (job entry point)"""
+    service = IngestService(PDFService(upload_folder), ArtifactCache(cache_folder), thumbnail_size,
+                            get_corpus_index())
+    result = service.run(file_path, stages, document_id)
+    if result['status'] == 'failed':
+        failed = [stage for stage, state in result['stages'].items() if state['status'] == 'failed']
+        raise ValueError(f"Ingest stages failed: {', '.join(failed)}")
+    return result
+
+def schedule_ingest(user_id: int, document_id: int, file_path: str) -> None:
+    """
+    Queue the ingest pipeline for a newly stored version at background priority
+
+    Call after the version is committed. Does nothing if INGEST_STAGES is empty.
+
+    Args:
+        user_id: ID of the user who created the version
+        document_id: ID of the document
+        file_path: Local path of the version file
+    """
+    stages = current_app.config.get('INGEST_STAGES', [])
+    if not stages:
+        return
+
+    # Warming is an optimization, so a scheduling failure must not fail the request
+    try:
+        service = IngestService(PDFService(current_app.config['UPLOAD_FOLDER']),
+                                ArtifactCache(current_app.config['CACHE_FOLDER']))
+        service.mark_queued(file_path, stages)
+        job_queue.enqueue('ingest', user_id, run_ingest,
+                          current_app.config['UPLOAD_FOLDER'], current_app.config['CACHE_FOLDER'],
+                          file_path, stages, current_app.config['INGEST_THUMBNAIL_SIZE'], document_id,
+                          document_id=document_id, priority=PRIORITY_BACKGROUND)
+    except Exception as e:
+        current_app.logger.warning(f"Could not schedule ingest for document {document_id}: {e}")
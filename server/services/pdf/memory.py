@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import ctypes
+import logging
+import threading
+import functools
+import inspect
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from services.lazy import lazy_import
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+fitz = lazy_import('fitz')  # PyMuPDF, loaded on first use
+
+logger = logging.getLogger(__name__)
+
+# MuPDF's default store maximum (FZ_STORE_DEFAULT), used when PyMuPDF does not report it
+DEFAULT_STORE_MAX = 256 << 20
+
+MB = 1024 * 1024
+
+def current_rss() -> Optional[int]:
+    """Resident set size of this process in bytes (None where /proc is unavailable)"""
+    if resource is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peak_rss() -> Optional[int]:
+    """Highest resident set size of this process so far in bytes (None where getrusage is unavailable)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _malloc_trim() -> bool:
+    """Return free heap memory to the operating system (glibc only)"""
+    try:
+        return bool(ctypes.CDLL('libc.so.6').malloc_trim(0))
+    except (OSError, AttributeError):
+        return False
+
+class MemoryGovernor:
+    """
+    Per-process memory budget for MuPDF work, with accounting per operation
+
+    MuPDF keeps decoded fonts, images and display lists in a process-wide
+    store that only shrinks when it reaches its maximum (256MB by default),
+    and freed C heap memory is rarely returned to the operating system, so a
+    worker's RSS ratchets up with the largest documents it has seen. The
+    governor measures the RSS of every PDFService call and, after each call:
+    - shrinks the store back to store_budget
+    - after heavy calls (heavy operations, or calls that grew RSS by at
+      least heavy_delta), empties the store and glyph cache and trims the heap
+    - does the same whenever RSS is above rss_soft_limit
+
+    RSS is process-wide, so with concurrent requests a call's delta also
+    includes the memory of calls running beside it; the figures are meant
+    for sizing containers, not for exact attribution.
+    """
+
+    def __init__(self, store_budget: int = 0, heavy_delta: int = 64 * MB, rss_soft_limit: int = 0,
+                 low_memory: bool = False):
+        """
+        Args:
+            store_budget: Bytes the MuPDF store is shrunk to after each call (0 leaves the store alone)
+            heavy_delta: RSS growth of a call that makes it heavy (bytes, 0 to only use heavy operations)
+            rss_soft_limit: RSS above which memory is released after every call (bytes, 0 for none)
+            low_memory: Whether to switch PyMuPDF to its low-memory mode (no display list caching)
+        """
+        self.store_budget = store_budget
+        self.heavy_delta = heavy_delta
+        self.rss_soft_limit = rss_soft_limit
+        self.low_memory = low_memory
+        self._applied = False
+        self._operations = {}
+        self._endpoints = {}
+        self._counters = {'store_shrinks': 0, 'releases': 0, 'soft_limit_releases': 0}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, operation: str, heavy: bool = False):
+        """
+        Account the memory of a MuPDF call and enforce the budget afterwards
+
+        Args:
+            operation: Operation name the call is recorded under
+            heavy: Whether the operation is known to be heavy (rendering, image decoding, rewriting)
+        """
+        self._apply_settings()
+        rss_before = current_rss()
+        peak_before = peak_rss()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            rss_after = current_rss()
+            peak_after = peak_rss()
+            delta = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            # The process high-water mark only moves when this call (or one beside it) set a new peak
+            peak = peak_after if peak_after is not None and peak_after > peak_before else rss_after
+            self._record(operation, time.perf_counter() - started, delta, peak)
+
+            if self.rss_soft_limit and rss_after is not None and rss_after > self.rss_soft_limit:
+                self._release(soft_limit=True)
+            elif heavy or (self.heavy_delta and delta is not None and delta >= self.heavy_delta):
+                self._release()
+            else:
+                self.shrink_store()
+
+    def shrink_store(self) -> None:
+        """Shrink the MuPDF store to store_budget, evicting the least recently used items"""
+        if not self.store_budget:
+            return
+        store_max = self._store_value('store_maxsize') or DEFAULT_STORE_MAX
+        if self.store_budget >= store_max:
+            return
+        store_size = self._store_value('store_size')
+        if store_size is not None and store_size <= self.store_budget:
+            return
+        # fz_shrink_store takes a percentage of the store's maximum
+        fitz.TOOLS.store_shrink(max(0, int(self.store_budget * 100 / store_max)))
+        with self._lock:
+            self._counters['store_shrinks'] += 1
+
+    def release(self) -> None:
+        """Empty the MuPDF store and glyph cache and return free heap memory to the operating system"""
+        self._release()
+
+    def stats(self) -> Dict:
+        """Process memory, store figures, budget counters, and memory per operation and endpoint"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'rss': current_rss(),
+                'peak_rss': peak_rss(),
+                'store': {
+                    'size': self._store_value('store_size'),
+                    'max': self._store_value('store_maxsize'),
+                    'budget': self.store_budget
+                },
+                'heavy_delta': self.heavy_delta,
+                'rss_soft_limit': self.rss_soft_limit,
+                'low_memory': self.low_memory,
+                **self._counters,
+                'operations': {name: self._summary(entry) for name, entry in self._operations.items()},
+                'endpoints': {name: self._summary(entry) for name, entry in self._endpoints.items()}
+            }
+
+    def _release(self, soft_limit: bool = False) -> None:
+        fitz.TOOLS.store_shrink(100)
+        fitz.TOOLS.glyph_cache_empty()
+        _malloc_trim()
+        with self._lock:
+            self._counters['releases'] += 1
+            if soft_limit:
+                self._counters['soft_limit_releases'] += 1
+
+    def _apply_settings(self) -> None:
+        # Deferred to the first call so PyMuPDF still loads lazily
+        if self._applied:
+            return
+        self._applied = True
+        if self.low_memory:
+            fitz.TOOLS.set_low_memory(True)
+
+    def _store_value(self, name: str) -> Optional[int]:
+        """A store figure from PyMuPDF (a property in older releases, a stub method in newer ones)"""
+        if 'fitz' not in sys.modules:
+            return None
+        value = getattr(fitz.TOOLS, name, None)
+        if callable(value):
+            value = value()
+        return value if isinstance(value, int) else None
+
+    def _record(self, operation: str, seconds: float, delta: Optional[int], peak: Optional[int]) -> None:
+        endpoint = _current_endpoint()
+        with self._lock:
+            for table, key in ((self._operations, operation), (self._endpoints, endpoint)):
+                if key is None:
+                    continue
+                entry = table.setdefault(key, {'calls': 0, 'seconds': 0.0, 'rss_delta_total': 0,
+                                               'rss_delta_max': 0, 'peak_rss_max': 0})
+                entry['calls'] += 1
+                entry['seconds'] += seconds
+                if delta is not None:
+                    entry['rss_delta_total'] += delta
+                    entry['rss_delta_max'] = max(entry['rss_delta_max'], delta)
+                if peak is not None:
+                    entry['peak_rss_max'] = max(entry['peak_rss_max'], peak)
+
+    @staticmethod
+    def _summary(entry: Dict) -> Dict:
+        return {
+            'calls': entry['calls'],
+            'avg_seconds': round(entry['seconds'] / entry['calls'], 4),
+            'avg_rss_delta': entry['rss_delta_total'] // entry['calls'],
+            'max_rss_delta': entry['rss_delta_max'],
+            'max_peak_rss': entry['peak_rss_max']
+        }
+
+def _current_endpoint() -> Optional[str]:
+    """Endpoint of the Flask request being handled, if any"""
+    try:
+        from flask import has_request_context, request
+    except ImportError:
+        return None
+    return request.endpoint if has_request_context() else None
+
+_governor = None
+_governor_pid = None
+_governor_lock = threading.Lock()
+
+# Settings of the governor, defaulting from the environment so process pool workers share them
+_settings = {
+    'store_budget': int(os.environ.get('MUPDF_STORE_MAX_MB', 0)) * MB,
+    'heavy_delta': int(os.environ.get('MUPDF_HEAVY_DELTA_MB', 64)) * MB,
+    'rss_soft_limit': int(os.environ.get('MUPDF_RSS_SOFT_LIMIT_MB', 0)) * MB,
+    'low_memory': os.environ.get('MUPDF_LOW_MEMORY', 'false').lower() == 'true'
+}
+
+def configure_memory(config) -> None:
+    """Set the memory budget from the app config (MUPDF_* settings)"""
+    global _governor
+    with _governor_lock:
+        _settings.update(
+            store_budget=config['MUPDF_STORE_MAX_MB'] * MB,
+            heavy_delta=config['MUPDF_HEAVY_DELTA_MB'] * MB,
+            rss_soft_limit=config['MUPDF_RSS_SOFT_LIMIT_MB'] * MB,
+            low_memory=config['MUPDF_LOW_MEMORY']
+        )
+        _governor = None
+
+def get_memory_governor() -> MemoryGovernor:
+    """Get the memory governor of this process (recreated after a fork)"""
+    global _governor, _governor_pid
+    with _governor_lock:
+        if _governor is None or _governor_pid != os.getpid():
+            _governor = MemoryGovernor(**_settings)
+            _governor_pid = os.getpid()
+        return _governor
+
+def memory_tracked(operation: Optional[str] = None, heavy: bool = False):
+    """
+    Track the memory of a PDFService method with the process's memory governor
+
+    Generator methods are tracked from the first item until the generator
+    is exhausted or closed, so streamed work is accounted as one call.
+
+    Args:
+        operation: Name to record the calls under (default: the method name)
+        heavy: Whether to release MuPDF's caches after every call
+    """
+    def decorator(func):
+        name = operation or func.__name__
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                with get_memory_governor().track(name, heavy):
+                    yield from func(*args, **kwargs)
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_memory_governor().track(name, heavy):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,38 @@
+from typing import Optional, Tuple
+
+from services.cache.artifact_cache import ArtifactCache
+from services.pdf.pdf_service import PDFService
+
+class PageRangeService:
+    """Service for building and caching standalone PDFs of page ranges per version"""
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache):
+        """Initialize with the PDF service used for extraction and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+
+    def get_range_path(self, file_path: str, first_page: int, last_page: int) -> Tuple[str, Optional[int]]:
+        """
+        Get a standalone PDF of a page range, building it on first use
+
+        Args:
+            file_path: Path to the PDF file
+            first_page: First page of the range (0-based index)
+            last_page: Last page of the range (0-based index, inclusive)
+
+        Returns:
+            Tuple of (path to the cached PDF, page count of the document,
+            or None if a cached range is served before the metadata is cached)
+        """
+        name = self.artifact_name(first_page, last_page)
+        if self.cache.exists(file_path, name):
+            info = self.cache.read_json(file_path, "info.json")
+            return self.cache.path_for(file_path, name), info['page_count'] if info else None
+
+        data, page_count = self.pdf_service.extract_page_range(file_path, first_page, last_page)
+        return self.cache.write_bytes(file_path, name, data), page_count
+
+    @staticmethod
+    def artifact_name(first_page: int, last_page: int) -> str:
+        """Cache name of the PDF of a page range"""
+        return f"pages/{first_page}-{last_page}.pdf"
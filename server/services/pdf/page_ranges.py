@@ -0,0 +1,68 @@
+from typing import List, Tuple, Union
+
+PageSelection = Union[None, str, List[int]]
+
+def parse_page_selection(selection: PageSelection, page_count: int) -> List[int]:
+    """
+    Resolve a page selection to a list of page numbers
+
+    Page numbers are 0-based, like everywhere else in the API.
+
+    Args:
+        selection: None or "all" for every page, a list of page numbers,
+                   or a string of comma-separated numbers and ranges ("0-4,7,9-")
+        page_count: Number of pages in the document
+
+    Returns:
+        List of page numbers in the requested order
+
+    Raises:
+        ValueError: If the selection is malformed or out of range
+    """
+    if selection is None or selection == 'all':
+        return list(range(page_count))
+
+    if isinstance(selection, list):
+        pages = selection
+    elif isinstance(selection, str):
+        pages = []
+        for part in selection.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                if '-' in part:
+                    start, _, end = part.partition('-')
+                    start = int(start) if start.strip() else 0
+                    end = int(end) if end.strip() else page_count - 1
+                    step = 1 if end >= start else -1
+                    pages.extend(range(start, end + step, step))
+                else:
+                    pages.append(int(part))
+            except ValueError:
+                raise ValueError(f"Invalid page range: {part}")
+    else:
+        raise ValueError("Page selection must be a list of page numbers or a range string")
+
+    for page in pages:
+        if not isinstance(page, int) or not 0 <= page < page_count:
+            raise ValueError(f"Page number {page} out of range (0-{page_count-1})")
+    return pages
+
+def group_page_runs(pages: List[int]) -> List[Tuple[int, int]]:
+    """
+    Group a list of page numbers into runs of ascending consecutive pages
+
+    Args:
+        pages: Page numbers in output order
+
+    Returns:
+        List of (first_page, last_page) tuples covering pages in order
+    """
+    runs: List[List[int]] = []
+    for page in pages:
+        if runs and page == runs[-1][1] + 1:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return [(first, last) for first, last in runs]
@@ -1,15 +1,59 @@
 import os
+import mmap
 import uuid
-import fitz  # PyMuPDF
-from typing import Dict, List, Tuple, Optional, BinaryIO
+import math
+import base64
+import hashlib
+from typing import Dict, List, Tuple, Optional, BinaryIO, Iterable, Iterator
 from werkzeug.datastructures import FileStorage
 
+from services.lazy import lazy_import
+from services.pdf.memory import memory_tracked
+from services.pdf.page_ranges import group_page_runs
+from services.storage.base import shard_key
+
+fitz = lazy_import('fitz')  # PyMuPDF, loaded on first use
+
 class PDFService:
     """Service for handling PDF operations"""
     
+    # Open documents from read-only memory maps (see open_document); set from PDF_OPEN_MMAP
+    use_mmap = os.environ.get('PDF_OPEN_MMAP', 'true').lower() == 'true'
+    
     def __init__(self, upload_folder: str):
         """Initialize with the folder for storing uploaded files"""
         self.upload_folder = upload_folder
+    
+    def open_document(self, file_path: str):
+        """
+        Open a PDF file with PyMuPDF
+        
+        With use_mmap, the file is opened from a read-only memory map instead
+        of being read through a file stream: every worker process maps the
+        same page-cache pages, and MuPDF's random access to objects costs no
+        read() calls or copies. Version files are never modified in place,
+        so the mapping stays valid. Needs PyMuPDF 1.25.4 or later (earlier
+        releases reject memoryview streams); empty files are opened by path.
+        
+        Args:
+            file_path: Path to the PDF file
+            
+        Returns:
+            The opened fitz.Document
+        """
+        if self.use_mmap:
+            try:
+                with open(file_path, 'rb') as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # An empty file cannot be mapped; opening the path reports it properly
+                pass
+            else:
+                doc = fitz.open("pdf", memoryview(mapping))
+                # The document reads from the mapping, so keep it alive as long as the document
+                doc._source_mapping = mapping
+                return doc
+        return fitz.open(file_path)
         
     def save_uploaded_file(self, file: FileStorage) -> Tuple[str, str, int]:
         """
@@ -25,7 +69,7 @@ class PDFService:
         original_filename = file.filename
         extension = os.path.splitext(original_filename)[1]
         unique_filename = f"{str(uuid.uuid4())}{extension}"
-        file_path = os.path.join(self.upload_folder, unique_filename)
+        file_path = self.new_file_path(unique_filename)
         
         # Save the file
         file.save(file_path)
@@ -33,6 +77,7 @@ class PDFService:
         
         return unique_filename, file_path, file_size
     
+    @memory_tracked()
     def get_document_info(self, file_path: str) -> Dict:
         """
         Get basic information about a PDF document
@@ -44,7 +89,7 @@ class PDFService:
             Dictionary with document metadata
         """
         try:
-            doc = fitz.open(file_path)
+            doc = self.open_document(file_path)
             
             info = {
                 'page_count': len(doc),
@@ -68,6 +113,7 @@ class PDFService:
         except Exception as e:
             raise ValueError(f"Error reading PDF: {str(e)}")
     
+    @memory_tracked()
     def extract_text(self, file_path: str, page_number: Optional[int] = None) -> Dict:
         """
         Extract text from a PDF document
@@ -81,7 +127,7 @@ class PDFService:
             Dictionary with extracted text
         """
         try:
-            doc = fitz.open(file_path)
+            doc = self.open_document(file_path)
             result = {}
             
             if page_number is not None:
@@ -101,6 +147,248 @@ class PDFService:
         except Exception as e:
             raise ValueError(f"Error extracting text: {str(e)}")
     
+    @memory_tracked()
+    def iter_text(self, file_path: str) -> Iterator[Tuple[int, str]]:
+        """
+        Extract text page by page
+
+        Unlike extract_text, only one page's text is held at a time, so
+        callers can stream the results of large documents.
+
+        Args:
+            file_path: Path to the PDF file
+
+        Yields:
+            Tuples of (page_number, text)
+        """
+        try:
+            doc = self.open_document(file_path)
+        except Exception as e:
+            raise ValueError(f"Error extracting text: {str(e)}")
+
+        try:
+            for i in range(len(doc)):
+                yield i, doc[i].get_text()
+        finally:
+            doc.close()
+
+    @memory_tracked()
+    def extract_words(self, file_path: str, page_number: int) -> Dict:
+        """
+        Extract the words of a page together with their bounding boxes
+
+        Args:
+            file_path: Path to the PDF file
+            page_number: Page number to extract from (0-based index)
+
+        Returns:
+            Dictionary with the page size and a list of
+            (x0, y0, x1, y1, word, block_no, line_no, word_no) tuples
+        """
+        try:
+            doc = self.open_document(file_path)
+
+            page_count = len(doc)
+            if not 0 <= page_number < page_count:
+                doc.close()
+                raise ValueError(f"Page number {page_number} out of range (0-{page_count - 1})")
+
+            page = doc[page_number]
+            result = {
+                'width': page.rect.width,
+                'height': page.rect.height,
+                'words': page.get_text("words")
+            }
+
+            doc.close()
+            return result
+
+        except Exception as e:
+            raise ValueError(f"Error extracting words: {str(e)}")
+
+    @memory_tracked()
+    def iter_words(self, file_path: str) -> Iterator[Tuple[int, Dict]]:
+        """
+        Extract the words of every page, opening the document once
+
+        Args:
+            file_path: Path to the PDF file
+
+        Yields:
+            Tuples of (page number, result), with results shaped like extract_words
+        """
+        try:
+            doc = self.open_document(file_path)
+        except Exception as e:
+            raise ValueError(f"Error extracting words: {str(e)}")
+
+        try:
+            for page_number, page in enumerate(doc):
+                yield page_number, {
+                    'width': page.rect.width,
+                    'height': page.rect.height,
+                    'words': page.get_text("words")
+                }
+        finally:
+            doc.close()
+
+    @memory_tracked()
+    def search_text(self, file_path: str, query: str,
+                    page_numbers: Iterable[int]) -> Iterator[Tuple[int, List[List[float]]]]:
+        """
+        Search for a string on the given pages
+
+        The document stays open while the generator is consumed, so callers
+        can stream results page by page.
+
+        Args:
+            file_path: Path to the PDF file
+            query: Text to search for (case-insensitive)
+            page_numbers: Page numbers to search (0-based index)
+
+        Yields:
+            Tuples of (page_number, hit quads), where each quad is given as
+            [ul.x, ul.y, ur.x, ur.y, ll.x, ll.y, lr.x, lr.y]
+        """
+        try:
+            doc = self.open_document(file_path)
+        except Exception as e:
+            raise ValueError(f"Error searching text: {str(e)}")
+
+        try:
+            for page_idx in page_numbers:
+                if 0 <= page_idx < len(doc):
+                    quads = doc[page_idx].search_for(query, quads=True)
+                    if quads:
+                        yield page_idx, [
+                            [round(v, 2) for point in (q.ul, q.ur, q.ll, q.lr) for v in point]
+                            for q in quads
+                        ]
+        finally:
+            doc.close()
+
+    @memory_tracked()
+    def get_page_hashes(self, file_path: str) -> List[str]:
+        """
+        Compute a content hash for every page
+
+        The hash covers the page geometry, its content streams, the raw
+        streams of the images and form XObjects it draws directly, and its
+        annotations, so equal hashes mean those content streams and
+        annotations are equal. Fonts and the resources of nested XObjects
+        are not covered. Streams are hashed without decompressing them.
+
+        Args:
+            file_path: Path to the PDF file
+
+        Returns:
+            List of hex digests, indexed by page number (0-based)
+        """
+        try:
+            doc = self.open_document(file_path)
+            hashes = []
+
+            for page in doc:
+                digest = hashlib.sha256()
+                digest.update(f"{tuple(page.rect)}|{page.rotation}|".encode('utf-8'))
+                digest.update(page.read_contents())
+                xrefs = sorted({img[0] for img in page.get_images(full=True)} |
+                               {xobj[0] for xobj in page.get_xobjects()})
+                for xref in xrefs:
+                    digest.update(doc.xref_stream_raw(xref) or b'')
+                for annot in page.annots() or []:
+                    digest.update(doc.xref_object(annot.xref, compressed=True).encode('utf-8'))
+                hashes.append(digest.hexdigest())
+
+            doc.close()
+            return hashes
+
+        except Exception as e:
+            raise ValueError(f"Error hashing pages: {str(e)}")
+
+    @memory_tracked()
+    def render_page_gray(self, file_path: str, page_number: int, scale: float = 0.5) -> Dict:
+        """
+        Render a page to an 8-bit grayscale raster
+
+        Args:
+            file_path: Path to the PDF file
+            page_number: Page number to render (0-based index)
+            scale: Zoom factor relative to 72 dpi
+
+        Returns:
+            Dictionary with 'width', 'height', 'samples' (one byte per pixel,
+            row by row) and the 'scale' used
+        """
+        try:
+            doc = self.open_document(file_path)
+
+            if not 0 <= page_number < len(doc):
+                doc.close()
+                raise ValueError(f"Page number {page_number} out of range (0-{len(doc)-1})")
+
+            pix = doc[page_number].get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+            result = {
+                'width': pix.width,
+                'height': pix.height,
+                'samples': pix.samples if pix.stride == pix.width else
+                           b''.join(pix.samples[y * pix.stride:y * pix.stride + pix.width] for y in range(pix.height)),
+                'scale': scale
+            }
+
+            doc.close()
+            return result
+
+        except Exception as e:
+            raise ValueError(f"Error rendering page: {str(e)}")
+
+    def get_file_hash(self, file_path: str) -> str:
+        """
+        Compute the SHA-256 digest of a file, reading it in chunks
+
+        Args:
+            file_path: Path to the file
+
+        Returns:
+            Hex digest
+        """
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @memory_tracked(heavy=True)
+    def render_page_thumbnails(self, file_path: str, max_size: int = 200,
+                               pages: Optional[List[int]] = None) -> Iterator[Tuple[int, bytes]]:
+        """
+        Render pages as PNG thumbnails, opening the document once
+
+        Args:
+            file_path: Path to the PDF file
+            max_size: Maximum width or height of a thumbnail in pixels
+            pages: Page numbers to render (0-based), or None for all pages
+
+        Yields:
+            Tuples of (page number, PNG bytes)
+        """
+        try:
+            doc = self.open_document(file_path)
+        except Exception as e:
+            raise ValueError(f"Error rendering thumbnails: {str(e)}")
+
+        try:
+            for page_number in (pages if pages is not None else range(len(doc))):
+                if not 0 <= page_number < len(doc):
+                    raise ValueError(f"Page number {page_number} out of range (0-{len(doc)-1})")
+                page = doc[page_number]
+                scale = max_size / max(page.rect.width, page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+                yield page_number, pix.tobytes('png')
+        finally:
+            doc.close()
+
+    @memory_tracked(heavy=True)
     def extract_images(self, file_path: str, page_number: Optional[int] = None) -> List[Dict]:
         """
         Extract images from a PDF document
@@ -114,11 +402,14 @@ class PDFService:
             List of dictionaries with image data and metadata
         """
         try:
-            doc = fitz.open(file_path)
+            doc = self.open_document(file_path)
             images = []
             
             pages_to_process = [page_number] if page_number is not None else range(len(doc))
             
+            # Images shared between pages (logos, letterheads) are decoded once
+            decoded = {}
+            
             for page_idx in pages_to_process:
                 if 0 <= page_idx < len(doc):
                     page = doc[page_idx]
@@ -126,7 +417,9 @@ class PDFService:
                     
                     for img_idx, img_info in enumerate(image_list):
                         xref = img_info[0]
-                        base_image = doc.extract_image(xref)
+                        if xref not in decoded:
+                            decoded[xref] = doc.extract_image(xref)
+                        base_image = decoded[xref]
                         
                         if base_image:
                             images.append({
@@ -144,7 +437,169 @@ class PDFService:
             
         except Exception as e:
             raise ValueError(f"Error extracting images: {str(e)}")
-    
+
+    @memory_tracked(heavy=True)
+    def iter_images(self, file_path: str, page_number: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Extract unique images one at a time
+
+        Yields the same dictionaries as extract_images, but decodes each image
+        only when the consumer asks for it, so memory stays bounded. Images
+        shared between pages are yielded once, at their first occurrence.
+
+        Args:
+            file_path: Path to the PDF file
+            page_number: Optional page number to extract from (0-based index)
+                        If None, extract from all pages
+
+        Yields:
+            Dictionaries with image data and metadata
+        """
+        try:
+            doc = self.open_document(file_path)
+        except Exception as e:
+            raise ValueError(f"Error extracting images: {str(e)}")
+
+        try:
+            pages_to_process = [page_number] if page_number is not None else range(len(doc))
+            seen = set()
+
+            for page_idx in pages_to_process:
+                if 0 <= page_idx < len(doc):
+                    for img_idx, img_info in enumerate(doc[page_idx].get_images(full=True)):
+                        xref = img_info[0]
+                        if xref in seen:
+                            continue
+                        seen.add(xref)
+                        base_image = doc.extract_image(xref)
+
+                        if base_image:
+                            yield {
+                                'page': page_idx,
+                                'index': img_idx,
+                                'width': base_image['width'],
+                                'height': base_image['height'],
+                                'format': base_image['ext'],
+                                'data': base_image['image'],
+                                'xref': xref
+                            }
+        finally:
+            doc.close()
+
+    @memory_tracked()
+    def get_image_index(self, file_path: str) -> Dict:
+        """
+        Index the images of a document without decoding them
+
+        Args:
+            file_path: Path to the PDF file
+
+        Returns:
+            Dictionary with one metadata entry per unique image xref and a
+            per-page list of the xrefs shown on that page
+        """
+        try:
+            doc = self.open_document(file_path)
+            images = {}
+            pages = []
+
+            for page_idx in range(len(doc)):
+                page_xrefs = []
+                for xref, smask, width, height, bpc, colorspace, _alt, name, image_filter, *_ in \
+                        doc[page_idx].get_images(full=True):
+                    page_xrefs.append(xref)
+                    if xref not in images:
+                        images[xref] = {
+                            'xref': xref,
+                            'width': width,
+                            'height': height,
+                            'bpc': bpc,
+                            'colorspace': colorspace,
+                            'filter': image_filter,
+                            'has_mask': smask > 0,
+                            'pages': []
+                        }
+                    if not images[xref]['pages'] or images[xref]['pages'][-1] != page_idx:
+                        images[xref]['pages'].append(page_idx)
+                pages.append(page_xrefs)
+
+            doc.close()
+            return {
+                'page_count': len(pages),
+                'images': list(images.values()),
+                'pages': pages
+            }
+
+        except Exception as e:
+            raise ValueError(f"Error indexing images: {str(e)}")
+
+    @memory_tracked()
+    def extract_image(self, file_path: str, xref: int) -> Dict:
+        """
+        Extract a single image by its xref
+
+        Args:
+            file_path: Path to the PDF file
+            xref: Cross-reference number of the image
+
+        Returns:
+            Dictionary with image data and metadata
+        """
+        try:
+            doc = self.open_document(file_path)
+            base_image = doc.extract_image(xref)
+            doc.close()
+
+            if not base_image:
+                raise ValueError(f"Object {xref} is not an image")
+
+            return {
+                'xref': xref,
+                'width': base_image['width'],
+                'height': base_image['height'],
+                'format': base_image['ext'],
+                'data': base_image['image']
+            }
+
+        except Exception as e:
+            raise ValueError(f"Error extracting image: {str(e)}")
+
+    @memory_tracked()
+    def render_image_thumbnail(self, file_path: str, xref: int, max_size: int = 200) -> bytes:
+        """
+        Render a PNG thumbnail of a single image
+
+        Args:
+            file_path: Path to the PDF file
+            xref: Cross-reference number of the image
+            max_size: Maximum width or height of the thumbnail in pixels
+
+        Returns:
+            PNG-encoded thumbnail
+        """
+        try:
+            doc = self.open_document(file_path)
+            pix = fitz.Pixmap(doc, xref)
+
+            # Apply the soft mask, if any, and convert to RGB for PNG output
+            smask_type, smask_ref = doc.xref_get_key(xref, "SMask")
+            if smask_type == "xref":
+                pix = fitz.Pixmap(pix, fitz.Pixmap(doc, int(smask_ref.split()[0])))
+            if pix.n - pix.alpha >= 4:
+                pix = fitz.Pixmap(fitz.csRGB, pix)
+
+            scale = min(1.0, max_size / max(pix.width, pix.height))
+            if scale < 1.0:
+                pix = fitz.Pixmap(pix, max(1, int(pix.width * scale)), max(1, int(pix.height * scale)), None)
+
+            data = pix.tobytes("png")
+            doc.close()
+            return data
+
+        except Exception as e:
+            raise ValueError(f"Error rendering image thumbnail: {str(e)}")
+
+    @memory_tracked()
     def add_text(self, file_path: str, text: str, page_number: int, 
                  position: Tuple[float, float], font_size: int = 11, 
                  color: Tuple[float, float, float] = (0, 0, 0)) -> str:
@@ -167,7 +622,7 @@ class PDFService:
             output_path = self._create_output_path(file_path)
             
             # Open the document
-            doc = fitz.open(file_path)
+            doc = self.open_document(file_path)
             
             if 0 <= page_number < len(doc):
                 page = doc[page_number]
@@ -187,6 +642,7 @@ class PDFService:
         except Exception as e:
             raise ValueError(f"Error adding text: {str(e)}")
     
+    @memory_tracked()
     def add_image(self, file_path: str, image_path: str, page_number: int,
                  position: Tuple[float, float], width: Optional[float] = None,
                  height: Optional[float] = None) -> str:
@@ -209,7 +665,7 @@ class PDFService:
             output_path = self._create_output_path(file_path)
             
             # Open the document
-            doc = fitz.open(file_path)
+            doc = self.open_document(file_path)
             
             if 0 <= page_number < len(doc):
                 page = doc[page_number]
@@ -231,6 +687,192 @@ class PDFService:
         except Exception as e:
             raise ValueError(f"Error adding image: {str(e)}")
     
+    @memory_tracked()
+    def apply_annotations(self, file_path: str, elements: List[Dict], output_path: Optional[str] = None) -> str:
+        """
+        Flatten annotation layer elements into a copy of a document
+
+        Elements are drawn in order, all in one pass over the document.
+        Image elements with the same image data share one embedded image.
+
+        Args:
+            file_path: Path to the PDF file
+            elements: Elements as kept by AnnotationService: 'text' elements
+                      (text, page, position, font_size, color) and 'image'
+                      elements (image as base64, page, position, width, height)
+            output_path: Optional path for the flattened file
+
+        Returns:
+            Path to the flattened PDF file
+        """
+        try:
+            output_path = output_path or self._create_output_path(file_path)
+            doc = self.open_document(file_path)
+            try:
+                image_xrefs = {}
+                for element in elements:
+                    page_number = element['page']
+                    if not 0 <= page_number < len(doc):
+                        raise ValueError(f"Page number {page_number} out of range (0-{len(doc)-1})")
+                    page = doc[page_number]
+                    x, y = element['position']
+
+                    if element['type'] == 'text':
+                        page.insert_text(fitz.Point(x, y), element['text'], fontsize=element.get('font_size', 11),
+                                         color=tuple(element.get('color', (0, 0, 0))))
+                    else:
+                        rect = fitz.Rect(x, y, x + (element.get('width') or 100), y + (element.get('height') or 100))
+                        xref = image_xrefs.get(element['image'], 0)
+                        if xref:
+                            page.insert_image(rect, xref=xref)
+                        else:
+                            image_xrefs[element['image']] = page.insert_image(
+                                rect, stream=base64.b64decode(element['image']))
+
+                doc.save(output_path, garbage=1, deflate=True)
+            finally:
+                doc.close()
+            return output_path
+
+        except Exception as e:
+            raise ValueError(f"Error applying annotations: {str(e)}")
+
+    @memory_tracked()
+    def build_stamp(self, stamp: Dict) -> bytes:
+        """
+        Build a stamp as a one-page PDF
+        
+        The stamp is drawn (and its image embedded) once; apply_stamp then
+        shows this page on every target page as a shared form XObject.
+        
+        Args:
+            stamp: Either {'text', 'font_size', 'color'} or {'image'} (base64
+                   encoded image data), plus an optional 'opacity' (0-1)
+            
+        Returns:
+            The stamp PDF as bytes
+        """
+        opacity = float(stamp.get('opacity', 1))
+        if not 0 < opacity <= 1:
+            raise ValueError("opacity must be between 0 (exclusive) and 1")
+        
+        doc = fitz.open()
+        try:
+            if stamp.get('text'):
+                font_size = float(stamp.get('font_size', 48))
+                color = stamp.get('color', (0, 0, 0))
+                if (not isinstance(color, (list, tuple)) or len(color) != 3
+                        or not all(isinstance(c, (int, float)) and 0 <= c <= 1 for c in color)):
+                    raise ValueError("color must be three numbers between 0 and 1")
+                width = fitz.get_text_length(stamp['text'], fontname='helv', fontsize=font_size)
+                page = doc.new_page(width=width, height=font_size * 1.2)
+                page.insert_text(fitz.Point(0, font_size * 0.95), stamp['text'], fontname='helv',
+                                 fontsize=font_size, color=tuple(color),
+                                 fill_opacity=opacity)
+            elif stamp.get('image'):
+                try:
+                    pix = fitz.Pixmap(base64.b64decode(stamp['image'], validate=True))
+                except Exception as e:
+                    raise ValueError(f"Invalid stamp image: {str(e)}")
+                if opacity < 1:
+                    pix = self._with_opacity(pix, opacity)
+                page = doc.new_page(width=pix.width, height=pix.height)
+                page.insert_image(page.rect, pixmap=pix)
+            else:
+                raise ValueError("A stamp needs either text or an image")
+            
+            return doc.tobytes(garbage=3, deflate=True)
+        finally:
+            doc.close()
+    
+    @memory_tracked(heavy=True)
+    def apply_stamp(self, file_path: str, stamp_pdf: bytes, pages: List[int], placement: Dict,
+                    output_path: Optional[str] = None) -> str:
+        """
+        Place a stamp built by build_stamp on many pages
+        
+        The stamp page is embedded once and every target page refers to the
+        same XObject, so the output grows by one small wrapper per page no
+        matter how large the stamp image is.
+        
+        Args:
+            file_path: Path to the PDF file
+            stamp_pdf: Stamp built by build_stamp
+            pages: Page numbers to stamp (0-based)
+            placement: Optional 'position' ('center', 'top-left', 'top-center',
+                       'top-right', 'bottom-left', 'bottom-center', 'bottom-right'
+                       or [x, y]), 'width', 'height', 'margin', 'rotate' (degrees)
+                       and 'overlay' (False puts the stamp under the page content)
+            output_path: Optional path for the stamped file
+            
+        Returns:
+            Path to the stamped PDF file
+        """
+        stamp = doc = None
+        try:
+            stamp = fitz.open("pdf", stamp_pdf)
+            doc = self.open_document(file_path)
+            output_path = output_path or self._create_output_path(file_path)
+            
+            natural = stamp[0].rect
+            width = float(placement.get('width') or natural.width)
+            # Keep the stamp's aspect ratio unless both sides are given
+            height = float(placement.get('height') or natural.height * width / natural.width)
+            rotate = float(placement.get('rotate', 0))
+            # Size the target box to the rotated stamp, so rotation does not shrink it
+            angle = math.radians(rotate)
+            box_width = abs(width * math.cos(angle)) + abs(height * math.sin(angle))
+            box_height = abs(width * math.sin(angle)) + abs(height * math.cos(angle))
+            
+            for page_number in pages:
+                if not 0 <= page_number < len(doc):
+                    raise ValueError(f"Page number {page_number} out of range (0-{len(doc)-1})")
+                page = doc[page_number]
+                # Positions are in the page as displayed; show_pdf_page draws in unrotated page space
+                rect = self._stamp_rect(page.rect, box_width, box_height,
+                                        placement.get('position', 'center'), float(placement.get('margin', 36)))
+                page.show_pdf_page(rect * page.derotation_matrix, stamp, 0,
+                                   overlay=placement.get('overlay', True), rotate=rotate + page.rotation)
+            
+            doc.save(output_path, garbage=1, deflate=True)
+            return output_path
+            
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error applying stamp: {str(e)}")
+        finally:
+            for opened in (doc, stamp):
+                if opened is not None:
+                    opened.close()
+    
+    def _stamp_rect(self, page_rect, width: float, height: float, position, margin: float):
+        """Target rectangle for a stamp box of the given size"""
+        if isinstance(position, (list, tuple)):
+            x, y = float(position[0]), float(position[1])
+        elif position == 'center':
+            x, y = (page_rect.width - width) / 2, (page_rect.height - height) / 2
+        else:
+            vertical, _, horizontal = str(position).partition('-')
+            if vertical not in ('top', 'bottom') or horizontal not in ('left', 'center', 'right'):
+                raise ValueError(f"Invalid stamp position: {position}")
+            y = margin if vertical == 'top' else page_rect.height - height - margin
+            x = {'left': margin,
+                 'center': (page_rect.width - width) / 2,
+                 'right': page_rect.width - width - margin}[horizontal]
+        return fitz.Rect(x, y, x + width, y + height)
+    
+    def _with_opacity(self, pix, opacity: float):
+        """Copy of an image pixmap with its alpha channel scaled by opacity"""
+        if pix.colorspace and pix.colorspace.n == 4:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        if not pix.alpha:
+            pix = fitz.Pixmap(pix, 1)
+        alphas = pix.samples[pix.n - 1::pix.n]
+        pix.set_alpha(bytes(int(a * opacity) for a in alphas))
+        return pix
+    
+    @memory_tracked(heavy=True)
     def merge_pdfs(self, pdf_paths: List[str]) -> str:
         """
         Merge multiple PDF files into one
@@ -243,27 +885,334 @@ class PDFService:
         """
         try:
             # Create a new output document
-            output_path = os.path.join(self.upload_folder, f"{str(uuid.uuid4())}.pdf")
+            output_path = self.new_file_path(f"{str(uuid.uuid4())}.pdf")
             output_doc = fitz.open()
             
             # Append each document to the output
             for path in pdf_paths:
-                doc = fitz.open(path)
+                doc = self.open_document(path)
                 output_doc.insert_pdf(doc)
                 doc.close()
             
-            # Save the merged document
-            output_doc.save(output_path)
+            # Save the merged document, merging objects shared between the inputs
+            output_doc.save(output_path, garbage=4, deflate=True)
             output_doc.close()
             return output_path
             
         except Exception as e:
             raise ValueError(f"Error merging PDFs: {str(e)}")
     
+    @memory_tracked(heavy=True)
+    def assemble_pdf(self, parts: List[Dict]) -> str:
+        """
+        Assemble a new PDF from page ranges of one or more documents
+        
+        Args:
+            parts: List of dictionaries with 'file_path', 'pages' (list of
+                   0-based page numbers, in output order) and optional
+                   'rotate' (degrees added to each page's own rotation,
+                   multiple of 90; pages keep their rotation if None)
+            
+        Returns:
+            Path to the assembled PDF file
+        """
+        sources = {}
+        try:
+            output_path = self.new_file_path(f"{str(uuid.uuid4())}.pdf")
+            output_doc = fitz.open()
+            
+            for part in parts:
+                # Keep each source open for the whole assembly, so objects it
+                # shares between its pages are copied only once
+                source = sources.get(part['file_path'])
+                if source is None:
+                    source = sources[part['file_path']] = self.open_document(part['file_path'])
+                
+                rotate = part.get('rotate')
+                for first, last in group_page_runs(part['pages']):
+                    start = len(output_doc)
+                    output_doc.insert_pdf(source, from_page=first, to_page=last, final=False)
+                    if rotate:
+                        # insert_pdf would set the rotation absolutely; turn each page relative to its own
+                        for page_number in range(start, len(output_doc)):
+                            page = output_doc[page_number]
+                            page.set_rotation((page.rotation + rotate) % 360)
+            
+            # Merge duplicate objects (fonts, images) between the inputs and
+            # write straight to disk
+            output_doc.save(output_path, garbage=4, deflate=True)
+            output_doc.close()
+            return output_path
+            
+        except Exception as e:
+            raise ValueError(f"Error assembling PDF: {str(e)}")
+        finally:
+            for source in sources.values():
+                source.close()
+    
+    @memory_tracked()
+    def get_form_fields(self, file_path: str) -> Dict[str, List[Dict]]:
+        """
+        Index the form widgets of a document
+        
+        Args:
+            file_path: Path to the PDF file
+            
+        Returns:
+            Dictionary mapping each field name to its widgets, each described
+            by page, xref, type, current value and, for checkboxes and radio
+            buttons, the "on" state
+        """
+        try:
+            doc = self.open_document(file_path)
+            fields = {}
+            
+            for page_idx in range(len(doc)):
+                for widget in doc[page_idx].widgets():
+                    entry = {
+                        'page': page_idx,
+                        'xref': widget.xref,
+                        'type': widget.field_type_string,
+                        'value': widget.field_value
+                    }
+                    if widget.field_type in (fitz.PDF_WIDGET_TYPE_CHECKBOX, fitz.PDF_WIDGET_TYPE_RADIOBUTTON):
+                        entry['on_state'] = widget.on_state()
+                    if widget.choice_values:
+                        entry['choices'] = widget.choice_values
+                    fields.setdefault(widget.field_name, []).append(entry)
+            
+            doc.close()
+            return fields
+            
+        except Exception as e:
+            raise ValueError(f"Error reading form fields: {str(e)}")
+    
+    @memory_tracked()
+    def fill_form(self, file_path: str, values: Dict, fields: Dict[str, List[Dict]],
+                  output_path: Optional[str] = None) -> str:
+        """
+        Fill form fields
+        
+        Widgets are loaded directly by page and xref from the field index,
+        so pages without fields to fill are never visited.
+        
+        Args:
+            file_path: Path to the PDF file
+            values: Field name to value; checkboxes take booleans, radio
+                    buttons take the "on" state of the button to select
+            fields: Field index as returned by get_form_fields
+            output_path: Optional path for the filled file
+            
+        Returns:
+            Path to the filled PDF file
+        """
+        unknown = sorted(set(values) - set(fields))
+        if unknown:
+            raise ValueError(f"Unknown form fields: {', '.join(unknown)}")
+        
+        try:
+            output_path = output_path or self._create_output_path(file_path)
+            doc = self.open_document(file_path)
+            # Widgets are only valid while their page object is alive
+            pages = {}
+            
+            for name, value in values.items():
+                for entry in fields[name]:
+                    page = pages.get(entry['page'])
+                    if page is None:
+                        page = pages[entry['page']] = doc[entry['page']]
+                    widget = page.load_widget(entry['xref'])
+                    if entry['type'] == 'CheckBox':
+                        widget.field_value = entry['on_state'] if value else 'Off'
+                    elif entry['type'] == 'RadioButton':
+                        widget.field_value = entry['on_state'] if value == entry['on_state'] else 'Off'
+                    else:
+                        widget.field_value = str(value) if value is not None else ''
+                    widget.update()
+            
+            pages.clear()
+            doc.save(output_path, garbage=1, deflate=True)
+            doc.close()
+            return output_path
+            
+        except Exception as e:
+            raise ValueError(f"Error filling form: {str(e)}")
+    
+    @memory_tracked()
+    def select_pages(self, file_path: str, pages: List[int]) -> str:
+        """
+        Keep only the given pages, in the given order
+        
+        Pages are rearranged in the page tree; their content is copied by
+        reference, never re-rendered.
+        
+        Args:
+            file_path: Path to the PDF file
+            pages: Page numbers (0-based) in their new order; may repeat pages
+            
+        Returns:
+            Path to the modified PDF file
+        """
+        try:
+            output_path = self._create_output_path(file_path)
+            doc = self.open_document(file_path)
+            doc.select(pages)
+            self._save_compacted(doc, output_path)
+            return output_path
+            
+        except Exception as e:
+            raise ValueError(f"Error selecting pages: {str(e)}")
+    
+    @memory_tracked()
+    def move_page(self, file_path: str, page_number: int, to: int) -> str:
+        """
+        Move a page to a new position
+        
+        Args:
+            file_path: Path to the PDF file
+            page_number: Page to move (0-based index)
+            to: Position (0-based index) the page should have afterwards
+            
+        Returns:
+            Path to the modified PDF file
+        """
+        try:
+            output_path = self._create_output_path(file_path)
+            doc = self.open_document(file_path)
+            
+            page_count = len(doc)
+            for value in (page_number, to):
+                if not 0 <= value < page_count:
+                    doc.close()
+                    raise ValueError(f"Page number {value} out of range (0-{page_count-1})")
+            
+            # fitz moves a page in front of the target page (-1 appends)
+            if to > page_number:
+                doc.move_page(page_number, to + 1 if to + 1 < page_count else -1)
+            elif to < page_number:
+                doc.move_page(page_number, to)
+            
+            self._save_compacted(doc, output_path)
+            return output_path
+            
+        except Exception as e:
+            raise ValueError(f"Error moving page: {str(e)}")
+    
+    @memory_tracked()
+    def delete_pages(self, file_path: str, pages: List[int]) -> str:
+        """
+        Delete pages from a document
+        
+        Args:
+            file_path: Path to the PDF file
+            pages: Page numbers to delete (0-based index)
+            
+        Returns:
+            Path to the modified PDF file
+        """
+        try:
+            output_path = self._create_output_path(file_path)
+            doc = self.open_document(file_path)
+            
+            if len(set(pages)) >= len(doc):
+                doc.close()
+                raise ValueError("Cannot delete every page of a document")
+            
+            doc.delete_pages(sorted(set(pages)))
+            self._save_compacted(doc, output_path)
+            return output_path
+            
+        except Exception as e:
+            raise ValueError(f"Error deleting pages: {str(e)}")
+    
+    @memory_tracked(heavy=True)
+    def split_pdf(self, file_path: str, page_groups: List[List[int]]) -> List[str]:
+        """
+        Split a document into several files
+        
+        Args:
+            file_path: Path to the PDF file
+            page_groups: One list of page numbers (0-based) per output file
+            
+        Returns:
+            Paths to the new PDF files, in the order of page_groups
+        """
+        output_paths = []
+        try:
+            source = self.open_document(file_path)
+            try:
+                for pages in page_groups:
+                    output_path = self.new_file_path(f"{str(uuid.uuid4())}.pdf")
+                    part = fitz.open()
+                    for first, last in group_page_runs(pages):
+                        part.insert_pdf(source, from_page=first, to_page=last, final=False)
+                    self._save_compacted(part, output_path)
+                    output_paths.append(output_path)
+            finally:
+                source.close()
+            return output_paths
+            
+        except Exception as e:
+            for path in output_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise ValueError(f"Error splitting PDF: {str(e)}")
+    
+    @memory_tracked()
+    def extract_page_range(self, file_path: str, first_page: int, last_page: int) -> Tuple[bytes, int]:
+        """
+        Build a standalone PDF of a range of consecutive pages
+
+        Only the objects the copied pages use (content streams, fonts,
+        images) are written, so the result is small even when the source
+        document is large.
+
+        Args:
+            file_path: Path to the PDF file
+            first_page: First page of the range (0-based index)
+            last_page: Last page of the range (0-based index, inclusive)
+
+        Returns:
+            Tuple of (PDF bytes, page count of the source document)
+        """
+        try:
+            source = self.open_document(file_path)
+            try:
+                page_count = len(source)
+                for value in (first_page, last_page):
+                    if not 0 <= value < page_count:
+                        raise ValueError(f"Page number {value} out of range (0-{page_count-1})")
+                if last_page < first_page:
+                    raise ValueError("The last page of the range must not be before the first")
+
+                part = fitz.open()
+                try:
+                    part.insert_pdf(source, from_page=first_page, to_page=last_page)
+                    return part.tobytes(garbage=3, deflate=True), page_count
+                finally:
+                    part.close()
+            finally:
+                source.close()
+
+        except Exception as e:
+            raise ValueError(f"Error extracting page range: {str(e)}")
+
+    def _save_compacted(self, doc, output_path: str) -> None:
+        """Save a document straight to disk, dropping objects no page uses anymore, and close it"""
+        try:
+            doc.save(output_path, garbage=3, deflate=True)
+        finally:
+            doc.close()
+    
+    def new_file_path(self, filename: str) -> str:
+        """Local path for a new file, in its storage shard under the upload folder"""
+        file_path = os.path.join(self.upload_folder, *shard_key(filename).split('/'))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return file_path
+    
     def _create_output_path(self, input_path: str) -> str:
         """Create a new unique output path based on the input path"""
-        dirname = os.path.dirname(input_path)
         basename = os.path.basename(input_path)
         filename, ext = os.path.splitext(basename)
         new_filename = f"{filename}_{str(uuid.uuid4())[:8]}{ext}"
-        return os.path.join(dirname, new_filename)
+        return self.new_file_path(new_filename)
@@ -0,0 +1,78 @@
+import re
+from typing import Dict, Iterator, List, Optional
+
+from services.pdf.pdf_service import PDFService
+from services.pdf.text_layer import TextLayerService
+
+_HYPHENATION = re.compile(r'-\n')
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_text(text: str) -> str:
+    """Normalize text for matching: join hyphenated lines, collapse whitespace, ignore case"""
+    return _WHITESPACE.sub(' ', _HYPHENATION.sub('', text)).strip().casefold()
+
+class SearchService:
+    """Service for in-document text search backed by the cached page text index"""
+
+    def __init__(self, pdf_service: PDFService, text_layer: TextLayerService):
+        """Initialize with the PDF service used for hit geometry and the text layer cache"""
+        self.pdf_service = pdf_service
+        self.text_layer = text_layer
+
+    def candidate_pages(self, file_path: str, query: str) -> List[int]:
+        """
+        Find the pages whose text can contain the query
+
+        Pages are filtered against the cached page text index, so only
+        these pages need to be searched for hit geometry.
+
+        Args:
+            file_path: Path to the PDF file
+            query: Text to search for
+
+        Returns:
+            List of candidate page numbers (0-based index)
+        """
+        needle = normalize_text(query)
+        return [
+            page_idx
+            for page_idx, page_text in enumerate(self.text_layer.get_page_texts(file_path))
+            if needle in normalize_text(page_text)
+        ]
+
+    def search(self, file_path: str, query: str, max_hits: Optional[int] = None) -> Iterator[Dict]:
+        """
+        Search a document, yielding results page by page
+
+        Args:
+            file_path: Path to the PDF file
+            query: Text to search for (case-insensitive)
+            max_hits: Optional maximum number of hits to report
+
+        Yields:
+            One dictionary per page with hits, followed by a summary record
+            (limit_reached is set only when hits beyond max_hits were left out)
+        """
+        candidates = self.candidate_pages(file_path, query)
+        total_hits = 0
+        limit_reached = False
+
+        for page_idx, quads in self.pdf_service.search_text(file_path, query, candidates):
+            if max_hits is not None and total_hits == max_hits:
+                # Looked one page of hits ahead: there are more than max_hits
+                limit_reached = True
+                break
+            if max_hits is not None and total_hits + len(quads) > max_hits:
+                quads = quads[:max_hits - total_hits]
+                limit_reached = True
+            total_hits += len(quads)
+            yield {'page': page_idx, 'quads': quads}
+            if limit_reached:
+                break
+
+        yield {
+            'done': True,
+            'candidate_pages': len(candidates),
+            'total_hits': total_hits,
+            'limit_reached': limit_reached
+        }
@@ -0,0 +1,69 @@
+import os
+from typing import Dict, List
+
+from services.jobs.process_pool import get_process_pool
+from services.pdf.pdf_service import PDFService
+from services.pdf.page_ranges import PageSelection, parse_page_selection
+
+def _stamp_file(upload_folder: str, file_path: str, stamp_pdf: bytes,
+                selection: PageSelection, placement: Dict) -> str:
+    """Stamp the selected pages of one file (runs in a pool process)"""
+    pdf_service = PDFService(upload_folder)
+    page_count = pdf_service.get_document_info(file_path)['page_count']
+    return pdf_service.apply_stamp(file_path, stamp_pdf, parse_page_selection(selection, page_count), placement)
+
+class StampService:
+    """Service for stamping and watermarking pages of one or many documents"""
+
+    def __init__(self, pdf_service: PDFService):
+        """Initialize with the PDF service used for stamping"""
+        self.pdf_service = pdf_service
+
+    def stamp(self, file_path: str, stamp: Dict, selection: PageSelection = None) -> str:
+        """
+        Stamp the selected pages of a document
+
+        Args:
+            file_path: Path to the PDF file
+            stamp: Stamp content (see PDFService.build_stamp) and placement
+                   (see PDFService.apply_stamp) in one dictionary
+            selection: Pages to stamp, as accepted by parse_page_selection
+
+        Returns:
+            Path to the stamped PDF file
+        """
+        return _stamp_file(self.pdf_service.upload_folder, file_path,
+                           self.pdf_service.build_stamp(stamp), selection, stamp)
+
+    def stamp_many(self, file_paths: List[str], stamp: Dict, selection: PageSelection = None) -> List[str]:
+        """
+        Stamp many documents in parallel
+
+        The stamp is built once and shipped to the pool processes as a small
+        PDF, so an image is decoded and compressed only once per batch.
+
+        Args:
+            file_paths: Paths to the PDF files
+            stamp: Stamp content and placement, as for stamp()
+            selection: Pages to stamp in every document
+
+        Returns:
+            Paths to the stamped PDF files, in input order
+        """
+        stamp_pdf = self.pdf_service.build_stamp(stamp)
+        pool = get_process_pool()
+        futures = [pool.submit(_stamp_file, self.pdf_service.upload_folder, file_path, stamp_pdf, selection, stamp)
+                   for file_path in file_paths]
+
+        output_paths = []
+        try:
+            for future in futures:
+                output_paths.append(future.result())
+        except Exception:
+            for future in futures:
+                future.cancel()
+            for path in output_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        return output_paths
@@ -0,0 +1,198 @@
+import sys
+import struct
+from array import array
+from typing import Dict, List, Sequence, Tuple
+
+from services.cache.artifact_cache import ArtifactCache
+from services.pdf.pdf_service import PDFService
+
+# Binary word layer layout (all values little-endian):
+#   header   magic "WPW1", uint32 word count, float32 page width, float32 page height
+#   bboxes   float32[count * 4]   x0, y0, x1, y1 per word
+#   numbers  uint32[count * 3]    block, line and word number per word
+#   offsets  uint32[count + 1]    byte offsets of each word in the string table
+#   strings  UTF-8 bytes of all words, concatenated
+WORDS_MAGIC = b'WPW1'
+WORDS_HEADER = struct.Struct('<4sIff')
+WORDS_MIMETYPE = 'application/vnd.webpdf.words'
+
+# Page text index layout (all values little-endian):
+#   header   magic "WPT1", uint32 page count
+#   offsets  uint32[count + 1]    byte offsets of each page in the string table
+#   strings  UTF-8 text of all pages, concatenated
+PAGES_MAGIC = b'WPT1'
+PAGES_HEADER = struct.Struct('<4sI')
+
+def _to_le_bytes(values: array) -> bytes:
+    """Serialize an array in little-endian byte order"""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_le_bytes(typecode: str, data: bytes) -> array:
+    """Deserialize a little-endian array"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def encode_string_table(strings: Sequence[str]) -> Tuple[array, bytes]:
+    """
+    Pack strings into an offsets array and a single UTF-8 blob
+
+    Returns:
+        Tuple of (uint32 offsets with len(strings) + 1 entries, blob)
+    """
+    offsets = array('I', [0])
+    chunks = []
+    position = 0
+    for value in strings:
+        encoded = value.encode('utf-8')
+        chunks.append(encoded)
+        position += len(encoded)
+        offsets.append(position)
+    return offsets, b''.join(chunks)
+
+def decode_string_table(offsets: Sequence[int], blob: bytes) -> List[str]:
+    """Unpack strings packed by encode_string_table"""
+    return [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+def encode_words(page_words: Dict) -> bytes:
+    """
+    Encode the words of a page into the binary word layer format
+
+    Args:
+        page_words: Dictionary as returned by PDFService.extract_words
+
+    Returns:
+        Encoded word layer
+    """
+    words = page_words['words']
+    bboxes = array('f')
+    numbers = array('I')
+    for x0, y0, x1, y1, _text, block_no, line_no, word_no in words:
+        bboxes.extend((x0, y0, x1, y1))
+        numbers.extend((block_no, line_no, word_no))
+    offsets, blob = encode_string_table([w[4] for w in words])
+
+    return b''.join([
+        WORDS_HEADER.pack(WORDS_MAGIC, len(words), page_words['width'], page_words['height']),
+        _to_le_bytes(bboxes),
+        _to_le_bytes(numbers),
+        _to_le_bytes(offsets),
+        blob,
+    ])
+
+def decode_words(data: bytes) -> Dict:
+    """
+    Decode a binary word layer
+
+    Returns:
+        Dictionary with page size and a list of word dictionaries
+    """
+    magic, count, width, height = WORDS_HEADER.unpack_from(data)
+    if magic != WORDS_MAGIC:
+        raise ValueError("Not a word layer")
+
+    position = WORDS_HEADER.size
+    sections = []
+    for typecode, length in (('f', count * 4), ('I', count * 3), ('I', count + 1)):
+        size = length * array(typecode).itemsize
+        sections.append(_from_le_bytes(typecode, data[position:position + size]))
+        position += size
+    bboxes, numbers, offsets = sections
+    texts = decode_string_table(offsets, data[position:])
+
+    return {
+        'width': width,
+        'height': height,
+        'words': [
+            {
+                'text': texts[i],
+                'bbox': list(bboxes[i * 4:i * 4 + 4]),
+                'block': numbers[i * 3],
+                'line': numbers[i * 3 + 1],
+                'word': numbers[i * 3 + 2],
+            }
+            for i in range(count)
+        ]
+    }
+
+def encode_page_texts(page_texts: Sequence[str]) -> bytes:
+    """Encode the text of every page of a document into a page text index"""
+    offsets, blob = encode_string_table(page_texts)
+    return PAGES_HEADER.pack(PAGES_MAGIC, len(page_texts)) + _to_le_bytes(offsets) + blob
+
+def decode_page_texts(data: bytes) -> List[str]:
+    """Decode a page text index into a list of page texts"""
+    magic, count = PAGES_HEADER.unpack_from(data)
+    if magic != PAGES_MAGIC:
+        raise ValueError("Not a page text index")
+
+    position = PAGES_HEADER.size
+    size = (count + 1) * array('I').itemsize
+    offsets = _from_le_bytes('I', data[position:position + size])
+    return decode_string_table(offsets, data[position + size:])
+
+class TextLayerService:
+    """Service for building and caching per-version text layers"""
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache):
+        """Initialize with the PDF service used for extraction and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+
+    def get_words_path(self, file_path: str, page_number: int) -> str:
+        """
+        Get the cached word layer of a page, building it on first use
+
+        Args:
+            file_path: Path to the PDF file
+            page_number: Page number (0-based index)
+
+        Returns:
+            Path to the encoded word layer
+        """
+        name = f"words/{page_number}.bin"
+        if not self.cache.exists(file_path, name):
+            page_words = self.pdf_service.extract_words(file_path, page_number)
+            self.cache.write_bytes(file_path, name, encode_words(page_words))
+        return self.cache.path_for(file_path, name)
+
+    def warm_words(self, file_path: str) -> int:
+        """
+        Build the word layers of all pages that are not cached yet
+
+        Args:
+            file_path: Path to the PDF file
+
+        Returns:
+            Number of pages whose word layer was built
+        """
+        built = 0
+        for page_number, page_words in self.pdf_service.iter_words(file_path):
+            name = f"words/{page_number}.bin"
+            if not self.cache.exists(file_path, name):
+                self.cache.write_bytes(file_path, name, encode_words(page_words))
+                built += 1
+        return built
+
+    def get_page_texts(self, file_path: str) -> List[str]:
+        """
+        Get the plain text of every page, building the page text index on first use
+
+        Args:
+            file_path: Path to the PDF file
+
+        Returns:
+            List of page texts, indexed by page number (0-based)
+        """
+        name = "text/pages.bin"
+        data = self.cache.read_bytes(file_path, name)
+        if data is None:
+            text_data = self.pdf_service.extract_text(file_path)
+            data = encode_page_texts([text_data[i] for i in range(len(text_data))])
+            self.cache.write_bytes(file_path, name, data)
+        return decode_page_texts(data)
@@ -0,0 +1,43 @@
+from services.cache.artifact_cache import ArtifactCache
+from services.pdf.pdf_service import PDFService
+
+class ThumbnailService:
+    """Service for rendering and caching page thumbnails per version"""
+
+    def __init__(self, pdf_service: PDFService, cache: ArtifactCache):
+        """Initialize with the PDF service used for rendering and the artifact cache"""
+        self.pdf_service = pdf_service
+        self.cache = cache
+
+    def get_thumbnail_path(self, file_path: str, page_number: int, max_size: int) -> str:
+        """
+        Get a PNG thumbnail of a page, rendering it on first use
+
+        Args:
+            file_path: Path to the PDF file
+            page_number: Page number (0-based index)
+            max_size: Maximum width or height of the thumbnail in pixels
+
+        Returns:
+            Path to the cached thumbnail
+        """
+        name = f"thumbnails/{page_number}_{max_size}.png"
+        if not self.cache.exists(file_path, name):
+            for _, png in self.pdf_service.render_page_thumbnails(file_path, max_size, [page_number]):
+                self.cache.write_bytes(file_path, name, png)
+        return self.cache.path_for(file_path, name)
+
+    def warm(self, file_path: str, max_size: int, page_count: int) -> int:
+        """
+        Render the thumbnails of all pages that are not cached yet, in one pass
+
+        Returns:
+            Number of thumbnails rendered
+        """
+        missing = [page for page in range(page_count)
+                   if not self.cache.exists(file_path, f"thumbnails/{page}_{max_size}.png")]
+        if not missing:
+            return 0
+        for page_number, png in self.pdf_service.render_page_thumbnails(file_path, max_size, missing):
+            self.cache.write_bytes(file_path, f"thumbnails/{page_number}_{max_size}.png", png)
+        return len(missing)
@@ -0,0 +1,113 @@
+import os
+import re
+import hashlib
+from abc import ABC, abstractmethod
+from flask import current_app
+from typing import BinaryIO, ContextManager
+
+# Shape of the keys shard_key produces ("3f/a2/<name>")
+KEY_PATTERN = re.compile(r'[0-9a-f]{2}/[0-9a-f]{2}/[^/\\]+')
+
+def shard_key(filename: str, levels: int = 2) -> str:
+    """
+    Build the storage key for a file name
+
+    Files are spread over fan-out directories named after the leading hex
+    digits of a hash of the name ("3f/a2/<name>"), so no single directory
+    grows past a few thousand entries. The hash makes the placement
+    deterministic, which lets the migration recompute keys for existing files.
+
+    Args:
+        filename: Base name of the file
+        levels: Number of fan-out directory levels (256 entries each)
+
+    Returns:
+        Relative key with forward slashes
+    """
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return '/'.join([digest[i * 2:i * 2 + 2] for i in range(levels)] + [filename])
+
+class StorageBackend(ABC):
+    """
+    Interface for document file storage
+
+    The database stores relative keys produced by shard_key. PyMuPDF needs
+    real files, so every backend keeps a local working copy under root:
+    new files are written there first and handed to store(), and
+    local_path() returns (and, for remote backends, fetches) the local copy
+    of a key. Rows written before keys were introduced hold file paths,
+    absolute or relative to the working directory (e.g. instance/uploads/<name>.pdf);
+    every method accepts those too, and `flask migrate-storage` turns them into keys.
+    """
+
+    def __init__(self, root: str):
+        """Initialize with the local working directory (the upload folder)"""
+        self.root = root
+
+    def is_key(self, value: str) -> bool:
+        """Whether a stored value is a storage key rather than a legacy file path"""
+        return KEY_PATTERN.fullmatch(value) is not None
+
+    def key_for(self, file_path: str) -> str:
+        """Key under which a local file is stored"""
+        return shard_key(os.path.basename(file_path))
+
+    def working_path(self, key: str) -> str:
+        """Local path of the working copy of a key (which may not exist yet), or of a legacy file path"""
+        if not self.is_key(key):
+            return self.legacy_path(key)
+        return os.path.join(self.root, *key.split('/'))
+
+    def legacy_path(self, value: str) -> str:
+        """
+        Resolve a legacy file path
+
+        Relative paths were relative to the server's working directory; if
+        the file is not found there, it is looked up by name in root.
+        """
+        path = os.path.abspath(value)
+        if not os.path.exists(path):
+            in_root = os.path.join(self.root, os.path.basename(value.replace('\\', '/')))
+            if os.path.exists(in_root):
+                return in_root
+        return path
+
+    @abstractmethod
+    def store(self, file_path: str) -> str:
+        """
+        Persist a local file and return its key
+
+        Args:
+            file_path: Path of a finished file, usually under root
+
+        Returns:
+            The key to record in the database
+        """
+
+    @abstractmethod
+    def local_path(self, key: str) -> str:
+        """Path of a local copy of the stored file, suitable for opening with PyMuPDF"""
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open a stored file for streaming reads"""
+
+    @abstractmethod
+    def open_write(self, key: str) -> ContextManager[BinaryIO]:
+        """Open a key for streaming writes; the file is only published once the block completes"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether a key is stored"""
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """Size of a stored file in bytes"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete a stored file and its working copy; missing files are ignored"""
+
+def get_storage() -> StorageBackend:
+    """Get the storage backend of the current app"""
+    return current_app.extensions['storage']
@@ -0,0 +1,161 @@
+import os
+import lzma
+import shutil
+import hashlib
+import tempfile
+from typing import List, Optional, Tuple
+
+from services.lazy import lazy_import
+
+# Suffix of the compressed (cold) form of a file, per codec
+COLD_SUFFIXES = {'zstd': '.zst', 'xz': '.xz'}
+
+DICTIONARY_FOLDER = '.dictionaries'
+
+def _zstandard():
+    """The zstandard module (optional dependency, needed for the zstd codec)"""
+    return lazy_import('zstandard')
+
+def cold_variant(path: str) -> Optional[str]:
+    """Path of the compressed form of a file, if the file is cold"""
+    for suffix in COLD_SUFFIXES.values():
+        if os.path.exists(path + suffix):
+            return path + suffix
+    return None
+
+def dictionary_path(dictionary_folder: str, dict_id: int) -> str:
+    """Path of a stored zstd dictionary"""
+    return os.path.join(dictionary_folder, f"{dict_id}.zdict")
+
+def train_dictionary(paths: List[str], size: int, sample_size: int = 16 * 1024) -> Optional[Tuple[int, bytes]]:
+    """
+    Train a zstd dictionary on the files of a document family
+
+    The files are cut into samples, so the versions of one document (which
+    share most of their objects) teach the dictionary their common content.
+    At most 100 times the dictionary size is sampled (zstd's recommended
+    training set), spread evenly over each file.
+
+    Args:
+        paths: Files of the family
+        size: Dictionary size in bytes
+        sample_size: Bytes per training sample
+
+    Returns:
+        Tuple of (dictionary ID, dictionary bytes), or None if there is too little data to train on
+    """
+    zstandard = _zstandard()
+    budget = max(1, size * 100 // max(1, len(paths)) // sample_size)
+    samples = []
+    for path in paths:
+        file_size = os.path.getsize(path)
+        count = min(budget, max(1, file_size // sample_size))
+        stride = file_size // count
+        with open(path, 'rb') as f:
+            for index in range(count):
+                f.seek(index * stride)
+                sample = f.read(sample_size)
+                if sample:
+                    samples.append(sample)
+    try:
+        dictionary = zstandard.train_dictionary(size, samples)
+    except zstandard.ZstdError:
+        return None
+    return dictionary.dict_id(), dictionary.as_bytes()
+
+def compress_file(path: str, codec: str, level: Optional[int] = None,
+                  dictionary: Optional[bytes] = None) -> str:
+    """
+    Write the compressed form of a file next to it (the original is kept)
+
+    Args:
+        path: File to compress
+        codec: 'zstd' or 'xz'
+        level: Compression level (zstd 1-22, xz preset 0-9; default 19 and 6)
+        dictionary: Optional zstd dictionary
+
+    Returns:
+        Path of the compressed file
+    """
+    target = path + COLD_SUFFIXES[codec]
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output, open(path, 'rb') as source:
+            if codec == 'zstd':
+                zstandard = _zstandard()
+                compressor = zstandard.ZstdCompressor(
+                    level=level or 19, write_checksum=True,
+                    dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+                compressor.copy_stream(source, output, size=os.path.getsize(path))
+            else:
+                with lzma.LZMAFile(output, 'wb', preset=6 if level is None else level) as compressed:
+                    shutil.copyfileobj(source, compressed, 1024 * 1024)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return target
+
+def _open_decompressed(cold_path: str, dictionary_folder: str):
+    """Open a reader of the original content of a compressed file"""
+    if cold_path.endswith(COLD_SUFFIXES['xz']):
+        return lzma.open(cold_path, 'rb')
+
+    zstandard = _zstandard()
+    source = open(cold_path, 'rb')
+    try:
+        dict_id = zstandard.get_frame_parameters(source.read(18)).dict_id
+        source.seek(0)
+        dictionary = None
+        if dict_id:
+            with open(dictionary_path(dictionary_folder, dict_id), 'rb') as f:
+                dictionary = zstandard.ZstdCompressionDict(f.read())
+        return zstandard.ZstdDecompressor(dict_data=dictionary).stream_reader(source, closefd=True)
+    except BaseException:
+        source.close()
+        raise
+
+def file_digest(path: str, cold_path: Optional[str] = None, dictionary_folder: str = '') -> str:
+    """SHA-256 of a file's content, read from its compressed form if cold_path is given"""
+    digest = hashlib.sha256()
+    with (_open_decompressed(cold_path, dictionary_folder) if cold_path else open(path, 'rb')) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def promote(path: str, dictionary_folder: str) -> bool:
+    """
+    Restore the original of a cold file in place and remove its compressed form
+
+    Concurrent promotions of the same file are safe: each writes its own
+    temporary file and the last rename wins with identical content.
+
+    Returns:
+        Whether the file was cold
+    """
+    cold_path = cold_variant(path)
+    if cold_path is None:
+        return False
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output, _open_decompressed(cold_path, dictionary_folder) as source:
+            shutil.copyfileobj(source, output, 1024 * 1024)
+        os.replace(temp_path, path)
+    except FileNotFoundError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        # Another reader promoted the file first and removed the compressed form
+        if os.path.exists(path):
+            return True
+        raise
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    try:
+        os.remove(cold_path)
+    except FileNotFoundError:
+        pass
+    return True
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from services.storage.base import StorageBackend
+from services.storage.compression import DICTIONARY_FOLDER, cold_variant, promote
+
+class ShardedLocalStorage(StorageBackend):
+    """
+    Storage on the local filesystem, in hashed fan-out directories under the upload folder
+
+    Files may be cold: compressed in place (see services/storage/tiering.py)
+    as <file>.zst or <file>.xz. Reads restore the original transparently,
+    which also promotes the file back to hot. Stored files are never
+    modified, so reads are recorded in their modification time, which
+    tiering uses to find files nobody has read for a while.
+    """
+
+    @property
+    def dictionary_folder(self) -> str:
+        """Folder of the zstd dictionaries cold files were compressed with"""
+        return os.path.join(self.root, DICTIONARY_FOLDER)
+
+    def store(self, file_path: str) -> str:
+        """Move a file into its shard (if it is not there already) and return its key"""
+        key = self.key_for(file_path)
+        target = self.working_path(key)
+        if os.path.abspath(target) != os.path.abspath(file_path):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(file_path, target)
+        return key
+
+    def local_path(self, key: str) -> str:
+        """Path of the file, decompressing it first if it is cold, and record the read"""
+        path = self.working_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Cold, or being compressed right now: either way the compressed form exists
+            promote(path, self.dictionary_folder)
+        except PermissionError:
+            # Legacy file the app may read but not touch; tiering ignores those
+            pass
+        return path
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            return open(self.local_path(key), 'rb')
+        except FileNotFoundError:
+            # Compressed between local_path and open
+            return open(self.local_path(key), 'rb')
+
+    @contextmanager
+    def open_write(self, key: str) -> Iterator[BinaryIO]:
+        target = self.working_path(key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def exists(self, key: str) -> bool:
+        path = self.working_path(key)
+        return os.path.exists(path) or cold_variant(path) is not None
+
+    def size(self, key: str) -> int:
+        """Bytes the file takes on disk (compressed size for cold files)"""
+        path = self.working_path(key)
+        if not os.path.exists(path):
+            path = cold_variant(path) or path
+        return os.path.getsize(path)
+
+    def delete(self, key: str) -> None:
+        path = self.working_path(key)
+        for variant in (path, cold_variant(path)):
+            if variant and os.path.exists(variant):
+                os.remove(variant)
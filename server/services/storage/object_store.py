@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from services.storage.base import StorageBackend
+
+class ObjectNotFound(Exception):
+    """Raised by DirectoryObjectClient for missing objects, shaped like botocore's ClientError"""
+
+    def __init__(self, key: str):
+        super().__init__(f"Object not found: {key}")
+        self.response = {'Error': {'Code': 'NoSuchKey', 'Message': str(self)}}
+
+def _is_missing(error: Exception) -> bool:
+    """Whether a client error means the object does not exist"""
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+class DirectoryObjectClient:
+    """
+    Local stand-in for an S3 client, storing objects as files under a directory
+
+    Implements the subset of the boto3 S3 client API used by ObjectStorage,
+    so the object-store code path can be run and tested without a bucket.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str) -> None:
+        with open(Filename, 'rb') as f:
+            self.upload_fileobj(f, Bucket, Key)
+
+    def upload_fileobj(self, Fileobj: BinaryIO, Bucket: str, Key: str) -> None:
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(Fileobj, f)
+        os.replace(temp_path, path)
+
+    def download_file(self, Bucket: str, Key: str, Filename: str) -> None:
+        with self.get_object(Bucket=Bucket, Key=Key)['Body'] as source, open(Filename, 'wb') as f:
+            shutil.copyfileobj(source, f)
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        head = self.head_object(Bucket=Bucket, Key=Key)
+        return {'Body': open(self._path(Bucket, Key), 'rb'), 'ContentLength': head['ContentLength']}
+
+    def head_object(self, Bucket: str, Key: str) -> dict:
+        path = self._path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ObjectNotFound(Key)
+        return {'ContentLength': os.path.getsize(path)}
+
+    def delete_object(self, Bucket: str, Key: str) -> None:
+        path = self._path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+
+class ObjectStorage(StorageBackend):
+    """
+    Storage in an S3-compatible object store
+
+    The upload folder holds working copies: files are uploaded when stored
+    and fetched on first local use, so repeated edits of a document only
+    download it once per server. Working copies can be deleted at any time.
+    """
+
+    def __init__(self, root: str, client, bucket: str):
+        """
+        Args:
+            root: Local working directory (the upload folder)
+            client: boto3 S3 client, or a DirectoryObjectClient
+            bucket: Bucket name
+        """
+        super().__init__(root)
+        self.client = client
+        self.bucket = bucket
+
+    def store(self, file_path: str) -> str:
+        """Upload a file and keep it as the working copy of its key"""
+        key = self.key_for(file_path)
+        working_path = self.working_path(key)
+        if os.path.abspath(working_path) != os.path.abspath(file_path):
+            os.makedirs(os.path.dirname(working_path), exist_ok=True)
+            shutil.move(file_path, working_path)
+        self.client.upload_file(Filename=working_path, Bucket=self.bucket, Key=key)
+        return key
+
+    def local_path(self, key: str) -> str:
+        """Path of the working copy, downloading the object if there is none"""
+        working_path = self.working_path(key)
+        if os.path.exists(working_path):
+            return working_path
+
+        os.makedirs(os.path.dirname(working_path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(working_path), suffix='.tmp')
+        os.close(fd)
+        try:
+            self.client.download_file(Bucket=self.bucket, Key=key, Filename=temp_path)
+            os.replace(temp_path, working_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return working_path
+
+    def open(self, key: str) -> BinaryIO:
+        if not self.is_key(key):
+            return open(self.working_path(key), 'rb')
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    @contextmanager
+    def open_write(self, key: str) -> Iterator[BinaryIO]:
+        # Spool small files in memory; the object only appears once fully uploaded
+        with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as f:
+            yield f
+            f.seek(0)
+            self.client.upload_fileobj(Fileobj=f, Bucket=self.bucket, Key=key)
+
+    def exists(self, key: str) -> bool:
+        if not self.is_key(key):
+            return os.path.exists(self.working_path(key))
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def size(self, key: str) -> int:
+        if not self.is_key(key):
+            return os.path.getsize(self.working_path(key))
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def delete(self, key: str) -> None:
+        if self.is_key(key):
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+        working_path = self.working_path(key)
+        if os.path.exists(working_path):
+            os.remove(working_path)
@@ -0,0 +1,122 @@
+import time
+from typing import Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import delete, select, update
+
+from models.db import (db, Document, DocumentVersion, DocumentTombstone, Job, AnnotationOperation,
+                       AnnotationSnapshot)
+from services.ai.corpus_index import CorpusIndex, get_corpus_index
+from services.cache.artifact_cache import ArtifactCache
+from services.storage.base import StorageBackend, get_storage
+
+class DocumentReaper:
+    """
+    Service for removing the rows and files of deleted (tombstoned) documents
+
+    Documents are processed in batches: the files of a batch are deleted
+    with retries, then the rows of every document whose files are all gone
+    are removed with a few set-based statements and one commit. Documents
+    with files that could not be deleted keep their tombstone, with the
+    error recorded, for the next run.
+    """
+
+    def __init__(self, storage: StorageBackend, cache: ArtifactCache, batch_size: int = 100,
+                 max_attempts: int = 3, retry_delay: float = 0.5, corpus_index: Optional[CorpusIndex] = None):
+        """
+        Args:
+            storage: Storage backend holding the files
+            cache: Artifact cache whose entries of the deleted versions are dropped
+            batch_size: Documents per batch (and per commit)
+            max_attempts: Tries per file before the document is left for a later run
+            retry_delay: Delay before the first retry, doubled per retry (seconds)
+            corpus_index: Corpus index the removed documents are dropped from
+        """
+        self.storage = storage
+        self.cache = cache
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.corpus_index = corpus_index
+
+    def reap(self, document_ids: Optional[List[int]] = None) -> Dict:
+        """
+        Remove tombstoned documents
+
+        Args:
+            document_ids: Documents to remove (default: every tombstoned document)
+
+        Returns:
+            Dictionary with the number of documents and files removed, the
+            bytes reclaimed, the number of batches, and the documents that failed
+        """
+        query = select(DocumentTombstone.document_id).order_by(DocumentTombstone.deleted_at)
+        if document_ids is not None:
+            query = query.where(DocumentTombstone.document_id.in_(document_ids))
+        pending = [row[0] for row in db.session.execute(query)]
+
+        result = {'documents': 0, 'files_deleted': 0, 'bytes_reclaimed': 0, 'batches': 0, 'failed': []}
+        for start in range(0, len(pending), self.batch_size):
+            self._reap_batch(pending[start:start + self.batch_size], result)
+            result['batches'] += 1
+        return result
+
+    def _reap_batch(self, document_ids: List[int], result: Dict) -> None:
+        # The original file of a document is also the file of its first version
+        keys = {document_id: set() for document_id in document_ids}
+        rows = db.session.execute(select(Document.id, Document.file_path)
+                                  .where(Document.id.in_(document_ids))
+                                  .execution_options(include_deleted=True))
+        for document_id, key in rows:
+            keys[document_id].add(key)
+        rows = db.session.execute(select(DocumentVersion.document_id, DocumentVersion.file_path)
+                                  .where(DocumentVersion.document_id.in_(document_ids)))
+        for document_id, key in rows:
+            keys[document_id].add(key)
+
+        reaped = []
+        for document_id, document_keys in keys.items():
+            try:
+                for key in document_keys:
+                    result['bytes_reclaimed'] += self._delete_file(key)
+                    result['files_deleted'] += 1
+                reaped.append(document_id)
+            except Exception as e:
+                current_app.logger.error(f"Could not remove the files of deleted document {document_id}: {e}")
+                result['failed'].append({'document_id': document_id, 'error': str(e)})
+                db.session.execute(update(DocumentTombstone)
+                                   .where(DocumentTombstone.document_id == document_id)
+                                   .values(attempts=DocumentTombstone.attempts + 1, last_error=str(e)))
+
+        if reaped:
+            db.session.execute(update(Job).where(Job.document_id.in_(reaped)).values(document_id=None))
+            db.session.execute(delete(AnnotationOperation).where(AnnotationOperation.document_id.in_(reaped)))
+            db.session.execute(delete(AnnotationSnapshot).where(AnnotationSnapshot.document_id.in_(reaped)))
+            db.session.execute(delete(DocumentVersion).where(DocumentVersion.document_id.in_(reaped)))
+            db.session.execute(delete(DocumentTombstone).where(DocumentTombstone.document_id.in_(reaped)))
+            db.session.execute(delete(Document).where(Document.id.in_(reaped)))
+        db.session.commit()
+        if reaped and self.corpus_index is not None:
+            # Searches already skip tombstoned documents, so the index may lag behind the commit
+            self.corpus_index.remove_documents(reaped)
+        result['documents'] += len(reaped)
+
+    def _delete_file(self, key: str) -> int:
+        """Delete a file and its cached artifacts with retries, returning the bytes reclaimed"""
+        for attempt in range(self.max_attempts):
+            try:
+                size = self.storage.size(key) if self.storage.exists(key) else 0
+                self.storage.delete(key)
+                self.cache.invalidate(key)
+                return size
+            except Exception:
+                if attempt == self.max_attempts - 1:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+def reap_documents(document_ids: Optional[List[int]] = None) -> Dict:
+    """Remove tombstoned documents with the app's storage and settings (job entry point)"""
+    reaper = DocumentReaper(get_storage(), ArtifactCache(current_app.config['CACHE_FOLDER']),
+                            current_app.config['REAPER_BATCH_SIZE'], current_app.config['REAPER_MAX_ATTEMPTS'],
+                            corpus_index=get_corpus_index())
+    return reaper.reap(document_ids)
@@ -0,0 +1,104 @@
+import os
+import click
+from flask.cli import with_appcontext
+
+from models.db import db, Document, DocumentVersion
+from services.lazy import lazy_import
+from services.storage.base import StorageBackend, get_storage
+from services.storage.local import ShardedLocalStorage
+from services.storage.object_store import ObjectStorage, DirectoryObjectClient
+from services.storage.reaper import reap_documents
+from services.storage.tiering import compress_cold_versions, storage_tiers
+
+def create_storage(config) -> StorageBackend:
+    """
+    Create the storage backend selected by STORAGE_BACKEND
+
+    "local" stores files in fan-out directories under UPLOAD_FOLDER, "s3"
+    stores them in STORAGE_BUCKET (STORAGE_ENDPOINT_URL selects an
+    S3-compatible service such as MinIO), and "directory" runs the object
+    store code path against plain files under STORAGE_DIRECTORY.
+    """
+    backend = config.get('STORAGE_BACKEND', 'local')
+    root = config['UPLOAD_FOLDER']
+
+    if backend == 'local':
+        return ShardedLocalStorage(root)
+    if backend == 's3':
+        boto3 = lazy_import('boto3')
+        client = boto3.client('s3', endpoint_url=config.get('STORAGE_ENDPOINT_URL') or None)
+        return ObjectStorage(root, client, config['STORAGE_BUCKET'])
+    if backend == 'directory':
+        return ObjectStorage(root, DirectoryObjectClient(config['STORAGE_DIRECTORY']), config['STORAGE_BUCKET'])
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def init_storage(app):
+    """Initialize the storage backend with the Flask app"""
+    app.extensions['storage'] = create_storage(app.config)
+    app.cli.add_command(migrate_storage_command)
+    app.cli.add_command(reap_documents_command)
+    app.cli.add_command(compress_cold_versions_command)
+    app.cli.add_command(storage_tiers_command)
+
+@click.command('migrate-storage')
+@click.option('--dry-run', is_flag=True, help='Only report what would be migrated.')
+@with_appcontext
+def migrate_storage_command(dry_run):
+    """Move files recorded by file path (rather than storage key) into the storage backend and store their keys"""
+    storage = get_storage()
+
+    # A document and its first version share a file, so group rows by path.
+    # Keys cannot be told apart from paths in SQL, so every row is checked here.
+    rows_by_path = {}
+    for model in (Document, DocumentVersion):
+        for row in model.query.all():
+            if not storage.is_key(row.file_path):
+                rows_by_path.setdefault(row.file_path, []).append(row)
+
+    migrated = missing = 0
+    for value, rows in rows_by_path.items():
+        path = storage.legacy_path(value)
+        if not os.path.exists(path):
+            click.echo(f'Missing file, skipped: {value}')
+            missing += 1
+            continue
+        if dry_run:
+            click.echo(f'{value} -> {storage.key_for(path)}')
+        else:
+            key = storage.store(path)
+            for row in rows:
+                row.file_path = key
+            # Commit per file so an interruption never leaves rows pointing at a moved file
+            db.session.commit()
+        migrated += 1
+
+    click.echo(f"{'Would migrate' if dry_run else 'Migrated'} {migrated} files ({missing} missing).")
+
+@click.command('reap-documents')
+@with_appcontext
+def reap_documents_command():
+    """Remove the rows and files of every deleted document left by earlier reaper runs"""
+    result = reap_documents()
+    click.echo(f"Removed {result['documents']} documents and {result['files_deleted']} files, "
+               f"reclaimed {result['bytes_reclaimed']} bytes ({len(result['failed'])} failed).")
+
+@click.command('compress-cold-versions')
+@with_appcontext
+def compress_cold_versions_command():
+    """Compress version files not accessed for COLD_AFTER_DAYS days (all but each document's latest version)"""
+    result = compress_cold_versions()
+    click.echo(f"Compressed {result['files']} files from {result['bytes_before']} to {result['bytes_after']} bytes "
+               f"({result['skipped']} not worth compressing, {len(result['failed'])} failed).")
+    _echo_tiers()
+
+@click.command('storage-tiers')
+@with_appcontext
+def storage_tiers_command():
+    """Report the hot (uncompressed) and cold (compressed) file and byte totals of the upload folder"""
+    _echo_tiers()
+
+def _echo_tiers():
+    tiers = storage_tiers(get_storage())
+    click.echo(f"Hot: {tiers['hot_files']} files, {tiers['hot_bytes']} bytes. "
+               f"Cold: {tiers['cold_files']} files, {tiers['cold_bytes']} bytes. "
+               f"Dictionaries: {tiers['dictionary_bytes']} bytes.")
@@ -0,0 +1,230 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models.db import db, Document, DocumentVersion
+from services.storage.base import StorageBackend, get_storage
+from services.storage.compression import (COLD_SUFFIXES, DICTIONARY_FOLDER, compress_file, dictionary_path,
+                                          file_digest, train_dictionary)
+from services.storage.local import ShardedLocalStorage
+
+class ColdTiering:
+    """
+    Service for compressing version files that have not been read for a while
+
+    Every file of a document except its latest version is a candidate once
+    neither read nor written for min_age_days. Files are never modified after
+    they are stored, so ShardedLocalStorage.local_path records reads in their
+    modification time (access times are not updated on noatime mounts, and
+    are updated by this service's own reads). With zstd, a dictionary is trained per document family (the files
+    of one document, which are mostly copies of each other) and used for a
+    file when it makes it smaller by at least dictionary_min_gain. Files are
+    only replaced by their compressed form when compression saves at least
+    min_saving and the compressed content checks out. Reads promote files
+    back to hot (see ShardedLocalStorage.local_path); a file read while it
+    was being compressed is kept hot.
+    """
+
+    def __init__(self, storage: StorageBackend, codec: str = 'xz', level: Optional[int] = None,
+                 min_age_days: float = 30, use_dictionary: bool = True, dictionary_size: int = 112 * 1024,
+                 dictionary_min_gain: float = 0.05, min_saving: float = 0.05):
+        """
+        Args:
+            storage: Storage backend (only the local backend keeps cold files)
+            codec: 'zstd' (needs the zstandard package) or 'xz'
+            level: Compression level (codec default if None)
+            min_age_days: Days without access before a file is compressed
+            use_dictionary: Whether to try family dictionaries (zstd only)
+            dictionary_size: Size of a trained dictionary in bytes
+            dictionary_min_gain: Fraction a dictionary must save over plain compression
+            min_saving: Fraction compression must save for a file to go cold
+        """
+        if codec not in COLD_SUFFIXES:
+            raise ValueError(f"Unknown codec: {codec} (expected one of {', '.join(COLD_SUFFIXES)})")
+        self.storage = storage
+        self.codec = codec
+        self.level = level
+        self.min_age_days = min_age_days
+        self.use_dictionary = use_dictionary and codec == 'zstd'
+        self.dictionary_size = dictionary_size
+        self.dictionary_min_gain = dictionary_min_gain
+        self.min_saving = min_saving
+
+    def run(self, document_ids: Optional[List[int]] = None) -> Dict:
+        """
+        Compress the cold files of all (or the given) documents
+
+        Returns:
+            Dictionary with the files compressed and skipped, the bytes
+            before and after, the dictionaries stored, and the files that failed
+        """
+        if not isinstance(self.storage, ShardedLocalStorage):
+            raise ValueError("Cold compression is only available with the local storage backend")
+
+        result = {'files': 0, 'skipped': 0, 'bytes_before': 0, 'bytes_after': 0, 'dictionaries': 0, 'failed': []}
+        cutoff = time.time() - self.min_age_days * 86400
+        for document_id, (keys, latest_key) in self._families(document_ids).items():
+            paths = [self.storage.working_path(key) for key in keys]
+            candidates = [path for path in paths
+                          if path != self.storage.working_path(latest_key) and self._is_cold(path, cutoff)]
+            if candidates:
+                self._compress_family(candidates, [path for path in paths if os.path.exists(path)], cutoff, result)
+        return result
+
+    def _families(self, document_ids: Optional[List[int]]) -> Dict[int, tuple]:
+        """Storage keys of every document (its original and versions) and the key of its latest version"""
+        families = {}
+        query = select(Document.id, Document.file_path)
+        if document_ids is not None:
+            query = query.where(Document.id.in_(document_ids))
+        for document_id, key in db.session.execute(query):
+            families[document_id] = ({key}, key)
+
+        latest = (select(DocumentVersion.document_id, func.max(DocumentVersion.version_number).label('number'))
+                  .group_by(DocumentVersion.document_id).subquery())
+        query = (select(DocumentVersion.document_id, DocumentVersion.file_path,
+                        DocumentVersion.version_number == latest.c.number)
+                 .join(latest, latest.c.document_id == DocumentVersion.document_id))
+        if document_ids is not None:
+            query = query.where(DocumentVersion.document_id.in_(document_ids))
+        for document_id, key, is_latest in db.session.execute(query):
+            if document_id not in families:
+                # Deleted document, left to the reaper
+                continue
+            keys, latest_key = families[document_id]
+            keys.add(key)
+            if is_latest:
+                families[document_id] = (keys, key)
+
+        # Legacy absolute paths are left alone; `flask migrate-storage` turns them into keys first
+        return {document_id: ({key for key in keys if self.storage.is_key(key)}, latest_key)
+                for document_id, (keys, latest_key) in families.items()}
+
+    def _is_cold(self, path: str, cutoff: float) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Already cold, or missing
+            return False
+        return stat.st_mtime < cutoff
+
+    def _compress_family(self, candidates: List[str], family: List[str], cutoff: float, result: Dict) -> None:
+        dictionary = None
+        if self.use_dictionary:
+            dictionary = train_dictionary(family, self.dictionary_size)
+        dictionary_used = False
+
+        for path in candidates:
+            try:
+                size = os.path.getsize(path)
+                cold_path = compress_file(path, self.codec, self.level)
+                if dictionary:
+                    plain_size = os.path.getsize(cold_path)
+                    os.replace(cold_path, cold_path + '.plain')
+                    cold_path = compress_file(path, self.codec, self.level, dictionary[1])
+                    if os.path.getsize(cold_path) <= plain_size * (1 - self.dictionary_min_gain):
+                        os.remove(cold_path + '.plain')
+                        if not dictionary_used:
+                            self._store_dictionary(*dictionary)
+                            dictionary_used = True
+                            result['dictionaries'] += 1
+                    else:
+                        os.replace(cold_path + '.plain', cold_path)
+
+                compressed_size = os.path.getsize(cold_path)
+                # Keep files hot that hardly compress, and leave them alone for another min_age_days
+                if compressed_size > size * (1 - self.min_saving):
+                    os.remove(cold_path)
+                    os.utime(path)
+                    result['skipped'] += 1
+                    continue
+                if file_digest(cold_path, cold_path, self._dictionary_folder) != file_digest(path):
+                    os.remove(cold_path)
+                    raise ValueError("The compressed file does not match the original")
+
+                if not self._retire(path, cold_path, cutoff):
+                    result['skipped'] += 1
+                    continue
+                result['files'] += 1
+                result['bytes_before'] += size
+                result['bytes_after'] += compressed_size
+            except Exception as e:
+                current_app.logger.error(f"Could not compress {path}: {e}")
+                result['failed'].append({'path': os.path.relpath(path, self.storage.root), 'error': str(e)})
+
+    def _retire(self, path: str, cold_path: str, cutoff: float) -> bool:
+        """
+        Replace a hot file by its compressed form, unless it was read meanwhile
+
+        The hot file is first renamed away in one step, so from then on readers
+        find it missing and promote the compressed form (see
+        ShardedLocalStorage.local_path). A read recorded before the rename
+        shows in the renamed file's modification time; the reader may still
+        hold the hot path, so the file is put back and stays hot.
+
+        Returns:
+            Whether the file went cold
+        """
+        retired_path = path + '.retired'
+        os.rename(path, retired_path)
+        if os.stat(retired_path).st_mtime < cutoff:
+            os.remove(retired_path)
+            return True
+
+        os.replace(retired_path, path)
+        try:
+            os.remove(cold_path)
+        except FileNotFoundError:
+            # A reader promoted the compressed form in the meantime
+            pass
+        return False
+
+    @property
+    def _dictionary_folder(self) -> str:
+        return os.path.join(self.storage.root, DICTIONARY_FOLDER)
+
+    def _store_dictionary(self, dict_id: int, data: bytes) -> None:
+        os.makedirs(self._dictionary_folder, exist_ok=True)
+        path = dictionary_path(self._dictionary_folder, dict_id)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(data)
+
+def storage_tiers(storage: StorageBackend) -> Dict:
+    """
+    Hot and cold byte totals of the files in the upload folder
+
+    Returns:
+        Dictionary with the number of files and bytes on disk, hot and cold,
+        and the bytes of the stored dictionaries
+    """
+    totals = {'hot_files': 0, 'hot_bytes': 0, 'cold_files': 0, 'cold_bytes': 0, 'dictionary_bytes': 0}
+    cold_suffixes = tuple(COLD_SUFFIXES.values())
+    for directory, subdirectories, files in os.walk(storage.root):
+        in_dictionaries = os.path.basename(directory) == DICTIONARY_FOLDER
+        for name in files:
+            if name.endswith(('.tmp', '.plain', '.retired')):
+                continue
+            try:
+                size = os.path.getsize(os.path.join(directory, name))
+            except FileNotFoundError:
+                continue
+            if in_dictionaries:
+                totals['dictionary_bytes'] += size
+            elif name.endswith(cold_suffixes):
+                totals['cold_files'] += 1
+                totals['cold_bytes'] += size
+            else:
+                totals['hot_files'] += 1
+                totals['hot_bytes'] += size
+    return totals
+
+def compress_cold_versions(document_ids: Optional[List[int]] = None) -> Dict:
+    """Compress cold version files with the app's storage and settings (job entry point)"""
+    config = current_app.config
+    tiering = ColdTiering(get_storage(), config['COLD_CODEC'], config['COLD_LEVEL'], config['COLD_AFTER_DAYS'],
+                          config['COLD_DICTIONARY'], min_saving=config['COLD_MIN_SAVING'])
+    return tiering.run(document_ids)